@@ -0,0 +1,289 @@
+"""
+Асинхронный доступ к БД для ASGI-режима вебаппа (webapp/asgi.py).
+
+Зеркало db.py на psycopg 3: тот же API (fetchone / fetchall / execute /
+execute_returning_one, unit of work, on_commit / after_transaction), только
+с await. Запросы и параметры те же (%s, %(name)s), строки — словари,
+поэтому SQL из services.py используется как есть.
+
+Соединения живут в AsyncConnectionPool в режиме autocommit; размеры пула
+и таймауты — те же переменные окружения DB_POOL_*, что у синхронного пула.
+Пока запрос ждёт ответа БД, event loop обслуживает другие запросы.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+import psycopg
+from psycopg.conninfo import make_conninfo
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+try:
+    from db import POOL_IDLE_TIMEOUT, POOL_MAX_SIZE, POOL_MIN_SIZE, POOL_WAIT_TIMEOUT
+    from metrics import skip_frames_of, timed_query
+except ModuleNotFoundError:
+    from tgbot.db import POOL_IDLE_TIMEOUT, POOL_MAX_SIZE, POOL_MIN_SIZE, POOL_WAIT_TIMEOUT
+    from tgbot.metrics import skip_frames_of, timed_query
+
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых соединение может быть мёртвым (см. connection_lost)
+CONNECTION_ERRORS = (psycopg.OperationalError, psycopg.InterfaceError)
+
+skip_frames_of(__file__)
+
+
+def connection_lost(exc: Exception, conn=None) -> bool:
+    """Как db.connection_lost: InterfaceError, закрытое соединение или SQLSTATE класса 08."""
+    if isinstance(exc, psycopg.InterfaceError):
+        return True
+    if conn is not None and conn.closed:
+        return True
+    return (getattr(exc, "sqlstate", None) or "").startswith("08")
+
+
+def conninfo() -> str:
+    """Параметры подключения из окружения — те же, что у db.connect()."""
+    return make_conninfo(
+        host=os.getenv("DB_HOST", "127.0.0.1"),
+        port=int(os.getenv("DB_PORT", "5432")),
+        dbname=os.getenv("DB_NAME", "lovebot"),
+        user=os.getenv("DB_USER", "postgres"),
+        password=os.getenv("DB_PASSWORD"),
+    )
+
+
+async def _configure(conn: psycopg.AsyncConnection) -> None:
+    await conn.set_autocommit(True)
+
+
+async def _reset(conn: psycopg.AsyncConnection) -> None:
+    # пул сам откатывает незавершённую транзакцию; возвращаем autocommit
+    if not conn.autocommit:
+        await conn.set_autocommit(True)
+
+
+_pool: Optional[AsyncConnectionPool] = None
+
+
+def get_pool() -> AsyncConnectionPool:
+    if _pool is None:
+        raise RuntimeError("async pool is not initialised: call adb.init_pool() on startup")
+    return _pool
+
+
+async def init_pool() -> AsyncConnectionPool:
+    """Открыть пул и дождаться min_size соединений. Вызывается на старте event loop."""
+    global _pool
+    if _pool is None:
+        _pool = AsyncConnectionPool(
+            conninfo(),
+            min_size=max(1, POOL_MIN_SIZE),
+            max_size=max(1, POOL_MAX_SIZE, POOL_MIN_SIZE),
+            max_idle=POOL_IDLE_TIMEOUT,
+            timeout=POOL_WAIT_TIMEOUT,
+            kwargs={"row_factory": dict_row},
+            configure=_configure,
+            reset=_reset,
+            open=False,
+        )
+        await _pool.open(wait=True)
+    return _pool
+
+
+async def close_pool() -> None:
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def pool_stats() -> dict:
+    if _pool is None:
+        return {}
+    stats = _pool.get_stats()
+    return {
+        "size": stats.get("pool_size", 0),
+        "idle": stats.get("pool_available", 0),
+        "in_use": stats.get("pool_size", 0) - stats.get("pool_available", 0),
+        "max_size": _pool.max_size,
+    }
+
+
+# ===== Unit of work =====
+# Как в db.py: одно соединение и одна транзакция на запрос, COMMIT в конце.
+# Контекст — ContextVar, а у asyncio он свой у каждой задачи (запроса).
+
+
+class UnitOfWork:
+    def __init__(self, pool: AsyncConnectionPool) -> None:
+        self._pool = pool
+        self.conn: Optional[psycopg.AsyncConnection] = None
+        self.after_commit = []
+        self.after_end = []
+
+    async def connection(self) -> psycopg.AsyncConnection:
+        if self.conn is None:
+            conn = await self._pool.getconn()
+            await conn.set_autocommit(False)
+            self.conn = conn
+        return self.conn
+
+    async def commit(self) -> None:
+        if self.conn is not None:
+            with timed_query("db.commit"):
+                await self.conn.commit()
+
+    async def rollback(self) -> None:
+        if self.conn is not None:
+            await self.conn.rollback()
+
+    async def release(self) -> None:
+        if self.conn is None:
+            return
+        conn, self.conn = self.conn, None
+        # битое соединение пул закроет сам
+        await self._pool.putconn(conn)
+
+    def run_callbacks(self, committed: bool) -> None:
+        callbacks = (self.after_commit if committed else []) + self.after_end
+        self.after_commit, self.after_end = [], []
+        for fn in callbacks:
+            try:
+                fn()
+            except Exception:
+                logger.exception("after-commit callback failed")
+
+
+_current_uow: ContextVar[Optional[UnitOfWork]] = ContextVar("current_async_uow", default=None)
+
+
+def begin_unit_of_work() -> Optional[UnitOfWork]:
+    """Открыть unit of work в текущей задаче; None — уже открыт (вложенный блок)."""
+    if _current_uow.get() is not None:
+        return None
+    uow = UnitOfWork(get_pool())
+    _current_uow.set(uow)
+    return uow
+
+
+async def end_unit_of_work(uow: Optional[UnitOfWork], commit: bool = True) -> None:
+    """Закрыть unit of work: COMMIT (или ROLLBACK при commit=False) и вернуть соединение."""
+    if uow is None:
+        return
+    committed = False
+    try:
+        if commit:
+            await uow.commit()
+            committed = True
+        else:
+            await uow.rollback()
+    finally:
+        await uow.release()
+        if _current_uow.get() is uow:
+            _current_uow.set(None)
+        uow.run_callbacks(committed)
+
+
+def on_commit(fn) -> None:
+    """Вызвать fn после COMMIT текущего unit of work (вне его — сразу)."""
+    uow = _current_uow.get()
+    if uow is None:
+        fn()
+    else:
+        uow.after_commit.append(fn)
+
+
+def after_transaction(fn) -> None:
+    """Вызвать fn по окончании текущего unit of work — COMMIT или ROLLBACK (вне его — сразу)."""
+    uow = _current_uow.get()
+    if uow is None:
+        fn()
+    else:
+        uow.after_end.append(fn)
+
+
+@asynccontextmanager
+async def unit_of_work():
+    """
+    async with unit_of_work():
+        ...  # все запросы — одна транзакция
+    """
+    uow = begin_unit_of_work()
+    try:
+        yield
+    except BaseException:
+        await end_unit_of_work(uow, commit=False)
+        raise
+    await end_unit_of_work(uow)
+
+
+@asynccontextmanager
+async def get_conn():
+    uow = _current_uow.get()
+    if uow is not None:
+        yield await uow.connection()
+        return
+
+    async with get_pool().connection() as conn:
+        yield conn
+
+
+async def _run_read(query, params, fetch):
+    # вне транзакции чтение безопасно повторить один раз (соединение могло умереть)
+    # таймаут или deadlock не повторяем — упал запрос, а не соединение
+    attempts = 1 if _current_uow.get() is not None else 2
+    timer = timed_query()
+    for attempt in range(attempts):
+        conn = None
+        try:
+            async with get_conn() as conn:
+                async with conn.cursor() as cur:
+                    with timer:
+                        await cur.execute(query, params or ())
+                        return await fetch(cur)
+        except CONNECTION_ERRORS as e:
+            if attempt + 1 == attempts or not connection_lost(e, conn):
+                raise
+
+
+async def fetchone(query, params=None):
+    return await _run_read(query, params, lambda cur: cur.fetchone())
+
+
+async def fetchall(query, params=None):
+    return await _run_read(query, params, lambda cur: cur.fetchall())
+
+
+async def execute(query, params=None):
+    timer = timed_query()
+    async with get_conn() as conn:
+        async with conn.cursor() as cur:
+            with timer:
+                await cur.execute(query, params or ())
+
+
+async def execute_returning_one(query, params=None):
+    timer = timed_query()
+    async with get_conn() as conn:
+        async with conn.cursor() as cur:
+            with timer:
+                await cur.execute(query, params or ())
+                return await cur.fetchone()
+
+
+async def execute_returning_all(query, params=None):
+    """Запись с RETURNING на много строк — как db.execute_returning_all, без повтора."""
+    timer = timed_query()
+    async with get_conn() as conn:
+        async with conn.cursor() as cur:
+            with timer:
+                await cur.execute(query, params or ())
+                return await cur.fetchall()
@@ -0,0 +1,82 @@
+"""
+Асинхронные версии функций services.py для ASGI-режима вебаппа.
+
+Только то, что нужно горячим эндпоинтам webapp/asgi.py. SQL, разбор
+результатов и in-process кэши (пользователи, пары) — общие с services.py,
+здесь только await вместо синхронных вызовов БД.
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, Optional
+
+try:
+    from adb import after_transaction, execute, execute_returning_one, fetchone, on_commit
+    import services
+except ModuleNotFoundError:
+    from tgbot.adb import after_transaction, execute, execute_returning_one, fetchone, on_commit
+    from tgbot import services
+
+
+async def get_or_create_user(tg_user) -> int:
+    user_id = services.cached_user_id(tg_user)
+    if user_id is not None:
+        return user_id
+
+    row = await execute_returning_one(
+        services.UPSERT_USER_SQL, (tg_user.id, *services.user_profile(tg_user))
+    )
+    user_id = row["id"]
+    on_commit(lambda: services.remember_user(tg_user, user_id))
+    return user_id
+
+
+async def get_user_id_by_telegram_id(telegram_id: int) -> Optional[int]:
+    user_id = services.cached_user_id_by_telegram_id(telegram_id)
+    if user_id is not None:
+        return user_id
+    row = await fetchone("SELECT id FROM users WHERE telegram_id = %s", (telegram_id,))
+    return row["id"] if row else None
+
+
+async def get_pair_by_user(user_id: int) -> Optional[Dict[str, Any]]:
+    known, pair = services.cached_pair_by_user(user_id)
+    if known:
+        return pair
+
+    user_gen, pair_gen = services.pair_cache_generations()
+    pair = await fetchone(services.PAIR_BY_USER_SQL, (user_id, user_id))
+    return services.cache_pair_lookup(user_id, pair, user_gen, pair_gen)
+
+
+def invalidate_pair_cache(pair_id: Optional[int] = None, user_ids=()) -> None:
+    def drop() -> None:
+        services.drop_pair_cache(pair_id, user_ids)
+
+    drop()
+    after_transaction(drop)
+
+
+async def bump_pair_version(pair_id: int, entity: Optional[str] = None, entity_ids=()) -> None:
+    await execute(*services.bump_version_statement(pair_id, entity, entity_ids))
+    invalidate_pair_cache(pair_id)
+
+
+async def add_wishlist_item(pair_id: int, owner_user_id: int, title: str, description: Optional[str] = None):
+    item = await execute_returning_one(
+        services.ADD_WISHLIST_ITEM_SQL, (pair_id, owner_user_id, title, description)
+    )
+    await bump_pair_version(pair_id, "wishlist_items", [item["id"]])
+    return item
+
+
+async def get_dashboard(user_id: int) -> Optional[Dict[str, Any]]:
+    row = await fetchone(services.DASHBOARD_SQL, {"user_id": user_id})
+    return services.dashboard_from_row(row)
+
+
+async def get_pair_changes(pair_id: int, user_id: int, since: int) -> Optional[Dict[str, Any]]:
+    row = await fetchone(
+        services.PAIR_CHANGES_SQL, {"pair_id": pair_id, "user_id": user_id, "since": since}
+    )
+    return services.pair_changes_from_row(row, since)
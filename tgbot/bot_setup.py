@@ -7,18 +7,50 @@ from __future__ import annotations
 
 from typing import Dict, Optional, Union
 
+import logging
+
 import telebot
 from telebot import types
+from telebot.handler_backends import BaseMiddleware
 
 try:
     from config import BOT_TOKEN
+    from db import begin_unit_of_work, end_unit_of_work
 except ModuleNotFoundError:
     from tgbot.config import BOT_TOKEN
+    from tgbot.db import begin_unit_of_work, end_unit_of_work
+
+
+logger = logging.getLogger(__name__)
 
 
 # === Экземпляр бота ===
 
-bot = telebot.TeleBot(BOT_TOKEN, parse_mode="HTML")
+bot = telebot.TeleBot(BOT_TOKEN, parse_mode="HTML", use_class_middlewares=True)
+
+
+class UnitOfWorkMiddleware(BaseMiddleware):
+    """
+    Каждый апдейт обрабатывается в одном unit of work:
+    все запросы хендлера идут через одно соединение и коммитятся один раз в конце.
+    Если хендлер упал — транзакция откатывается.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.update_types = ["message", "callback_query"]
+
+    def pre_process(self, message, data) -> None:
+        data["uow"] = begin_unit_of_work()
+
+    def post_process(self, message, data, exception) -> None:
+        try:
+            end_unit_of_work(data.get("uow"), commit=exception is None)
+        except Exception as e:
+            logger.error("Failed to commit update transaction: %s", e)
+
+
+bot.setup_middleware(UnitOfWorkMiddleware())
 
 # Временные действия пользователя: что он сейчас вводит
 pending_actions: Dict[int, str] = {}
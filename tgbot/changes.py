@@ -0,0 +1,141 @@
+"""
+Межпроцессные уведомления об изменениях (Postgres LISTEN/NOTIFY).
+
+Триггеры из migrations/0003_change_notify.sql шлют NOTIFY в канал
+fambot_changes на каждую запись в pairs / wishlist_items / notes.
+В каждом процессе (бот, вебапп) работает поток-слушатель, который раздаёт
+события подписчикам — например, сервисный слой сбрасывает по ним кэш пар.
+Так процессы могут кэшировать данные, не расходясь друг с другом,
+без внешнего брокера.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import select
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    from db import connect
+except ModuleNotFoundError:
+    from tgbot.db import connect
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "fambot_changes"
+
+# Как часто проверять живость LISTEN-соединения, если событий нет (сек.)
+KEEPALIVE_INTERVAL = 30.0
+MAX_RECONNECT_DELAY = 60.0
+
+Event = Dict[str, Any]
+
+_subscribers: Dict[str, List[Callable[[Event], None]]] = defaultdict(list)
+_reset_subscribers: List[Callable[[], None]] = []
+
+
+def subscribe(entity: str, fn: Callable[[Event], None]) -> None:
+    """Подписаться на изменения таблицы entity ("pairs", "wishlist_items", "notes" или "*")."""
+    _subscribers[entity].append(fn)
+
+
+def subscribe_reset(fn: Callable[[], None]) -> None:
+    """
+    Подписаться на (пере)подключение слушателя. Пока соединения не было,
+    события могли потеряться — подписчик должен сбросить всё, что кэширует.
+    """
+    _reset_subscribers.append(fn)
+
+
+def dispatch(payload: str) -> None:
+    try:
+        event = json.loads(payload)
+    except ValueError:
+        logger.warning("Bad change payload: %r", payload)
+        return
+
+    for fn in _subscribers.get(event.get("entity"), []) + _subscribers.get("*", []):
+        try:
+            fn(event)
+        except Exception:
+            logger.exception("Change subscriber failed for %s", event)
+
+
+def _reset() -> None:
+    for fn in _reset_subscribers:
+        try:
+            fn()
+        except Exception:
+            logger.exception("Change reset subscriber failed")
+
+
+class ChangeListener(threading.Thread):
+    """Поток, который держит отдельное соединение с LISTEN и переподключается при обрыве."""
+
+    def __init__(self) -> None:
+        super().__init__(name="change-listener", daemon=True)
+        self._stop_event = threading.Event()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def run(self) -> None:
+        delay = 1.0
+        while not self._stop_event.is_set():
+            conn = None
+            try:
+                conn = connect()
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CHANNEL}")
+                _reset()
+                delay = 1.0
+                self._listen(conn)
+            except Exception as e:
+                logger.warning("Change listener disconnected: %s", e)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            if not self._stop_event.wait(delay):
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    def _listen(self, conn) -> None:
+        last_check = time.monotonic()
+        while not self._stop_event.is_set():
+            ready, _, _ = select.select([conn], [], [], 5.0)
+            if ready:
+                conn.poll()
+                while conn.notifies:
+                    dispatch(conn.notifies.pop(0).payload)
+                last_check = time.monotonic()
+            elif time.monotonic() - last_check >= KEEPALIVE_INTERVAL:
+                # полуоткрытое TCP-соединение само не «проснётся» — проверяем запросом
+                with conn.cursor() as cur:
+                    cur.execute("SELECT 1")
+                last_check = time.monotonic()
+
+
+_listener: Optional[ChangeListener] = None
+_listener_pid: Optional[int] = None
+_listener_lock = threading.Lock()
+
+
+def start_listener() -> None:
+    """Запустить слушателя в этом процессе (повторный вызов ничего не делает; безопасно после fork)."""
+    global _listener, _listener_pid
+    if _listener is not None and _listener_pid == os.getpid():
+        return
+    with _listener_lock:
+        if _listener is not None and _listener_pid == os.getpid():
+            return
+        _listener = ChangeListener()
+        _listener_pid = os.getpid()
+        _listener.start()
@@ -1,15 +1,69 @@
+"""
+Подключение к БД: пул соединений, общий для бота, веб-приложения и нотифаера.
+
+Соединения живут в пуле в режиме autocommit: одиночный запрос — это один
+round trip без отдельного COMMIT. Пул потокобезопасен, держит от
+DB_POOL_MIN до DB_POOL_MAX соединений, закрывает простаивающие дольше
+DB_POOL_IDLE_TIMEOUT секунд и перед выдачей проверяет соединение, которое
+не использовалось дольше DB_POOL_CHECK_AFTER секунд (например, после
+рестарта Postgres).
+"""
+
+import atexit
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
-from contextlib import contextmanager
-import os
 try:
     from config import DATABASE_URL
+    from metrics import skip_frames_of, timed_query
 except ModuleNotFoundError:
     from tgbot.config import DATABASE_URL
+    from tgbot.metrics import skip_frames_of, timed_query
 
 
-@contextmanager
-def get_conn():
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN", "1"))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX", "10"))
+POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))
+POOL_CHECK_AFTER = float(os.getenv("DB_POOL_CHECK_AFTER", "30"))
+POOL_WAIT_TIMEOUT = float(os.getenv("DB_POOL_WAIT_TIMEOUT", "10"))
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых соединение может быть мёртвым (см. connection_lost)
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+# метрики запросов помечаются функцией, вызвавшей fetchone / execute, а не этим модулем
+skip_frames_of(__file__)
+
+
+def connection_lost(exc: Exception, conn=None) -> bool:
+    """
+    Соединение действительно умерло: InterfaceError, закрытое соединение или
+    SQLSTATE класса 08. OperationalError — это ещё и statement_timeout,
+    deadlock, serialization failure: соединение после них живо, а запрос
+    повторять нельзя (он только что упал по таймауту или конфликту).
+    """
+    if isinstance(exc, psycopg2.InterfaceError):
+        return True
+    if conn is not None and conn.closed:
+        return True
+    return (getattr(exc, "pgcode", None) or "").startswith("08")
+
+
+class PoolTimeout(Exception):
+    """Свободное соединение не освободилось за DB_POOL_WAIT_TIMEOUT секунд."""
+
+
+def connect():
+    """Открыть новое соединение с параметрами из окружения."""
     conn = psycopg2.connect(
         host=os.getenv("DB_HOST", "127.0.0.1"),
         port=int(os.getenv("DB_PORT", "5432")),
@@ -17,36 +71,445 @@ def get_conn():
         user=os.getenv("DB_USER", "postgres"),
         password=os.getenv("DB_PASSWORD"),
     )
+    conn.autocommit = True
+    return conn
+
+
+class ConnectionPool:
+    """
+    Потокобезопасный пул соединений psycopg2.
+
+    Свободные соединения хранятся стеком (последнее возвращённое выдаётся
+    первым), поэтому «лишние» соединения остаются внизу стека и со временем
+    закрываются по idle_timeout.
+    """
+
+    def __init__(
+        self,
+        connect_fn=connect,
+        min_size: int = POOL_MIN_SIZE,
+        max_size: int = POOL_MAX_SIZE,
+        idle_timeout: float = POOL_IDLE_TIMEOUT,
+        check_after: float = POOL_CHECK_AFTER,
+        wait_timeout: float = POOL_WAIT_TIMEOUT,
+    ) -> None:
+        self._connect = connect_fn
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self.wait_timeout = wait_timeout
+
+        self._cond = threading.Condition()
+        self._idle = []  # [(conn, last_used_monotonic)]
+        self._size = 0  # открытые соединения: свободные + выданные
+        self._pid = os.getpid()
+
+    # --- выдача / возврат ---
+
+    def getconn(self):
+        """Взять соединение из пула (или открыть новое, если есть место)."""
+        deadline = time.monotonic() + self.wait_timeout
+        with self._cond:
+            self._check_fork()
+            while True:
+                self._evict_idle()
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(
+                        f"no free connection in {self.wait_timeout}s "
+                        f"(max_size={self.max_size})"
+                    )
+                self._cond.wait(remaining)
+
+        if conn is not None and self._is_healthy(conn, last_used):
+            return conn
+
+        # Нового соединения ещё нет, либо старое умерло — открываем взамен,
+        # место в пуле уже зарезервировано.
+        if conn is not None:
+            self._close_quietly(conn)
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def putconn(self, conn, broken: bool = False) -> None:
+        """Вернуть соединение в пул. broken=True — закрыть и не переиспользовать."""
+        if not broken and not conn.closed:
+            try:
+                if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if not conn.autocommit:
+                    conn.autocommit = True
+            except CONNECTION_ERRORS as e:
+                broken = connection_lost(e, conn)
+
+        with self._cond:
+            if os.getpid() != self._pid:
+                # соединение от родительского процесса — не трогаем
+                return
+            if broken or conn.closed:
+                self._size -= 1
+                self._close_quietly(conn)
+                # Скорее всего, сервер перезапускался: остальные свободные
+                # соединения проверим перед следующей выдачей.
+                self._idle = [(c, float("-inf")) for c, _ in self._idle]
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    # --- обслуживание ---
+
+    def fill(self) -> None:
+        """Заранее открыть min_size соединений (чтобы первый запрос не ждал handshake)."""
+        conns = []
+        try:
+            while True:
+                with self._cond:
+                    if self._size >= self.min_size:
+                        break
+                conns.append(self.getconn())
+        finally:
+            for conn in conns:
+                self.putconn(conn)
+
+    def closeall(self) -> None:
+        with self._cond:
+            for conn, _ in self._idle:
+                self._close_quietly(conn)
+            self._size -= len(self._idle)
+            self._idle = []
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "max_size": self.max_size,
+            }
+
+    def _is_healthy(self, conn, last_used: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except CONNECTION_ERRORS:
+            return False
+
+    def _evict_idle(self) -> None:
+        """Закрыть соединения, простаивающие дольше idle_timeout (сверх min_size)."""
+        if not self._idle or self.idle_timeout <= 0:
+            return
+        now = time.monotonic()
+        while self._idle and self._size > self.min_size:
+            conn, last_used = self._idle[0]
+            if now - last_used < self.idle_timeout:
+                break
+            self._idle.pop(0)
+            self._size -= 1
+            self._close_quietly(conn)
+
+    def _check_fork(self) -> None:
+        """После fork (gunicorn и т.п.) соединения родителя использовать нельзя."""
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self._idle = []
+            self._size = 0
+
+    @staticmethod
+    def _close_quietly(conn) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Единый пул процесса (создаётся при первом обращении)."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def init_pool() -> ConnectionPool:
+    """Создать пул и прогреть min_size соединений. Вызывается на старте процесса."""
+    pool = get_pool()
+    pool.fill()
+    return pool
+
+
+def close_pool() -> None:
+    if _pool is not None:
+        _pool.closeall()
+
+
+atexit.register(close_pool)
+
+
+# ===== Unit of work =====
+#
+# Внутри unit of work все fetchone/execute идут через одно соединение
+# в одной транзакции, COMMIT — один раз в конце. Вебапп открывает его на
+# каждый Flask-запрос, бот — на каждый апдейт (см. bot_setup.py).
+# Соединение берётся из пула лениво, при первом запросе к БД.
+
+
+class UnitOfWork:
+    def __init__(self, pool: ConnectionPool, isolation: Optional[str] = None) -> None:
+        self._pool = pool
+        # уровень изоляции транзакции ("REPEATABLE READ, READ ONLY" и т.п.); None — по умолчанию БД
+        self.isolation = isolation
+        self.conn = None
+        self.broken = False
+        self.after_commit = []  # колбэки, которые нужно вызвать после COMMIT
+        self.after_end = []  # колбэки после COMMIT или ROLLBACK
+
+    def connection(self):
+        if self.conn is None:
+            conn = self._pool.getconn()
+            conn.autocommit = False
+            self.conn = conn
+            if self.isolation:
+                # первой командой транзакции; действует только до её конца
+                with conn.cursor() as cur:
+                    self._guard(lambda: cur.execute(f"SET TRANSACTION ISOLATION LEVEL {self.isolation}"))
+        return self.conn
+
+    def commit(self) -> None:
+        if self.conn is not None:
+            with timed_query("db.commit"):
+                self._guard(self.conn.commit)
+
+    def rollback(self) -> None:
+        if self.conn is not None:
+            self._guard(self.conn.rollback)
+
+    def release(self) -> None:
+        """Откатить незакоммиченное и вернуть соединение в пул."""
+        if self.conn is None:
+            return
+        conn, self.conn = self.conn, None
+        self._pool.putconn(conn, broken=self.broken)
+
+    def run_callbacks(self, committed: bool) -> None:
+        callbacks = (self.after_commit if committed else []) + self.after_end
+        self.after_commit, self.after_end = [], []
+        for fn in callbacks:
+            try:
+                fn()
+            except Exception:
+                logger.exception("after-commit callback failed")
+
+    def _guard(self, fn) -> None:
+        try:
+            fn()
+        except CONNECTION_ERRORS as e:
+            self.broken = self.broken or connection_lost(e, self.conn)
+            raise
+
+
+_current_uow: ContextVar[Optional[UnitOfWork]] = ContextVar("current_uow", default=None)
+
+
+def current_unit_of_work() -> Optional[UnitOfWork]:
+    return _current_uow.get()
+
+
+def begin_unit_of_work(isolation: Optional[str] = None) -> Optional[UnitOfWork]:
+    """
+    Открыть unit of work в текущем контексте (потоке).
+    Если он уже открыт — вернуть None: вложенный блок работает во внешней
+    транзакции (и с её уровнем изоляции).
+    isolation — уровень изоляции, например "REPEATABLE READ, READ ONLY":
+    все чтения блока видят один снимок БД.
+    """
+    if _current_uow.get() is not None:
+        return None
+    uow = UnitOfWork(get_pool(), isolation)
+    _current_uow.set(uow)
+    return uow
+
+
+def end_unit_of_work(uow: Optional[UnitOfWork], commit: bool = True) -> None:
+    """Закрыть unit of work: COMMIT (или ROLLBACK при commit=False) и вернуть соединение."""
+    if uow is None:
+        return
+    committed = False
+    try:
+        if commit:
+            uow.commit()
+            committed = True
+        else:
+            uow.rollback()
+    finally:
+        uow.release()
+        if _current_uow.get() is uow:
+            _current_uow.set(None)
+        uow.run_callbacks(committed)
+
+
+def on_commit(fn) -> None:
+    """
+    Вызвать fn после COMMIT текущего unit of work (при ROLLBACK — не вызывать).
+    Вне unit of work запрос уже закоммичен (autocommit), поэтому fn вызывается сразу.
+    Нужно для in-process кэшей: не класть в кэш то, что может откатиться.
+    """
+    uow = _current_uow.get()
+    if uow is None:
+        fn()
+    else:
+        uow.after_commit.append(fn)
+
+
+def after_transaction(fn) -> None:
+    """Вызвать fn, когда текущий unit of work завершится — COMMIT или ROLLBACK (вне его — сразу)."""
+    uow = _current_uow.get()
+    if uow is None:
+        fn()
+    else:
+        uow.after_end.append(fn)
+
+
+@contextmanager
+def unit_of_work(isolation: Optional[str] = None):
+    """
+    with unit_of_work():
+        ...  # все запросы — одна транзакция
+    """
+    uow = begin_unit_of_work(isolation)
+    try:
+        yield
+    except BaseException:
+        end_unit_of_work(uow, commit=False)
+        raise
+    end_unit_of_work(uow)
+
+
+@contextmanager
+def get_conn():
+    uow = _current_uow.get()
+    if uow is not None:
+        conn = uow.connection()
+        try:
+            yield conn
+        except CONNECTION_ERRORS as e:
+            uow.broken = uow.broken or connection_lost(e, conn)
+            raise
+        return
+
+    pool = get_pool()
+    conn = pool.getconn()
+    broken = False
     try:
         yield conn
+    except CONNECTION_ERRORS as e:
+        broken = connection_lost(e, conn)
+        raise
     finally:
-        conn.close()
+        pool.putconn(conn, broken=broken)
+
+
+def _run_read(query, params, fetch):
+    # Вне транзакции чтение безопасно повторить один раз: если соединение
+    # умерло (рестарт сервера), get_conn уже выбросил его из пула.
+    # Только для SELECT: UPDATE/INSERT/DELETE ... RETURNING мог закоммититься
+    # до обрыва — их выполняют execute_returning_one / execute_returning_all.
+    # Таймаут или deadlock не повторяем — соединение цело, запрос просто упал.
+    attempts = 1 if _current_uow.get() is not None else 2
+    timer = timed_query()
+    for attempt in range(attempts):
+        conn = None
+        try:
+            with get_conn() as conn:
+                with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                    with timer:
+                        cur.execute(query, params or ())
+                        return fetch(cur)
+        except CONNECTION_ERRORS as e:
+            if attempt + 1 == attempts or not connection_lost(e, conn):
+                raise
 
 
 def fetchone(query, params=None):
-    with get_conn() as conn:
-        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-            cur.execute(query, params or ())
-            return cur.fetchone()
+    return _run_read(query, params, lambda cur: cur.fetchone())
 
 
 def fetchall(query, params=None):
+    return _run_read(query, params, lambda cur: cur.fetchall())
+
+
+def iterate(query, params=None, itersize: int = 2000):
+    """
+    Потоково читать большой результат через серверный курсор: строки
+    приходят из БД пачками по itersize, в памяти держится одна пачка.
+    Вне unit of work соединение занято, пока генератор не дочитан или не закрыт.
+    """
     with get_conn() as conn:
-        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-            cur.execute(query, params or ())
-            return cur.fetchall()
+        # серверному курсору нужна транзакция
+        own_transaction = conn.autocommit
+        if own_transaction:
+            conn.autocommit = False
+        try:
+            with conn.cursor(name=f"iter_{id(conn)}_{time.monotonic_ns()}",
+                             cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                cur.itersize = itersize
+                with timed_query():
+                    cur.execute(query, params or ())
+                yield from cur
+        finally:
+            if own_transaction:
+                conn.rollback()
+                conn.autocommit = True
+
+
+# Коммит не нужен: вне unit of work соединение в autocommit,
+# внутри — коммитит end_unit_of_work.
 
 
 def execute(query, params=None):
     with get_conn() as conn:
         with conn.cursor() as cur:
-            cur.execute(query, params or ())
-        conn.commit()
+            with timed_query():
+                cur.execute(query, params or ())
 
 def execute_returning_one(query, params=None):
     with get_conn() as conn:
         with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-            cur.execute(query, params or ())
-            row = cur.fetchone()
-        conn.commit()
+            with timed_query():
+                cur.execute(query, params or ())
+                row = cur.fetchone()
     return row
+
+
+def execute_returning_all(query, params=None):
+    """Запись с RETURNING на много строк; без повтора при обрыве, в отличие от fetchall."""
+    with get_conn() as conn:
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            with timed_query():
+                cur.execute(query, params or ())
+                rows = cur.fetchall()
+    return rows
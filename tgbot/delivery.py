@@ -0,0 +1,67 @@
+"""
+Когда доставлять плановые уведомления (годовщины, красивые даты).
+
+У пользователя есть часовой пояс и предпочтительный час (users.timezone,
+users.notify_hour; NULL — значения по умолчанию). Событие дня D приходит
+каждому участнику пары в его местный день D: в выбранный час или, если час
+не выбран, в окно NOTIFIER_DEFAULT_HOURS. Минута внутри часа (и час внутри
+окна) — детерминированный хэш от (telegram_id, D): отправки равномерно
+размазаны по дню, а не уходят одним всплеском, и повторный расчёт даёт то
+же время.
+"""
+
+from __future__ import annotations
+
+import os
+import zlib
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# Часовой пояс пользователей, которые его не выбрали
+DEFAULT_TIMEZONE = os.getenv("NOTIFIER_DEFAULT_TZ", "Europe/Moscow")
+# Окно доставки по умолчанию: часы [начало, конец) местного времени
+DEFAULT_HOURS = tuple(int(h) for h in os.getenv("NOTIFIER_DEFAULT_HOURS", "10-21").split("-"))
+
+
+def is_valid_timezone(name: str) -> bool:
+    try:
+        ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+    return True
+
+
+def user_zone(name: Optional[str]) -> ZoneInfo:
+    """Часовой пояс пользователя; неизвестный или пустой — DEFAULT_TIMEZONE."""
+    if name and is_valid_timezone(name):
+        return ZoneInfo(name)
+    return ZoneInfo(DEFAULT_TIMEZONE)
+
+
+def delivery_time(telegram_id: int, day: date, tz_name: Optional[str] = None,
+                  notify_hour: Optional[int] = None) -> datetime:
+    """Момент доставки события дня day пользователю (aware, UTC)."""
+    spread = zlib.crc32(f"{telegram_id}:{day.isoformat()}".encode())
+    if notify_hour is None:
+        start, end = DEFAULT_HOURS
+        seconds = start * 3600 + spread % (max(end - start, 1) * 3600)
+    else:
+        seconds = notify_hour * 3600 + spread % 3600
+    local = datetime.combine(day, time(), tzinfo=user_zone(tz_name)) + timedelta(seconds=seconds)
+    return local.astimezone(timezone.utc)
+
+
+def local_day_end(day: date, tz_name: Optional[str] = None) -> datetime:
+    """Конец местного дня day (aware, UTC): позже событие дня уже не «сегодня»."""
+    local = datetime.combine(day + timedelta(days=1), time(), tzinfo=user_zone(tz_name))
+    return local.astimezone(timezone.utc)
+
+
+def describe(tz_name: Optional[str], notify_hour: Optional[int]) -> str:
+    """Настройки пользователя по-человечески: «с 9:00 до 10:00 (Europe/Berlin)»."""
+    if notify_hour is None:
+        start, end = DEFAULT_HOURS
+    else:
+        start, end = notify_hour, (notify_hour + 1) % 24
+    return f"с {start}:00 до {end}:00 ({tz_name or DEFAULT_TIMEZONE})"
@@ -0,0 +1,236 @@
+"""
+Выгрузка вишлиста в XLSX (а для скачивания — ещё в CSV и JSON) потоком.
+
+Строки идут из серверного курсора (services.iter_wishlist_export) прямо
+в write-only книгу openpyxl, которая пишет лист во временный файл, а готовый
+.xlsx собирается в SpooledTemporaryFile: небольшие файлы остаются в памяти,
+большие уходят на диск. Память не растёт с размером списка.
+
+Отправку в чат делает воркер outbox (задание kind='export'), а не запрос
+вебаппа. Готовый файл кэшируется по хэшу содержимого списка: после первой
+загрузки запоминается file_id, который вернул Telegram, и повторная выгрузка
+неизменённого списка — это пересылка по file_id без сборки и загрузки файла.
+
+Для скачивания из Mini App (/api/wishlist/export) stream_wishlist_export
+отдаёт файл кусками: CSV и JSON пишутся по мере чтения курсора, XLSX
+собирается в SpooledTemporaryFile и читается из него блоками.
+
+В XLSX ширины колонок (<cols>) идут перед строками, поэтому write-only книге
+они нужны до первой записи. Их считает БД оконными агрегатами в том же
+запросе, так что данные читаются один раз.
+"""
+
+from __future__ import annotations
+
+import csv
+import hashlib
+import io
+import json
+import os
+from tempfile import SpooledTemporaryFile
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font
+from openpyxl.utils import get_column_letter
+from telebot.apihelper import ApiTelegramException
+
+try:
+    from db import unit_of_work
+    from services import (
+        forget_export_file_id,
+        get_export_file_id,
+        get_wishlist_content_hash,
+        iter_wishlist_export,
+        save_export_file_id,
+    )
+except ModuleNotFoundError:
+    from tgbot.db import unit_of_work
+    from tgbot.services import (
+        forget_export_file_id,
+        get_export_file_id,
+        get_wishlist_content_hash,
+        iter_wishlist_export,
+        save_export_file_id,
+    )
+
+
+# До какого размера готовый файл держится в памяти (байт)
+EXPORT_SPOOL_MAX = int(os.getenv("EXPORT_SPOOL_MAX", str(4 * 1024 * 1024)))
+
+PRIORITY_LABELS = {"high": "Очень хочу", "medium": "Хочу", "low": "Несрочно"}
+HEADERS = ["Желание", "Приоритет", "Ссылка", "Создано"]
+
+MIN_WIDTH = 10
+MAX_WIDTH = 60
+
+# Меняйте при изменении вида файла — старые file_id перестанут подходить
+EXPORT_FORMAT_VERSION = 1
+EXPORT_FILENAME = "wishlist.xlsx"
+
+# Примерный размер куска потоковой выгрузки (байт)
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+# format -> (mimetype, расширение файла)
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "json": ("application/json; charset=utf-8", "json"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+}
+# Ключи объектов в JSON — те же колонки, что в CSV/XLSX
+JSON_KEYS = ["title", "priority", "url", "created_at"]
+
+
+def column_width(max_len: Optional[int]) -> int:
+    """Ширина колонки по самой длинной строке (как у прежней авто-ширины)."""
+    return min(max(MIN_WIDTH, max_len or 0) + 2, MAX_WIDTH)
+
+
+def wishlist_row(row: Dict[str, Any]) -> list:
+    created_at = row.get("created_at")
+    priority = row.get("priority") or "medium"
+    return [
+        row.get("title") or "",
+        PRIORITY_LABELS.get(priority, priority),
+        row.get("url") or "",
+        created_at.strftime("%d.%m.%Y") if created_at else "",
+    ]
+
+
+def write_wishlist_xlsx(
+    rows: Iterable[Dict[str, Any]],
+    sheet_name: str = "Wishlist",
+) -> Tuple[SpooledTemporaryFile, int]:
+    """
+    Собрать XLSX из строк iter_wishlist_export.
+    Возвращает (файл, установленный на начало; число желаний).
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(sheet_name[:31])  # Excel limit
+
+    rows_iter: Iterator[Dict[str, Any]] = iter(rows)
+    first = next(rows_iter, None)
+    total = first["total"] if first else 0
+
+    widths = [
+        column_width(first["max_title_len"] if first else None),
+        column_width(max(len(label) for label in PRIORITY_LABELS.values())),
+        column_width(first["max_url_len"] if first else None),
+        column_width(len("dd.mm.yyyy")),
+    ]
+    for col, width in enumerate(widths, 1):
+        ws.column_dimensions[get_column_letter(col)].width = width
+
+    header_font = Font(bold=True)
+    header_alignment = Alignment(vertical="center")
+    header = []
+    for title in HEADERS:
+        cell = WriteOnlyCell(ws, value=title)
+        cell.font = header_font
+        cell.alignment = header_alignment
+        header.append(cell)
+    ws.append(header)
+
+    if first is not None:
+        ws.append(wishlist_row(first))
+        for row in rows_iter:
+            ws.append(wishlist_row(row))
+
+    out = SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX)
+    wb.save(out)
+    out.seek(0)
+    return out, total
+
+
+def export_cache_key(content_hash: str, sheet_name: str) -> str:
+    raw = f"wishlist:v{EXPORT_FORMAT_VERSION}:{sheet_name}:{content_hash}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def send_wishlist_export(bot, chat_id: int, pair_id: int, owner_user_id: int, sheet_name: str) -> None:
+    """
+    Отправить в чат вишлист owner_user_id в XLSX.
+    Неизменённый список пересылается по сохранённому file_id.
+    """
+    summary = get_wishlist_content_hash(pair_id, owner_user_id)
+    key = export_cache_key(summary["content_hash"], sheet_name)
+    caption = f"📄 {sheet_name}\nВсего: {summary['total']}"
+
+    file_id = get_export_file_id(key)
+    if file_id:
+        try:
+            bot.send_document(chat_id, file_id, caption=caption)
+            return
+        except ApiTelegramException as e:
+            if e.error_code != 400:
+                raise
+            # file_id больше не принимается — соберём файл заново
+            forget_export_file_id(key)
+
+    # Файл и ключ кэша — из одного снимка: иначе изменение между двумя
+    # запросами сохранило бы под ключом file_id файла с другим содержимым.
+    with unit_of_work(isolation="REPEATABLE READ, READ ONLY"):
+        summary = get_wishlist_content_hash(pair_id, owner_user_id)
+        out, _ = write_wishlist_xlsx(iter_wishlist_export(pair_id, owner_user_id), sheet_name)
+    key = export_cache_key(summary["content_hash"], sheet_name)
+    caption = f"📄 {sheet_name}\nВсего: {summary['total']}"
+    with out:
+        message = bot.send_document(chat_id, out, caption=caption, visible_file_name=EXPORT_FILENAME)
+    document = getattr(message, "document", None)
+    if document is not None:
+        save_export_file_id(key, document.file_id)
+
+
+def iter_wishlist_csv(rows: Iterable[Dict[str, Any]]) -> Iterator[bytes]:
+    """CSV кусками примерно по EXPORT_CHUNK_SIZE. BOM — чтобы Excel понял UTF-8."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    buf.write("\ufeff")
+    writer.writerow(HEADERS)
+    for row in rows:
+        writer.writerow(wishlist_row(row))
+        if buf.tell() >= EXPORT_CHUNK_SIZE:
+            yield buf.getvalue().encode("utf-8")
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode("utf-8")
+
+
+def iter_wishlist_json(rows: Iterable[Dict[str, Any]]) -> Iterator[bytes]:
+    """JSON-массив объектов кусками примерно по EXPORT_CHUNK_SIZE."""
+    parts = ["["]
+    size = 1
+    for i, row in enumerate(rows):
+        item = json.dumps(dict(zip(JSON_KEYS, wishlist_row(row))), ensure_ascii=False)
+        parts.append(item if i == 0 else "," + item)
+        size += len(item) + 1
+        if size >= EXPORT_CHUNK_SIZE:
+            yield "".join(parts).encode("utf-8")
+            parts, size = [], 0
+    parts.append("]")
+    yield "".join(parts).encode("utf-8")
+
+
+def iter_wishlist_xlsx(rows: Iterable[Dict[str, Any]], sheet_name: str) -> Iterator[bytes]:
+    out, _ = write_wishlist_xlsx(rows, sheet_name)
+    with out:
+        while True:
+            chunk = out.read(EXPORT_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def stream_wishlist_export(pair_id: int, owner_user_id: int, fmt: str, sheet_name: str) -> Iterator[bytes]:
+    """
+    Выгрузка в формате fmt (ключ EXPORT_FORMATS) кусками байт.
+    Ленивая: курсор открывается на первом next() и закрывается вместе
+    с генератором, в том числе если клиент оборвал скачивание.
+    """
+    rows = iter_wishlist_export(pair_id, owner_user_id)
+    if fmt == "csv":
+        return iter_wishlist_csv(rows)
+    if fmt == "json":
+        return iter_wishlist_json(rows)
+    return iter_wishlist_xlsx(rows, sheet_name)
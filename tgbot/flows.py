@@ -6,13 +6,13 @@
 from __future__ import annotations
 
 import html
-from datetime import date as _date, timedelta
 from urllib.parse import quote
 
 from telebot import types
 
 from config import BOT_USERNAME
 from db import fetchone
+from pair_calendar import relationship_calendar
 from bot_setup import send_or_edit
 from services import (
     get_or_create_user,
@@ -162,10 +162,10 @@ def start_date_flow(chat_id: int, tg_user) -> None:
 
     if pair["start_date"]:
         start = pair["start_date"]
-        today = _date.today()
+        cal = relationship_calendar(start)
+        start_fmt = start.strftime("%d.%m.%Y")
 
-        if start > today:
-            start_fmt = start.strftime("%d.%m.%Y")
+        if cal["future"]:
             text = (
                 f"Дата начала отношений: <b>{start_fmt}</b>\n\n"
                 "Похоже, эта дата ещё в будущем 🙃\n"
@@ -173,81 +173,32 @@ def start_date_flow(chat_id: int, tg_user) -> None:
             )
             button_text = "✏️ Изменить дату"
         else:
-            start_fmt = start.strftime("%d.%m.%Y")
-            days_together = (today - start).days
+            days_together = cal["days_together"]
+            years = cal["years"]
+            months = cal["months"]
+            days_until_next = cal["days_until_next"]
 
-            years = today.year - start.year
-            if (today.month, today.day) < (start.month, start.day):
-                years -= 1
-
-            last_year_anniv = _date(start.year + years, start.month, start.day)
-
-            months = (today.year - last_year_anniv.year) * 12 + (
-                today.month - last_year_anniv.month
-            )
-            if today.day < start.day:
-                months -= 1
-            if months < 0:
-                months = 0
-
-            next_anniv = _date(start.year + years + 1, start.month, start.day)
-            days_until_next = (next_anniv - today).days
-
-            total_period_days = (next_anniv - last_year_anniv).days or 1
-            done_days = (today - last_year_anniv).days
-            done_days = max(0, min(done_days, total_period_days))
-
-            ratio = done_days / total_period_days
+            ratio = cal["progress_to_next"]
             bar_len = 10
             filled = int(round(ratio * bar_len))
             filled = min(filled, bar_len)
             bar = "█" * filled + "░" * (bar_len - filled)
             percent = int(ratio * 100)
 
-            milestone_days = [
-                100,
-                200,
-                300,
-                400,
-                500,
-                600,
-                700,
-                800,
-                900,
-                1000,
-                1500,
-                2000,
-                2500,
-                3000,
-            ]
-            next_milestone = None
-            for d in milestone_days:
-                if d > days_together:
-                    next_milestone = d
-                    break
-
             milestone_block = ""
-            if next_milestone is not None:
-                days_to_milestone = next_milestone - days_together
-                milestone_date = start + timedelta(days=next_milestone)
+            if cal["next_milestone_days"] is not None:
                 milestone_block = (
                     f"\n\n✨ <b>Ближайшая «красивая» дата:</b>\n"
-                    f"– <b>{next_milestone}</b> дней вместе — "
-                    f"<b>{milestone_date.strftime('%d.%m.%Y')}</b>\n"
-                    f"– Осталось: <b>{days_to_milestone}</b> дней"
+                    f"– <b>{cal['next_milestone_days']}</b> дней вместе — "
+                    f"<b>{cal['next_milestone_date'].strftime('%d.%m.%Y')}</b>\n"
+                    f"– Осталось: <b>{cal['next_milestone_days_left']}</b> дней"
                 )
 
-            if years < 0:
-                years = 0
-            next_big_year = ((years // 5) + 1) * 5
-            big_anniv_date = _date(start.year + next_big_year, start.month, start.day)
-            days_to_big = (big_anniv_date - today).days
-
             big_block = (
                 f"\n\n🎉 <b>Следующий большой юбилей:</b>\n"
-                f"– <b>{next_big_year}</b> лет — "
-                f"<b>{big_anniv_date.strftime('%d.%m.%Y')}</b>\n"
-                f"– Осталось: <b>{days_to_big}</b> дней"
+                f"– <b>{cal['next_big_year']}</b> лет — "
+                f"<b>{cal['next_big_year_date'].strftime('%d.%m.%Y')}</b>\n"
+                f"– Осталось: <b>{cal['next_big_year_days_left']}</b> дней"
             )
 
             text = (
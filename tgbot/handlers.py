@@ -7,15 +7,16 @@ from __future__ import annotations
 
 import html
 import re
-from datetime import date
-
-import telebot
 from telebot import types
 
 from db import fetchone, execute
+from delivery import describe as describe_delivery, is_valid_timezone
+from pair_calendar import relationship_calendar
+from outbox import enqueue_message
 from bot_setup import bot, pending_actions, wishlist_link_targets, send_or_edit, get_id
 from services import (
     get_or_create_user,
+    get_user_id_by_telegram_id,
     get_pair_by_user,
     add_wishlist_item,
     get_wishlist_for_owner,
@@ -31,7 +32,15 @@ from flows import (
     render_wishlist_for,
     show_wishlist_root,
 )
-from services import set_pair_start_date, set_pair_cloud_url, link_partner_to_pair
+from services import (
+    get_notification_settings,
+    set_notification_settings,
+    set_pair_start_date,
+    set_pair_cloud_url,
+    link_partner_to_pair,
+    delete_pair,
+    bump_pair_version,
+)
 
 
 # ===== Обработка ожидаемых действий (pending_actions) =====
@@ -118,7 +127,8 @@ def handle_pending(message: types.Message) -> None:
 
                 kb = add_inline_home_button(types.InlineKeyboardMarkup())
 
-                send_or_edit(
+                # уйдёт после коммита апдейта, отправит воркер outbox
+                enqueue_message(
                     partner["telegram_id"],
                     notif_text,
                     reply_markup=kb,
@@ -269,6 +279,7 @@ def handle_pending(message: types.Message) -> None:
 
         item = items[index - 1]
         execute("DELETE FROM wishlist_items WHERE id = %s", (item["id"],))
+        bump_pair_version(pair["id"], "wishlist_items", [item["id"]])
 
         send_or_edit(
             message,
@@ -309,6 +320,7 @@ def handle_pending(message: types.Message) -> None:
             "UPDATE wishlist_items SET url = %s WHERE id = %s",
             (url, item_id),
         )
+        bump_pair_version(pair["id"], "wishlist_items", [item_id])
 
         wishlist_link_targets.pop(tg_id, None)
 
@@ -336,8 +348,6 @@ def start_cmd(message: types.Message) -> None:
     - deep-link с инвайтом (start inv_xxx)
     - обычный старт (главный экран).
     """
-    from datetime import date as _date
-
     user_id = get_or_create_user(message.from_user)
 
     # === deep-link: подключение партнёра ===
@@ -417,24 +427,10 @@ def start_cmd(message: types.Message) -> None:
         )
 
         if pair["start_date"]:
-            start = pair["start_date"]
-            today = date.today()
-
-            years = today.year - start.year
-            if (today.month, today.day) < (start.month, start.day):
-                years -= 1
-
-            last_anniv = date(start.year + years, start.month, start.day)
-
-            months = (today.year - last_anniv.year) * 12 + (
-                today.month - last_anniv.month
+            cal = relationship_calendar(pair["start_date"])
+            together_text = (
+                f"Вы вместе уже <b>{cal.get('years', 0)}</b> г. <b>{cal.get('months', 0)}</b> м. 💞"
             )
-            if today.day < start.day:
-                months -= 1
-            if months < 0:
-                months = 0
-
-            together_text = f"Вы вместе уже <b>{years}</b> г. <b>{months}</b> м. 💞"
         else:
             together_text = "Вы ещё не указали дату начала отношений 💌"
 
@@ -456,6 +452,56 @@ def start_cmd(message: types.Message) -> None:
     )
 
 
+# ===== /notify — когда присылать уведомления о годовщинах =====
+
+
+NOTIFY_HELP = (
+    "Можно выбрать час и часовой пояс:\n"
+    "<code>/notify 9</code> — с 9:00 до 10:00\n"
+    "<code>/notify 9 Europe/Berlin</code> — и часовой пояс\n"
+    "<code>/notify Asia/Almaty</code> — только часовой пояс\n"
+    "<code>/notify reset</code> — по умолчанию"
+)
+
+
+@bot.message_handler(commands=["notify"])
+def notify_cmd(message: types.Message) -> None:
+    """
+    Настройки плановых уведомлений (годовщины, красивые даты):
+    час доставки и часовой пояс пользователя. Их учитывает `notifier.py --daemon`.
+    """
+    user_id = get_or_create_user(message.from_user)
+    settings = get_notification_settings(user_id)
+    tz_name, hour = settings["timezone"], settings["notify_hour"]
+
+    args = message.text.split()[1:]
+    if args == ["reset"]:
+        tz_name, hour = None, None
+    elif args:
+        for arg in args:
+            if arg.isdigit() and 0 <= int(arg) <= 23:
+                hour = int(arg)
+            elif is_valid_timezone(arg):
+                tz_name = arg
+            else:
+                send_or_edit(
+                    get_id(message),
+                    f"Не понял «{html.escape(arg)}» 🤔\n\n{NOTIFY_HELP}",
+                    parse_mode="HTML",
+                )
+                return
+
+    if args:
+        set_notification_settings(user_id, tz_name, hour)
+        text = f"Готово! Уведомления о ваших датах буду присылать {describe_delivery(tz_name, hour)} ⏰"
+    else:
+        text = (
+            f"Уведомления о ваших датах приходят {describe_delivery(tz_name, hour)} ⏰\n\n"
+            f"{NOTIFY_HELP}"
+        )
+    send_or_edit(get_id(message), text, parse_mode="HTML")
+
+
 # ===== Навигация через inline-меню (menu_*) =====
 
 
@@ -745,7 +791,7 @@ def process_delete_pair_callback(call: types.CallbackQuery) -> None:
             pass
         return
 
-    execute("DELETE FROM pairs WHERE id = %s", (pair_id,))
+    delete_pair(pair_id)
 
     bot.answer_callback_query(call.id, "Пара удалена")
 
@@ -768,15 +814,8 @@ def process_delete_pair_callback(call: types.CallbackQuery) -> None:
     for tg_id in [pair["t1"], pair["t2"]]:
         if tg_id:
             try:
-                u_id = get_or_create_user(
-                    telebot.types.User(
-                        id=tg_id,
-                        is_bot=False,
-                        first_name="",
-                        last_name="",
-                        username=None,
-                    )
-                )
+                # без get_or_create_user: он перезаписал бы профиль пустым именем
+                u_id = get_user_id_by_telegram_id(tg_id)
             except Exception:
                 u_id = None
 
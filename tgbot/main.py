@@ -1,6 +1,9 @@
 import logging
 
 from bot_setup import bot  # единый экземпляр бота
+from db import init_pool
+from changes import start_listener
+import metrics
 import handlers  # noqa: F401  # импорт нужен для регистрации хендлеров через декораторы
 
 
@@ -8,5 +11,9 @@ logging.basicConfig(level=logging.INFO)
 
 
 if __name__ == "__main__":
+    init_pool()
+    start_listener()
+    metrics.instrument_telegram()
+    metrics.serve()
     print("Bot started...")
     bot.infinity_polling()
\ No newline at end of file
@@ -0,0 +1,377 @@
+"""
+Метрики процесса в текстовом формате Prometheus.
+
+Что меряется:
+- HTTP-запросы вебаппа: время по маршруту, число SQL-запросов на запрос
+  (N+1 видно как рост гистограммы fambot_http_request_db_queries) и лог
+  медленных запросов дольше SLOW_REQUEST_MS;
+- запросы к БД (db.py / adb.py): время и ошибки по месту вызова —
+  функции, которая вызвала fetchone / execute (services.get_dashboard и т.п.);
+- вызовы Telegram Bot API (бот, воркер outbox): время по методу и исходу.
+
+Вебапп отдаёт метрики на GET /metrics — только с METRICS_TOKEN: вебапп
+открыт в интернет (хост Mini App), и без токена /metrics там закрыт.
+Бот и воркер outbox — отдельные процессы: им нужен METRICS_PORT, тогда
+метрики поднимаются на http://0.0.0.0:METRICS_PORT/metrics в фоновом
+потоке; этот порт внутренний, и токен на нём необязателен.
+
+Реестр — в памяти процесса; под gunicorn с несколькими воркерами
+каждый воркер считает своё.
+"""
+
+from __future__ import annotations
+
+import hmac
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+
+# Запросы дольше (мс) пишутся в лог медленных запросов; 0 — выключено
+SLOW_REQUEST_MS = int(os.getenv("SLOW_REQUEST_MS", "500"))
+# Порт /metrics для бота и воркера outbox; пусто — не поднимать
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# /metrics требует Authorization: Bearer <METRICS_TOKEN>; пусто — вебапп
+# метрики не отдаёт, а METRICS_PORT отдаёт без проверки
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, object]) -> Tuple:
+        return tuple(labels.get(n, "") for n in self.labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self) -> list:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> None:
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> list:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, k)} {_format_number(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets=LATENCY_BUCKETS) -> None:
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [счётчики по бакетам..., +Inf, сумма]
+        self._values: Dict[Tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+                    break
+            else:
+                row[len(self.buckets)] += 1
+            row[-1] += value
+
+    def _samples(self) -> list:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        lines = []
+        for key, row in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), row):
+                cumulative += count
+                le = f'le="{_format_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_number(row[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+_registry = []
+
+
+def _register(metric):
+    _registry.append(metric)
+    return metric
+
+
+def render() -> str:
+    """Все метрики процесса в текстовом формате Prometheus."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+HTTP_DURATION = _register(Histogram(
+    "fambot_http_request_duration_seconds", "HTTP request latency by route",
+    ("method", "route", "status"),
+))
+HTTP_DB_QUERIES = _register(Histogram(
+    "fambot_http_request_db_queries", "SQL queries issued per HTTP request",
+    ("route",), buckets=COUNT_BUCKETS,
+))
+HTTP_SLOW = _register(Counter(
+    "fambot_http_slow_requests_total", "HTTP requests slower than SLOW_REQUEST_MS", ("route",),
+))
+DB_DURATION = _register(Histogram(
+    "fambot_db_query_duration_seconds", "SQL query latency by calling function",
+    ("caller",), buckets=QUERY_BUCKETS,
+))
+DB_ERRORS = _register(Counter(
+    "fambot_db_query_errors_total", "SQL queries that raised", ("caller",),
+))
+DB_POOL = _register(Gauge(
+    "fambot_db_pool_connections", "Database pool connections", ("pool", "state"),
+))
+TELEGRAM_DURATION = _register(Histogram(
+    "fambot_telegram_request_duration_seconds", "Telegram Bot API call latency",
+    ("method", "outcome"),
+))
+
+
+# ===== Запросы к БД =====
+
+
+class RequestStats:
+    """Счётчики одного HTTP-запроса: сколько SQL и сколько времени в БД."""
+
+    __slots__ = ("queries", "db_seconds", "callers")
+
+    def __init__(self) -> None:
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.callers = _Tally()
+
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+# Файлы, кадры которых пропускаются при поиске вызывающей функции
+_db_files = {__file__}
+
+
+def skip_frames_of(filename: str) -> None:
+    """Модули доступа к БД регистрируют себя, чтобы метка указывала на их вызывающего."""
+    _db_files.add(filename)
+
+
+def query_caller() -> str:
+    """Метка "модуль.функция" — первый кадр стека вне db.py / adb.py / contextlib."""
+    frame = sys._getframe(1)
+    while frame is not None and (
+        frame.f_code.co_filename in _db_files or frame.f_code.co_filename.endswith("contextlib.py")
+    ):
+        frame = frame.f_back
+    if frame is None:
+        return "unknown"
+    module = os.path.splitext(os.path.basename(frame.f_code.co_filename))[0]
+    return f"{module}.{frame.f_code.co_name}"
+
+
+def observe_query(caller: str, seconds: float, failed: bool = False) -> None:
+    DB_DURATION.observe(seconds, caller=caller)
+    if failed:
+        DB_ERRORS.inc(caller=caller)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += seconds
+        stats.callers[caller] += 1
+
+
+class timed_query:
+    """
+    with timed_query():
+        cur.execute(...)
+
+    Метка — функция, вызвавшая db.fetchone / execute / ...
+    """
+
+    __slots__ = ("caller", "_t0")
+
+    def __init__(self, caller: Optional[str] = None) -> None:
+        self.caller = caller or query_caller()
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe_query(self.caller, time.perf_counter() - self._t0, failed=exc_type is not None)
+        return False
+
+
+# ===== HTTP-запросы =====
+
+
+def begin_request() -> RequestStats:
+    """Начать учёт запроса в текущем контексте (поток Flask / задача asyncio)."""
+    stats = RequestStats()
+    _request_stats.set(stats)
+    return stats
+
+
+def end_request(method: str, route: str, path: str, status: int, seconds: float) -> None:
+    """Записать метрики запроса и, если он медленный, строку в лог."""
+    stats = _request_stats.get()
+    _request_stats.set(None)
+    HTTP_DURATION.observe(seconds, method=method, route=route, status=status)
+    if stats is None:
+        return
+    HTTP_DB_QUERIES.observe(stats.queries, route=route)
+    if SLOW_REQUEST_MS and seconds * 1000 >= SLOW_REQUEST_MS:
+        HTTP_SLOW.inc(route=route)
+        top = ", ".join(f"{caller} x{n}" for caller, n in stats.callers.most_common(5))
+        logger.warning(
+            "Slow request %s %s -> %s: %.0f ms, %d queries, %.0f ms in DB [%s]",
+            method, path, status, seconds * 1000, stats.queries, stats.db_seconds * 1000, top,
+        )
+
+
+def check_token(authorization: Optional[str], required: bool = False) -> bool:
+    """
+    Разрешён ли запрос к /metrics с таким заголовком Authorization.
+    required — без заданного METRICS_TOKEN отказывать (публичный хост вебаппа).
+    """
+    if not METRICS_TOKEN:
+        return not required
+    expected = f"Bearer {METRICS_TOKEN}".encode("utf-8")
+    # сравнение за постоянное время: токен не подбирается по задержке ответа
+    return hmac.compare_digest((authorization or "").encode("utf-8"), expected)
+
+
+# ===== Telegram Bot API =====
+
+_telegram_installed = False
+
+
+def instrument_telegram() -> None:
+    """
+    Мерить все вызовы Bot API процесса. У pyTelegramBotAPI нет хука с
+    именем метода и результатом, поэтому оборачиваем apihelper._make_request —
+    через него идут все методы TeleBot.
+    """
+    global _telegram_installed
+    if _telegram_installed:
+        return
+    _telegram_installed = True
+
+    from telebot import apihelper
+
+    make_request = apihelper._make_request
+
+    def timed_make_request(token, method_name, *args, **kwargs):
+        t0 = time.perf_counter()
+        outcome = "ok"
+        try:
+            return make_request(token, method_name, *args, **kwargs)
+        except apihelper.ApiTelegramException as e:
+            outcome = str(e.error_code)
+            raise
+        except Exception:
+            outcome = "network"
+            raise
+        finally:
+            TELEGRAM_DURATION.observe(time.perf_counter() - t0, method=method_name, outcome=outcome)
+
+    apihelper._make_request = timed_make_request
+
+
+# ===== /metrics для процессов без HTTP-сервера =====
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        if not check_token(self.headers.get("Authorization")):
+            self.send_error(401)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int = METRICS_PORT) -> Optional[ThreadingHTTPServer]:
+    """Поднять /metrics на порту в фоновом потоке (port=0 — не поднимать)."""
+    if not port:
+        return None
+    server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Metrics on http://0.0.0.0:{port}/metrics")
+    return server
@@ -0,0 +1,273 @@
+"""
+Версионированные миграции схемы БД.
+
+Миграции — файлы migrations/NNNN_name.sql, применяются по порядку номеров,
+применённые версии записываются в таблицу schema_migrations.
+
+Обычная миграция выполняется одной транзакцией. Если в первой строке файла
+стоит `-- migrate: no-transaction`, файл выполняется по одному оператору
+в autocommit — это нужно для CREATE INDEX CONCURRENTLY, который не блокирует
+запись в живые таблицы, но не может работать внутри транзакции.
+
+Запуск:
+    python migrate.py             # применить новые миграции
+    python migrate.py --status    # какие версии применены / ожидают
+    python migrate.py --indexes   # индексы: какие запросы обслуживают, сколько сканов
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import re
+from typing import List, Tuple
+
+try:
+    from db import connect
+except ModuleNotFoundError:
+    from tgbot.db import connect
+
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+NO_TRANSACTION_MARKER = "-- migrate: no-transaction"
+
+# Произвольная константа: не даём двум процессам мигрировать одновременно
+ADVISORY_LOCK_ID = 7_021_001
+
+_FILENAME_RE = re.compile(r"^(\d{4})_([\w-]+)\.sql$")
+_CONCURRENT_INDEX_RE = re.compile(
+    r"^\s*CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?"
+    r'(?:"?\w+"?\.)?"?(\w+)"?',
+    re.IGNORECASE,
+)
+
+
+def list_migrations() -> List[Tuple[str, str, str]]:
+    """[(version, name, path)] в порядке версий."""
+    result = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        m = _FILENAME_RE.match(filename)
+        if m:
+            result.append((m.group(1), m.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    return result
+
+
+def split_statements(sql: str) -> List[str]:
+    """
+    Разбить SQL-файл на операторы по `;`.
+    Учитывает строки в '...', $$...$$-блоки и комментарии `--`.
+    """
+    statements = []
+    buf = []
+    i = 0
+    n = len(sql)
+    while i < n:
+        ch = sql[i]
+        if sql.startswith("--", i):
+            end = sql.find("\n", i)
+            end = n if end == -1 else end
+            buf.append(sql[i:end])
+            i = end
+            continue
+        if ch == "'":
+            end = i + 1
+            while end < n:
+                if sql[end] == "'" and not sql.startswith("''", end):
+                    break
+                end += 2 if sql.startswith("''", end) else 1
+            buf.append(sql[i:end + 1])
+            i = end + 1
+            continue
+        m = re.match(r"\$\w*\$", sql[i:])
+        if m:
+            tag = m.group(0)
+            end = sql.find(tag, i + len(tag))
+            end = n if end == -1 else end + len(tag)
+            buf.append(sql[i:end])
+            i = end
+            continue
+        if ch == ";":
+            statements.append("".join(buf))
+            buf = []
+        else:
+            buf.append(ch)
+        i += 1
+    statements.append("".join(buf))
+
+    def has_code(stmt: str) -> bool:
+        return any(
+            line.strip() and not line.strip().startswith("--")
+            for line in stmt.splitlines()
+        )
+
+    return [s.strip() for s in statements if has_code(s)]
+
+
+def ensure_schema_migrations(conn) -> None:
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version     TEXT PRIMARY KEY,
+                name        TEXT NOT NULL,
+                applied_at  TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            )
+            """
+        )
+
+
+def applied_versions(conn) -> set:
+    with conn.cursor() as cur:
+        cur.execute("SELECT version FROM schema_migrations")
+        return {row[0] for row in cur.fetchall()}
+
+
+def concurrent_index_names(statements: List[str]) -> List[str]:
+    """Имена индексов из CREATE INDEX CONCURRENTLY [IF NOT EXISTS] <name> миграции."""
+    names = []
+    for statement in statements:
+        # комментарии перед оператором split_statements оставляет в нём
+        code = "\n".join(line for line in statement.splitlines() if not line.lstrip().startswith("--"))
+        m = _CONCURRENT_INDEX_RE.match(code)
+        if m:
+            names.append(m.group(1))
+    return names
+
+
+def drop_invalid_indexes(conn, names: List[str]) -> None:
+    """
+    Прерванный CREATE INDEX CONCURRENTLY оставляет INVALID-индекс,
+    а IF NOT EXISTS его потом молча пропустит. Удаляем такие перед повтором —
+    только индексы этой миграции: INVALID бывает и индекс, который прямо
+    сейчас строит другой сеанс, его трогать нельзя.
+    """
+    if not names:
+        return
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT format('%%I.%%I', n.nspname, c.relname)
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE NOT i.indisvalid AND n.nspname = current_schema()
+              AND c.relname = ANY(%s)
+            """,
+            (names,),
+        )
+        for (index_name,) in cur.fetchall():
+            print(f"  dropping invalid index {index_name}")
+            cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+
+
+def apply_migration(conn, version: str, name: str, path: str) -> None:
+    with open(path, encoding="utf-8") as f:
+        sql = f.read()
+
+    record = (
+        "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+        (version, name),
+    )
+
+    if sql.lstrip().startswith(NO_TRANSACTION_MARKER):
+        # Каждый оператор отдельно, в autocommit. Операторы таких миграций
+        # должны быть идемпотентны (IF NOT EXISTS), чтобы повтор после сбоя был безопасен.
+        statements = split_statements(sql)
+        drop_invalid_indexes(conn, concurrent_index_names(statements))
+        with conn.cursor() as cur:
+            for statement in statements:
+                cur.execute(statement)
+            cur.execute(*record)
+        return
+
+    conn.autocommit = False
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql)
+            cur.execute(*record)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.autocommit = True
+
+
+def migrate() -> int:
+    """Применить все новые миграции. Возвращает число применённых."""
+    conn = connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(%s)", (ADVISORY_LOCK_ID,))
+        ensure_schema_migrations(conn)
+        done = applied_versions(conn)
+
+        count = 0
+        for version, name, path in list_migrations():
+            if version in done:
+                continue
+            print(f"Applying {version}_{name} ...")
+            apply_migration(conn, version, name, path)
+            count += 1
+
+        print(f"Migrations applied: {count}")
+        return count
+    finally:
+        conn.close()
+
+
+def print_status() -> None:
+    conn = connect()
+    try:
+        ensure_schema_migrations(conn)
+        done = applied_versions(conn)
+    finally:
+        conn.close()
+
+    for version, name, _ in list_migrations():
+        mark = "applied" if version in done else "pending"
+        print(f"{version}_{name}: {mark}")
+
+
+def print_indexes() -> None:
+    """Отчёт по индексам: таблица, описание обслуживаемых запросов, число сканов, размер."""
+    conn = connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT s.relname,
+                       s.indexrelname,
+                       obj_description(s.indexrelid, 'pg_class') AS serves,
+                       s.idx_scan,
+                       pg_size_pretty(pg_relation_size(s.indexrelid)) AS size
+                FROM pg_stat_user_indexes s
+                WHERE s.schemaname = current_schema()
+                ORDER BY s.relname, s.indexrelname
+                """
+            )
+            rows = cur.fetchall()
+    finally:
+        conn.close()
+
+    for table, index, serves, scans, size in rows:
+        print(f"{table}.{index}  scans={scans}  size={size}")
+        print(f"    serves: {serves or '-'}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="FamBot DB migrations")
+    parser.add_argument("--status", action="store_true", help="show applied / pending migrations")
+    parser.add_argument("--indexes", action="store_true", help="show indexes and the queries they serve")
+    args = parser.parse_args()
+
+    if args.status:
+        print_status()
+    elif args.indexes:
+        print_indexes()
+    else:
+        migrate()
+
+
+if __name__ == "__main__":
+    main()
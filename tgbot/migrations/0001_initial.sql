@@ -53,4 +53,14 @@ CREATE TABLE IF NOT EXISTS notes (
     author_user_id  INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
     text            TEXT NOT NULL,
     created_at      TIMESTAMPTZ NOT NULL DEFAULT NOW()
-);
\ No newline at end of file
+);
+
+ALTER TABLE wishlist_items
+    ADD COLUMN IF NOT EXISTS url TEXT;
+
+CREATE TABLE IF NOT EXISTS pair_invites (
+    id              SERIAL PRIMARY KEY,
+    creator_user_id INT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    invite_token    VARCHAR(64) UNIQUE NOT NULL,
+    created_at      TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
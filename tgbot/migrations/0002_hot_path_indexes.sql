@@ -0,0 +1,41 @@
+-- migrate: no-transaction
+-- Индексы под горячие запросы. CONCURRENTLY — без блокировки записи
+-- в живые таблицы, поэтому миграция идёт вне транзакции.
+-- COMMENT ON INDEX описывает, какие запросы обслуживает индекс
+-- (видно в `python migrate.py --indexes`).
+
+-- services.get_pair_by_user: creator_user_id = %s OR partner_user_id = %s (BitmapOr двух индексов)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS pairs_creator_user_id_idx
+    ON pairs (creator_user_id);
+COMMENT ON INDEX pairs_creator_user_id_idx IS
+    'services.get_pair_by_user (creator_user_id = ... OR ...); ON DELETE CASCADE from users';
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS pairs_partner_user_id_idx
+    ON pairs (partner_user_id);
+COMMENT ON INDEX pairs_partner_user_id_idx IS
+    'services.get_pair_by_user (... OR partner_user_id = ...); ON DELETE SET NULL from users';
+
+-- services.get_wishlist_for_owner (ORDER BY created_at), send_wishlist_to_bot
+-- (ORDER BY created_at DESC), /api/wishlist/clear
+CREATE INDEX CONCURRENTLY IF NOT EXISTS wishlist_items_pair_owner_created_idx
+    ON wishlist_items (pair_id, owner_user_id, created_at);
+COMMENT ON INDEX wishlist_items_pair_owner_created_idx IS
+    'services.get_wishlist_for_owner, app.send_wishlist_to_bot, /api/wishlist/clear; ON DELETE CASCADE from pairs';
+
+-- /api/init: заметки пары, ORDER BY created_at DESC
+CREATE INDEX CONCURRENTLY IF NOT EXISTS notes_pair_created_idx
+    ON notes (pair_id, created_at DESC);
+COMMENT ON INDEX notes_pair_created_idx IS
+    '/api/init notes listing (pair_id = ... ORDER BY created_at DESC); ON DELETE CASCADE from pairs';
+
+-- notifier.notification_already_sent: pair_id + notif_type, payload->>key фильтруется по паре строк
+CREATE INDEX CONCURRENTLY IF NOT EXISTS notifications_log_pair_type_idx
+    ON notifications_log (pair_id, notif_type);
+COMMENT ON INDEX notifications_log_pair_type_idx IS
+    'notifier.notification_already_sent; ON DELETE CASCADE from pairs';
+
+-- services.get_or_create_invite_for_user
+CREATE INDEX CONCURRENTLY IF NOT EXISTS pair_invites_creator_user_id_idx
+    ON pair_invites (creator_user_id);
+COMMENT ON INDEX pair_invites_creator_user_id_idx IS
+    'services.get_or_create_invite_for_user; ON DELETE CASCADE from users';
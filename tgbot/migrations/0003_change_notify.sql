@@ -0,0 +1,55 @@
+-- Уведомления об изменениях для межпроцессной инвалидации кэшей.
+-- Любая запись в pairs / wishlist_items / notes (из бота, вебаппа, нотифаера
+-- или руками из psql) шлёт NOTIFY в канал fambot_changes. Postgres доставляет
+-- его слушателям только после COMMIT. Слушатель — tgbot/changes.py.
+--
+-- payload (JSON):
+--   {"entity": "pairs", "op": "UPDATE", "pair_id": 1, "user_ids": [1, 2]}
+--   {"entity": "wishlist_items" | "notes", "op": "INSERT", "pair_id": 1, "id": 10}
+
+CREATE OR REPLACE FUNCTION fambot_notify_change() RETURNS trigger AS $$
+DECLARE
+    rec RECORD;
+    payload JSON;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        rec := OLD;
+    ELSE
+        rec := NEW;
+    END IF;
+
+    IF TG_TABLE_NAME = 'pairs' THEN
+        payload := json_build_object(
+            'entity', TG_TABLE_NAME,
+            'op', TG_OP,
+            'pair_id', rec.id,
+            'user_ids', json_build_array(rec.creator_user_id, rec.partner_user_id)
+        );
+    ELSE
+        payload := json_build_object(
+            'entity', TG_TABLE_NAME,
+            'op', TG_OP,
+            'pair_id', rec.pair_id,
+            'id', rec.id
+        );
+    END IF;
+
+    PERFORM pg_notify('fambot_changes', payload::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS pairs_notify_change ON pairs;
+CREATE TRIGGER pairs_notify_change
+    AFTER INSERT OR UPDATE OR DELETE ON pairs
+    FOR EACH ROW EXECUTE FUNCTION fambot_notify_change();
+
+DROP TRIGGER IF EXISTS wishlist_items_notify_change ON wishlist_items;
+CREATE TRIGGER wishlist_items_notify_change
+    AFTER INSERT OR UPDATE OR DELETE ON wishlist_items
+    FOR EACH ROW EXECUTE FUNCTION fambot_notify_change();
+
+DROP TRIGGER IF EXISTS notes_notify_change ON notes;
+CREATE TRIGGER notes_notify_change
+    AFTER INSERT OR UPDATE OR DELETE ON notes
+    FOR EACH ROW EXECUTE FUNCTION fambot_notify_change();
@@ -0,0 +1,5 @@
+-- Монотонная версия данных пары: растёт при любом изменении пары, её вишлистов
+-- и заметок (services.bump_pair_version). По ней /api/init отдаёт ETag
+-- и отвечает «не изменилось», если у клиента актуальное состояние.
+ALTER TABLE pairs
+    ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 1;
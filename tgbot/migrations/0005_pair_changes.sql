@@ -0,0 +1,24 @@
+-- Журнал изменений вишлистов и заметок для дельта-синхронизации (/api/sync).
+-- Каждая запись: «в версии version пары изменилась строка entity/entity_id».
+-- Что именно произошло, журнал не хранит: если строка ещё есть — клиенту
+-- отдаётся её текущее состояние, если нет — надгробие (id удалённой строки).
+CREATE TABLE IF NOT EXISTS pair_changes (
+    id          BIGSERIAL PRIMARY KEY,
+    pair_id     INT NOT NULL REFERENCES pairs(id) ON DELETE CASCADE,
+    version     BIGINT NOT NULL,
+    entity      TEXT NOT NULL CHECK (entity IN ('wishlist_items', 'notes')),
+    entity_id   INT NOT NULL,
+    changed_at  TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS pair_changes_pair_version_idx
+    ON pair_changes (pair_id, version);
+COMMENT ON INDEX pair_changes_pair_version_idx IS
+    'services.get_pair_changes (pair_id = ... AND version > since); ON DELETE CASCADE from pairs';
+
+-- Журнал чистится по давности (services.prune_pair_changes). changes_since —
+-- версия, начиная с которой журнал пары полный: клиенту с более старой
+-- версией /api/sync ответит reset, и он загрузит всё через /api/init.
+ALTER TABLE pairs
+    ADD COLUMN IF NOT EXISTS changes_since BIGINT NOT NULL DEFAULT 0;
+UPDATE pairs SET changes_since = version;
@@ -0,0 +1,44 @@
+-- UPDATE pairs, который только поднимает version (services.bump_pair_version
+-- после записи в вишлисты/заметки), помечается в NOTIFY флагом version_only.
+-- Кэшу пар такое событие по-прежнему нужно (версия — часть ETag /api/init),
+-- а SSE-хабу (webapp/events.py) — нет: само изменение придёт отдельным
+-- событием wishlist_items / notes.
+--
+-- payload (JSON):
+--   {"entity": "pairs", "op": "UPDATE", "pair_id": 1, "user_ids": [1, 2], "version_only": true}
+--   {"entity": "wishlist_items" | "notes", "op": "INSERT", "pair_id": 1, "id": 10}
+
+CREATE OR REPLACE FUNCTION fambot_notify_change() RETURNS trigger AS $$
+DECLARE
+    rec RECORD;
+    payload JSON;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        rec := OLD;
+    ELSE
+        rec := NEW;
+    END IF;
+
+    IF TG_TABLE_NAME = 'pairs' THEN
+        payload := json_build_object(
+            'entity', TG_TABLE_NAME,
+            'op', TG_OP,
+            'pair_id', rec.id,
+            'user_ids', json_build_array(rec.creator_user_id, rec.partner_user_id),
+            'version_only', TG_OP = 'UPDATE'
+                AND to_jsonb(NEW) - 'version' - 'changes_since'
+                    = to_jsonb(OLD) - 'version' - 'changes_since'
+        );
+    ELSE
+        payload := json_build_object(
+            'entity', TG_TABLE_NAME,
+            'op', TG_OP,
+            'pair_id', rec.pair_id,
+            'id', rec.id
+        );
+    END IF;
+
+    PERFORM pg_notify('fambot_changes', payload::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
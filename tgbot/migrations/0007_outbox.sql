@@ -0,0 +1,36 @@
+-- Исходящие сообщения Telegram (transactional outbox).
+-- Запись в outbox делается в той же транзакции, что и изменение данных
+-- (tgbot/outbox.py: enqueue_message / enqueue_document), а отправляет
+-- отдельный процесс `python outbox.py` — с повторами, backoff и dead letter.
+CREATE TABLE IF NOT EXISTS outbox (
+    id               BIGSERIAL PRIMARY KEY,
+    kind             TEXT NOT NULL CHECK (kind IN ('message', 'document')),
+    chat_id          BIGINT NOT NULL,
+    -- message: text, parse_mode, reply_markup; document: filename, caption
+    payload          JSONB NOT NULL DEFAULT '{}'::jsonb,
+    document         BYTEA,
+    status           TEXT NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'sent', 'dead')),
+    attempts         INT NOT NULL DEFAULT 0,
+    next_attempt_at  TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    last_error       TEXT,
+    created_at       TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    sent_at          TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS outbox_pending_idx
+    ON outbox (next_attempt_at) WHERE status = 'pending';
+COMMENT ON INDEX outbox_pending_idx IS
+    'outbox.claim_batch (status = pending AND next_attempt_at <= NOW() ORDER BY next_attempt_at)';
+
+-- Будим воркер сразу после COMMIT, а не по таймеру опроса
+CREATE OR REPLACE FUNCTION fambot_notify_outbox() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('fambot_outbox', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS outbox_notify ON outbox;
+CREATE TRIGGER outbox_notify
+    AFTER INSERT ON outbox
+    FOR EACH STATEMENT EXECUTE FUNCTION fambot_notify_outbox();
@@ -0,0 +1,10 @@
+-- Приоритет исходящих сообщений: воркер outbox забирает сначала более важные
+-- (файл, который пользователь только что запросил, раньше массовых поздравлений).
+ALTER TABLE outbox
+    ADD COLUMN IF NOT EXISTS priority SMALLINT NOT NULL DEFAULT 0;
+
+DROP INDEX IF EXISTS outbox_pending_idx;
+CREATE INDEX IF NOT EXISTS outbox_pending_priority_idx
+    ON outbox (priority DESC, next_attempt_at) WHERE status = 'pending';
+COMMENT ON INDEX outbox_pending_priority_idx IS
+    'outbox.claim_batch (status = pending AND next_attempt_at <= NOW() ORDER BY priority DESC, next_attempt_at)';
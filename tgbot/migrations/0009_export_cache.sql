@@ -0,0 +1,15 @@
+-- Выгрузки вишлиста — фоновые задания в outbox (kind = 'export'): эндпоинт
+-- только ставит задание, файл собирает и отправляет воркер outbox.
+ALTER TABLE outbox DROP CONSTRAINT IF EXISTS outbox_kind_check;
+ALTER TABLE outbox
+    ADD CONSTRAINT outbox_kind_check CHECK (kind IN ('message', 'document', 'export'));
+
+-- Уже загруженные в Telegram файлы выгрузок. cache_key — хэш содержимого
+-- списка (только выгружаемые поля) и оформления файла: пока список не менялся,
+-- повторная выгрузка — это send_document по file_id, без генерации и загрузки.
+CREATE TABLE IF NOT EXISTS export_cache (
+    cache_key     TEXT PRIMARY KEY,
+    file_id       TEXT NOT NULL,
+    created_at    TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    last_used_at  TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
@@ -0,0 +1,9 @@
+-- migrate: no-transaction
+-- Нотифаер выбирает только пары с событием сегодня: start_date = ANY(даты,
+-- у которых сегодня годовщина, напоминание или красивое число дней).
+
+-- notifier.get_due_events: pairs JOIN due ON start_date
+CREATE INDEX CONCURRENTLY IF NOT EXISTS pairs_start_date_idx
+    ON pairs (start_date) WHERE start_date IS NOT NULL;
+COMMENT ON INDEX pairs_start_date_idx IS
+    'notifier.get_due_events (start_date = ANY(due dates))';
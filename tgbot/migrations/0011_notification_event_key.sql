@@ -0,0 +1,29 @@
+-- Ключ дедупликации уведомлений: (pair_id, notif_type, event_key), где
+-- event_key — номер года для годовщин и число дней для красивых дат.
+-- Нотифаер «занимает» событие INSERT ... ON CONFLICT DO NOTHING RETURNING
+-- до отправки: второй параллельный запуск получит пустой результат и
+-- ничего не отправит, а проверка и запись — один индексный запрос.
+
+ALTER TABLE notifications_log ADD COLUMN IF NOT EXISTS event_key TEXT;
+
+UPDATE notifications_log
+SET event_key = COALESCE(payload->>'year', payload->>'days', payload::text, '')
+WHERE event_key IS NULL;
+
+-- дубли, которые уже успели отправиться дважды, — оставляем первую запись
+DELETE FROM notifications_log l
+USING notifications_log earlier
+WHERE earlier.pair_id = l.pair_id
+  AND earlier.notif_type = l.notif_type
+  AND earlier.event_key = l.event_key
+  AND earlier.id < l.id;
+
+ALTER TABLE notifications_log ALTER COLUMN event_key SET NOT NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS notifications_log_event_key_idx
+    ON notifications_log (pair_id, notif_type, event_key);
+COMMENT ON INDEX notifications_log_event_key_idx IS
+    'notifier.claim_notification (ON CONFLICT), notifier.get_due_events (NOT EXISTS); ON DELETE CASCADE from pairs';
+
+-- уникальный индекс покрывает (pair_id, notif_type) — старый больше не нужен
+DROP INDEX IF EXISTS notifications_log_pair_type_idx;
@@ -0,0 +1,20 @@
+-- Прогоны нотифаера: контрольная точка для перезапуска после сбоя.
+-- last_pair_id — все due-пары с id не больше него уже обработаны
+-- (сплошной префикс списка запуска), sent / failed — счётчики, которые
+-- коммитятся вместе с пачкой. Незавершённый прогон (finished_at IS NULL)
+-- на дату один: перезапуск за ту же дату продолжает его.
+CREATE TABLE IF NOT EXISTS notifier_runs (
+    id            SERIAL PRIMARY KEY,
+    run_date      DATE NOT NULL,
+    last_pair_id  INT NOT NULL DEFAULT 0,
+    sent          INT NOT NULL DEFAULT 0,
+    failed        INT NOT NULL DEFAULT 0,
+    started_at    TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at    TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    finished_at   TIMESTAMPTZ
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS notifier_runs_open_idx
+    ON notifier_runs (run_date) WHERE finished_at IS NULL;
+COMMENT ON INDEX notifier_runs_open_idx IS
+    'notifier.start_run (ON CONFLICT — продолжить незавершённый прогон за дату)';
@@ -0,0 +1,9 @@
+-- Часовой пояс (IANA, например 'Europe/Moscow') и предпочтительный час
+-- плановых уведомлений пользователя. NULL — значения по умолчанию
+-- (NOTIFIER_DEFAULT_TZ / NOTIFIER_DEFAULT_HOURS, см. tgbot/delivery.py).
+ALTER TABLE users ADD COLUMN IF NOT EXISTS timezone TEXT;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS notify_hour SMALLINT;
+
+ALTER TABLE users DROP CONSTRAINT IF EXISTS users_notify_hour_check;
+ALTER TABLE users ADD CONSTRAINT users_notify_hour_check
+    CHECK (notify_hour BETWEEN 0 AND 23);
@@ -1,16 +1,29 @@
+import argparse
 import json
-from datetime import date as _date, timedelta
-
-import telebot
-
-from config import BOT_TOKEN
-from db import fetchall, fetchone, execute
-
-bot = telebot.TeleBot(BOT_TOKEN, parse_mode="HTML")
-
-# Красивые числа дней
-BEAUTIFUL_DAYS = [100, 200, 300, 400, 500, 600, 700, 800, 900,
-                  1000, 1500, 2000, 2500, 3000]
+import os
+import queue
+import threading
+import time
+from datetime import date as _date, datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from db import current_unit_of_work, execute, execute_returning_one, fetchall, fetchone, init_pool, unit_of_work
+from delivery import delivery_time, local_day_end
+from outbox import enqueue_message, PRIORITY_SCHEDULED
+from pair_calendar import ANNIVERSARY_REMINDERS, calendars_for, due_start_dates, relationship_calendar
+from services import prune_pair_changes
+
+
+# Параллельные воркеры в одном процессе; процессы на других хостах можно
+# запускать одновременно — пары между ними делит SKIP LOCKED.
+# Каждому воркеру нужно соединение: держите DB_POOL_MAX не меньше.
+NOTIFIER_WORKERS = int(os.getenv("NOTIFIER_WORKERS", "4"))
+# Сколько событий воркер забирает за одну транзакцию
+NOTIFIER_BATCH_SIZE = int(os.getenv("NOTIFIER_BATCH_SIZE", "200"))
+# Режим --daemon: как часто проверять события (сек.) и за сколько до времени
+# доставки занимать событие и ставить сообщения в outbox (сек.)
+NOTIFIER_SCHEDULER_INTERVAL = float(os.getenv("NOTIFIER_SCHEDULER_INTERVAL", "300"))
+NOTIFIER_PLAN_AHEAD = float(os.getenv("NOTIFIER_PLAN_AHEAD", "900"))
 
 
 def get_all_pairs_with_start_date():
@@ -26,10 +39,171 @@ def get_all_pairs_with_start_date():
     )
 
 
+DUE_EVENTS_SQL = """
+    WITH due (start_date, notif_type, event_key, payload) AS (
+        SELECT * FROM unnest(%(starts)s::date[], %(types)s::text[], %(keys)s::text[],
+                             %(payloads)s::jsonb[])
+    )
+    SELECT p.id, p.creator_user_id, p.partner_user_id, p.start_date,
+           due.notif_type, due.payload,
+           array_remove(ARRAY[uc.telegram_id, up.telegram_id], NULL) AS telegram_ids,
+           -- часовой пояс и час доставки участников (режим --daemon)
+           jsonb_path_query_array(
+               jsonb_build_array(
+                   jsonb_build_object('telegram_id', uc.telegram_id, 'timezone', uc.timezone,
+                                      'notify_hour', uc.notify_hour),
+                   jsonb_build_object('telegram_id', up.telegram_id, 'timezone', up.timezone,
+                                      'notify_hour', up.notify_hour)
+               ),
+               '$[*] ? (@.telegram_id != null)'
+           ) AS members
+    FROM due
+    JOIN pairs p ON p.start_date = due.start_date
+    LEFT JOIN users uc ON uc.id = p.creator_user_id
+    LEFT JOIN users up ON up.id = p.partner_user_id
+    WHERE p.start_date = ANY(%(dates)s::date[])  -- отбор по индексу, а не hash join по всей pairs
+      AND p.id > %(after)s
+      AND p.id <> ALL(%(skip)s::int[])
+      AND (%(pair_ids)s::int[] IS NULL OR p.id = ANY(%(pair_ids)s::int[]))
+      AND NOT EXISTS (
+          SELECT 1
+          FROM notifications_log l
+          WHERE l.pair_id = p.id
+            AND l.notif_type = due.notif_type
+            AND l.event_key = due.event_key
+      )
+    ORDER BY p.id
+    LIMIT %(limit)s
+    -- пары, которые сейчас обрабатывает другой воркер, пропускаем
+    FOR NO KEY UPDATE OF p SKIP LOCKED
+"""
+
+
+def due_events_params(today: _date, reminders: bool = True):
+    """
+    Параметры DUE_EVENTS_SQL: события дня по датам начала, у которых сегодня
+    есть событие (pair_calendar.due_start_dates, индекс pairs_start_date_idx).
+    reminders=False — без напоминаний «через 7 дней / завтра» (догоняющий
+    прогон за прошедший день: отсчёт в них уже неверен).
+    None — сегодня событий нет ни у одной даты.
+    """
+    columns = {"starts": [], "types": [], "keys": [], "payloads": []}
+    for start, events in due_start_dates(today).items():
+        for notif_type, payload in events:
+            if not reminders and notif_type in ANNIVERSARY_REMINDERS.values():
+                continue
+            columns["starts"].append(start)
+            columns["types"].append(notif_type)
+            columns["keys"].append(event_key(payload))
+            columns["payloads"].append(json.dumps(payload))
+    if not columns["starts"]:
+        return None
+    columns["dates"] = sorted(set(columns["starts"]))
+    return columns
+
+
+def get_due_events(params, limit: Optional[int] = NOTIFIER_BATCH_SIZE, skip=(), pair_ids=None, after: int = 0):
+    """
+    Неотправленные события дня одним запросом: пара + notif_type + payload +
+    telegram_id обоих участников (у пары может быть несколько строк).
+    pair_ids — только эти пары (по первичному ключу), иначе все due-пары
+    с id больше after. Строки пар блокируются до конца транзакции, другие
+    воркеры их пропускают — для обработки вызывать внутри unit of work.
+    """
+    return fetchall(
+        DUE_EVENTS_SQL,
+        dict(
+            params,
+            limit=limit,
+            skip=list(skip),
+            pair_ids=list(pair_ids) if pair_ids is not None else None,
+            after=after,
+        ),
+    )
+
+
+def due_pair_chunks(params, size: int = NOTIFIER_BATCH_SIZE, after: int = 0) -> List[List[int]]:
+    """Список due-пар на запуск (один запрос), нарезанный на пачки для воркеров."""
+    pair_ids = sorted({row["id"] for row in get_due_events(params, limit=None, after=after)})
+    return [pair_ids[i:i + size] for i in range(0, len(pair_ids), size)]
+
+
+# ====== Контрольная точка прогона (таблица notifier_runs) ======
+
+def start_run(run_date: _date) -> Dict[str, Any]:
+    """
+    Незавершённый прогон за дату — продолжить (его last_pair_id и счётчики),
+    иначе начать новый. Одновременные процессы за одну дату получают одну
+    и ту же строку (notifier_runs_open_idx).
+    """
+    return execute_returning_one(
+        """
+        INSERT INTO notifier_runs (run_date)
+        VALUES (%s)
+        ON CONFLICT (run_date) WHERE finished_at IS NULL
+        DO UPDATE SET updated_at = NOW()
+        RETURNING id, run_date, last_pair_id, sent, failed, started_at
+        """,
+        (run_date,),
+    )
+
+
+def record_run_progress(run_id: int, sent: int, failed: int) -> None:
+    """Счётчики пачки — в её же транзакции: после сбоя они совпадают с логом."""
+    execute(
+        "UPDATE notifier_runs SET sent = sent + %s, failed = failed + %s, updated_at = NOW() WHERE id = %s",
+        (sent, failed, run_id),
+    )
+
+
+def advance_run_checkpoint(run_id: int, last_pair_id: int) -> None:
+    # GREATEST: воркеры и процессы пишут вперемешку, точка не откатывается назад
+    execute(
+        "UPDATE notifier_runs SET last_pair_id = GREATEST(last_pair_id, %s), updated_at = NOW() WHERE id = %s",
+        (last_pair_id, run_id),
+    )
+
+
+def finish_run(run_id: int) -> Dict[str, Any]:
+    return execute_returning_one(
+        "UPDATE notifier_runs SET finished_at = NOW(), updated_at = NOW() WHERE id = %s RETURNING sent, failed",
+        (run_id,),
+    )
+
+
+class RunCheckpoint:
+    """
+    Продвижение last_pair_id по пачкам списка запуска. Пачки завершаются
+    вразнобой, поэтому точка — конец сплошного префикса завершённых пачек:
+    всё, что до неё, перезапуск может не выбирать.
+    """
+
+    def __init__(self, run_id: int, chunks: List[List[int]]) -> None:
+        self.run_id = run_id
+        self._ends = [chunk[-1] for chunk in chunks]
+        self._done = [False] * len(chunks)
+        self._prefix = 0
+        self._lock = threading.Lock()
+
+    def chunk_done(self, index: int) -> None:
+        with self._lock:
+            self._done[index] = True
+            prefix = self._prefix
+            while prefix < len(self._done) and self._done[prefix]:
+                prefix += 1
+            if prefix == self._prefix:
+                return
+            self._prefix = prefix
+            last_pair_id = self._ends[prefix - 1]
+        advance_run_checkpoint(self.run_id, last_pair_id)
+
+
 def get_pair_telegram_ids(pair_row):
     """
     Получить telegram_id обоих участников пары.
     """
+    if "telegram_ids" in pair_row:
+        return pair_row["telegram_ids"]
     ids = []
     for user_id in (pair_row["creator_user_id"], pair_row["partner_user_id"]):
         if not user_id:
@@ -43,114 +217,82 @@ def get_pair_telegram_ids(pair_row):
     return ids
 
 
-def notification_already_sent(pair_id: int, notif_type: str, payload_key: str, payload_value: str) -> bool:
+def event_key(payload: dict) -> str:
+    """Ключ события в notifications_log: номер года или число дней из payload."""
+    return str(next(iter(payload.values())))
+
+
+def claim_notification(pair_id: int, notif_type: str, key: str, payload: dict) -> bool:
     """
-    Проверяем, отправляли ли уведомление с таким типом и значением.
-    payload_key: ключ в JSON (например 'year' или 'days')
-    payload_value: строковое значение этого поля
+    Занять событие до отправки. False — его уже отправили или прямо сейчас
+    отправляет другой запуск (уникальный индекс notifications_log_event_key_idx;
+    конкурент ждёт COMMIT/ROLLBACK первого и получает пустой результат).
     """
-    row = fetchone(
-        f"""
-        SELECT 1
-        FROM notifications_log
-        WHERE pair_id = %s
-          AND notif_type = %s
-          AND payload->>%s = %s
+    row = execute_returning_one(
+        """
+        INSERT INTO notifications_log (pair_id, notif_type, event_key, payload)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (pair_id, notif_type, event_key) DO NOTHING
+        RETURNING id
         """,
-        (pair_id, notif_type, payload_key, payload_value)
+        (pair_id, notif_type, key, json.dumps(payload)),
     )
     return row is not None
 
 
-def log_notification(pair_id: int, notif_type: str, payload: dict):
+def release_notification(pair_id: int, notif_type: str, key: str) -> None:
+    """Освободить занятое событие, если отправить не удалось, — следующий запуск повторит."""
     execute(
-        """
-        INSERT INTO notifications_log (pair_id, notif_type, payload)
-        VALUES (%s, %s, %s)
-        """,
-        (pair_id, notif_type, json.dumps(payload))
+        "DELETE FROM notifications_log WHERE pair_id = %s AND notif_type = %s AND event_key = %s",
+        (pair_id, notif_type, key),
     )
 
 
-def handle_anniversaries_for_pair(pair):
-    """
-    Обработка годовщин и напоминаний (7 дней, 1 день, в день годовщины).
-    """
-    pair_id = pair["id"]
-    start = pair["start_date"]
-    if start is None:
-        return
-
-    today = _date.today()
-
-    # Если дата в будущем – игнорируем, что-то ввели странно
-    if start > today:
-        return
-
-    # Текущая/следующая годовщина
-    anniv_this_year = _date(today.year, start.month, start.day)
-
-    if anniv_this_year >= today:
-        upcoming_anniv = anniv_this_year
-    else:
-        upcoming_anniv = _date(today.year + 1, start.month, start.day)
-
-    # какой это по счёту год
-    year_n = upcoming_anniv.year - start.year
-    if year_n <= 0:
-        return  # до первой годовщины ещё не дожили
-
-    days_to_anniv = (upcoming_anniv - today).days
-
-    # 7 дней до годовщины
-    if days_to_anniv == 7:
-        if not notification_already_sent(pair_id, "year_anniversary_7d", "year", str(year_n)):
-            send_year_anniversary_7d(pair, year_n, upcoming_anniv)
-            log_notification(pair_id, "year_anniversary_7d", {"year": year_n})
-
-    # 1 день до годовщины
-    if days_to_anniv == 1:
-        if not notification_already_sent(pair_id, "year_anniversary_1d", "year", str(year_n)):
-            send_year_anniversary_1d(pair, year_n, upcoming_anniv)
-            log_notification(pair_id, "year_anniversary_1d", {"year": year_n})
-
-    # В день годовщины
-    if days_to_anniv == 0 and upcoming_anniv == today:
-        if not notification_already_sent(pair_id, "year_anniversary", "year", str(year_n)):
-            send_year_anniversary(pair, year_n)
-            log_notification(pair_id, "year_anniversary", {"year": year_n})
-
-
-def handle_beautiful_days_for_pair(pair):
+def handle_events_for_pair(pair, calendar):
     """
-    Обработка красивых чисел дней: 100, 200, 500, 1000 и т.д.
+    События пары на сегодня (см. pair_calendar): напоминания за 7 и 1 день
+    до годовщины, годовщина, красивое число дней. Каждое — один раз.
+    Для прошедшего дня (pair["event_day"]) — без напоминаний.
     """
-    pair_id = pair["id"]
-    start = pair["start_date"]
-    if start is None:
-        return
-
-    today = _date.today()
-    if start > today:
-        return
+    for notif_type, payload in calendar["due_events"]:
+        if pair.get("event_day") and notif_type in ANNIVERSARY_REMINDERS.values():
+            continue
+        send_event(pair, calendar, notif_type, payload)
 
-    days_together = (today - start).days
 
-    if days_together in BEAUTIFUL_DAYS:
-        if not notification_already_sent(pair_id, "beautiful_day", "days", str(days_together)):
-            send_beautiful_day(pair, days_together)
-            log_notification(pair_id, "beautiful_day", {"days": days_together})
+def send_event(pair, calendar, notif_type: str, payload: dict) -> bool:
+    """Занять событие и поставить сообщения в outbox; False — уже занято."""
+    key = event_key(payload)
+    if not claim_notification(pair["id"], notif_type, key, payload):
+        return False
+    try:
+        SENDERS[notif_type](pair, calendar, next(iter(payload.values())))
+    except Exception:
+        # в unit of work занятие откатится вместе с транзакцией,
+        # вне его (autocommit) — снимаем явно
+        if current_unit_of_work() is None:
+            release_notification(pair["id"], notif_type, key)
+        raise
+    return True
 
 
 # ====== Функции отправки сообщений ======
 
 def send_to_pair(pair, text: str):
+    # Сообщения уходят через outbox: воркер отправит их в пределах лимитов
+    # Telegram, повторит при 429 и сбоях, а запись в лог и постановка
+    # в очередь коммитятся вместе (unit of work на пару в main).
+    # pair["send_at"] — время доставки каждому участнику (режим --daemon);
+    # участника, которого там нет, планировщик пропустил: его день уже прошёл.
     tg_ids = get_pair_telegram_ids(pair)
+    send_at = pair.get("send_at")
     for tg_id in tg_ids:
-        try:
-            bot.send_message(tg_id, text)
-        except Exception as e:
-            print(f"Failed to send to {tg_id}: {e}")
+        if send_at is not None and tg_id not in send_at:
+            continue
+        enqueue_message(
+            tg_id, text, priority=PRIORITY_SCHEDULED,
+            send_at=send_at.get(tg_id) if send_at is not None else None,
+        )
 
 
 def send_year_anniversary_7d(pair, year_n: int, date_anniv: _date):
@@ -173,38 +315,372 @@ def send_year_anniversary_1d(pair, year_n: int, date_anniv: _date):
     send_to_pair(pair, text)
 
 
-def send_year_anniversary(pair, year_n: int):
-    text = (
-        f"🎉 Сегодня ваш маленький праздник!\n\n"
-        f"Вам исполнилось <b>{year_n}</b> лет вместе 💖\n"
-        f"Хороший повод обняться подольше, чем обычно 🥰"
-    )
+def send_year_anniversary(pair, year_n: int, event_day: Optional[_date] = None):
+    # event_day — догоняющий прогон за прошедший день: пишем дату, а не «сегодня»
+    if event_day:
+        text = (
+            f"🎉 {event_day.strftime('%d.%m.%Y')} был ваш маленький праздник!\n\n"
+            f"Вам исполнилось <b>{year_n}</b> лет вместе 💖\n"
+            f"Никогда не поздно обняться подольше, чем обычно 🥰"
+        )
+    else:
+        text = (
+            f"🎉 Сегодня ваш маленький праздник!\n\n"
+            f"Вам исполнилось <b>{year_n}</b> лет вместе 💖\n"
+            f"Хороший повод обняться подольше, чем обычно 🥰"
+        )
     send_to_pair(pair, text)
 
 
-def send_beautiful_day(pair, days_together: int):
-    text = (
-        f"✨ Красивое число: сегодня вы вместе уже <b>{days_together}</b> дней! 💫\n\n"
-        f"Пусть этот день будет таким же особенным, как и ваше «вместе» 💕"
-    )
+def send_beautiful_day(pair, days_together: int, event_day: Optional[_date] = None):
+    if event_day:
+        text = (
+            f"✨ Красивое число: {event_day.strftime('%d.%m.%Y')} вам исполнилось "
+            f"<b>{days_together}</b> дней вместе! 💫\n\n"
+            f"Пусть этот день останется таким же особенным, как и ваше «вместе» 💕"
+        )
+    else:
+        text = (
+            f"✨ Красивое число: сегодня вы вместе уже <b>{days_together}</b> дней! 💫\n\n"
+            f"Пусть этот день будет таким же особенным, как и ваше «вместе» 💕"
+        )
     send_to_pair(pair, text)
 
 
-def main():
-    print("Notifier started")
+# тип уведомления -> отправка (pair, календарь, значение из payload);
+# pair["event_day"] есть только в догоняющем прогоне (--date в прошлом)
+SENDERS = {
+    "year_anniversary_7d": lambda pair, cal, year_n: send_year_anniversary_7d(pair, year_n, cal["next_anniversary"]),
+    "year_anniversary_1d": lambda pair, cal, year_n: send_year_anniversary_1d(pair, year_n, cal["next_anniversary"]),
+    "year_anniversary": lambda pair, cal, year_n: send_year_anniversary(pair, year_n, pair.get("event_day")),
+    "beautiful_day": lambda pair, cal, days: send_beautiful_day(pair, days, pair.get("event_day")),
+}
+
+
+def group_by_pair(rows) -> Dict[int, List[Dict[str, Any]]]:
+    # строки одной пары идут подряд (ORDER BY p.id)
+    by_pair = {}
+    for row in rows:
+        by_pair.setdefault(row["id"], []).append(row)
+    return by_pair
+
+
+def send_due_pair(pair, pair_rows, today: _date) -> int:
+    """
+    События одной пары под точкой сохранения: при ошибке откатываются только
+    они (исключение пробрасывается), остальная пачка остаётся. Возвращает
+    число поставленных в outbox событий.
+    """
+    calendar = relationship_calendar(pair["start_date"], today)
+    execute("SAVEPOINT notifier_pair")
+    try:
+        sent = sum(send_event(pair, calendar, row["notif_type"], row["payload"]) for row in pair_rows)
+    except Exception:
+        execute("ROLLBACK TO SAVEPOINT notifier_pair")
+        raise
+    execute("RELEASE SAVEPOINT notifier_pair")
+    return sent
+
+
+def backfill_pair(pair, today: _date):
+    """Пара для отправки за день today: в прошедший день — с event_day (текст с датой)."""
+    return dict(pair, event_day=today) if today < _date.today() else pair
+
+
+def process_due_batch(params, today: _date, run_id: int, stats: dict, failed: set, pair_ids=None) -> bool:
+    """
+    Одна транзакция воркера: забрать пачку (пары pair_ids или следующие
+    NOTIFIER_BATCH_SIZE событий), занять события, поставить сообщения
+    в outbox и записать счётчики прогона, COMMIT. Каждая пара — под своей
+    точкой сохранения: ошибка одной пары не откатывает остальные, а сама
+    пара больше не выбирается этим воркером. False — выбирать нечего.
+    """
+    with unit_of_work():
+        if pair_ids is None:
+            rows = get_due_events(params, skip=failed)
+        else:
+            rows = get_due_events(params, limit=None, skip=failed, pair_ids=pair_ids)
+        if not rows:
+            return False
+
+        batch = {"events": 0, "pairs": 0, "failed": 0}
+        for pair_id, pair_rows in group_by_pair(rows).items():
+            try:
+                sent = send_due_pair(backfill_pair(pair_rows[0], today), pair_rows, today)
+            except Exception as e:
+                failed.add(pair_id)
+                batch["failed"] += 1
+                print(f"Error processing pair {pair_id}: {e}")
+                continue
+            if sent:
+                batch["events"] += sent
+                batch["pairs"] += 1
+
+        record_run_progress(run_id, batch["events"], batch["failed"])
+
+    for key, value in batch.items():
+        stats[key] += value
+    return True
+
+
+def notifier_worker(params, today: _date, checkpoint: RunCheckpoint, chunks: "queue.Queue", stats: dict) -> None:
+    """
+    Сначала пачки пар из общего списка запуска (выборка по первичному
+    ключу — дёшево), затем добор полным запросом по всем due-парам: пары,
+    которых не было в списке, которые в момент выборки держал другой
+    процесс или которые остались ниже контрольной точки после сбоя.
+    Поэтому контрольная точка только сокращает работу перезапуска,
+    а от повторной отправки защищает notifications_log.
+    """
+    failed = set()
+
+    def guarded(fn) -> bool:
+        try:
+            return fn()
+        except Exception as e:
+            # ошибка самой выборки или COMMIT — пачка откатилась целиком
+            print(f"Notifier worker error: {e}")
+            stats["errors"] += 1
+            time.sleep(1)
+            return stats["errors"] < 3
+
+    def process_chunk(index: int, chunk: List[int]) -> bool:
+        process_due_batch(params, today, checkpoint.run_id, stats, failed, chunk)
+        checkpoint.chunk_done(index)
+        return True
+
+    while True:
+        try:
+            index, chunk = chunks.get_nowait()
+        except queue.Empty:
+            break
+        if not guarded(lambda: process_chunk(index, chunk)):
+            return
+    while guarded(lambda: process_due_batch(params, today, checkpoint.run_id, stats, failed)):
+        pass
+
+
+def run_due_events(today: _date, workers: int = NOTIFIER_WORKERS) -> None:
+    """
+    Обычный режим: workers потоков разбирают пачки событий дня, строки
+    пар захватываются через FOR NO KEY UPDATE SKIP LOCKED — так же делятся
+    пары и между процессами на разных хостах. Прогон за дату ведётся
+    в notifier_runs: перезапуск после сбоя продолжает с контрольной точки.
+    День в прошлом (--date) — догоняющий прогон без напоминаний. В конце —
+    отчёт о пропускной способности.
+    """
+    params = due_events_params(today, reminders=today >= _date.today())
+    if params is None:
+        print(f"No events for {today.isoformat()}")
+        return
+
+    started = time.perf_counter()
+    run = start_run(today)
+    if run["last_pair_id"] or run["sent"] or run["failed"]:
+        print(
+            f"Resuming run {run['id']} for {today.isoformat()} after pair {run['last_pair_id']} "
+            f"({run['sent']} sent, {run['failed']} failed so far)"
+        )
+    else:
+        print(f"Run {run['id']} for {today.isoformat()}")
+
+    pair_chunks = due_pair_chunks(params, after=run["last_pair_id"])
+    checkpoint = RunCheckpoint(run["id"], pair_chunks)
+    chunks = queue.Queue()
+    for item in enumerate(pair_chunks):
+        chunks.put(item)
+
+    stats = [{"events": 0, "pairs": 0, "failed": 0, "errors": 0} for _ in range(max(1, workers))]
+    threads = [
+        threading.Thread(
+            target=notifier_worker, args=(params, today, checkpoint, chunks, worker_stats), name=f"notifier-{i}"
+        )
+        for i, worker_stats in enumerate(stats)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    events = sum(s["events"] for s in stats)
+    print(
+        f"Notified {events} events for {sum(s['pairs'] for s in stats)} pairs "
+        f"({sum(s['failed'] for s in stats)} failed) in {elapsed:.2f}s: "
+        f"{events / elapsed if elapsed else 0:.0f} events/s, {len(threads)} workers"
+    )
+    print("  per worker: " + ", ".join(str(s["events"]) for s in stats))
+
+    if any(s["errors"] >= 3 for s in stats):
+        # воркер сдался — прогон остаётся открытым, следующий запуск продолжит
+        print(f"Run {run['id']} interrupted, rerun to resume")
+        return
+    totals = finish_run(run["id"])
+    print(f"Run {run['id']} finished: {totals['sent']} sent, {totals['failed']} failed in total")
+
+
+# ====== Режим --daemon: доставка по местному времени участников ======
+
+def plan_delivery(pair, day: _date, now: datetime) -> Optional[Dict[int, datetime]]:
+    """
+    {telegram_id: момент доставки} события дня day участникам пары (см.
+    delivery.py) или None — ещё рано: до самой ранней доставки больше
+    NOTIFIER_PLAN_AHEAD. Участник, у которого местный день day уже кончился,
+    в план не попадает — сообщение «на сегодня» пришло бы ему на следующий
+    день; кончился у всех — тоже None: пропущенные дни догоняет `--date`.
+    """
+    members = [m for m in pair.get("members") or [] if local_day_end(day, m["timezone"]) > now]
+    if not members:
+        return None
+    send_at = {
+        m["telegram_id"]: delivery_time(m["telegram_id"], day, m["timezone"], m["notify_hour"])
+        for m in members
+    }
+    if min(send_at.values()) > now + timedelta(seconds=NOTIFIER_PLAN_AHEAD):
+        return None
+    return send_at
+
+
+def plan_due_batch(params, day: _date, pair_ids: List[int], now: datetime, stats: dict) -> None:
+    """
+    Одна транзакция планировщика: из пачки due-пар дня day занять события
+    тех, чьё время доставки подошло, и поставить сообщения в outbox
+    с send_at — outbox придержит их до нужного момента.
+    """
+    with unit_of_work():
+        rows = get_due_events(params, limit=None, pair_ids=pair_ids)
+        for pair_id, pair_rows in group_by_pair(rows).items():
+            send_at = plan_delivery(pair_rows[0], day, now)
+            if send_at is None:
+                continue
+            try:
+                sent = send_due_pair(dict(pair_rows[0], send_at=send_at), pair_rows, day)
+            except Exception as e:
+                stats["failed"] += 1
+                print(f"Error planning pair {pair_id}: {e}")
+                continue
+            if sent:
+                stats["events"] += sent
+                stats["pairs"] += 1
+
+
+def plan_due_events(now: datetime) -> dict:
+    """
+    Один проход планировщика. Местная дата любого пользователя — вчера,
+    сегодня или завтра по UTC, поэтому проверяются события этих трёх дней.
+    """
+    stats = {"events": 0, "pairs": 0, "failed": 0}
+    utc_day = now.astimezone(timezone.utc).date()
+    for day in (utc_day - timedelta(days=1), utc_day, utc_day + timedelta(days=1)):
+        params = due_events_params(day)
+        if params is None:
+            continue
+        for pair_ids in due_pair_chunks(params):
+            plan_due_batch(params, day, pair_ids, now, stats)
+    return stats
+
+
+def run_scheduler(interval: float = NOTIFIER_SCHEDULER_INTERVAL) -> None:
+    """
+    Постоянно работающий планировщик: каждые interval секунд занимает
+    события, время доставки которых подошло, и кладёт сообщения в outbox
+    на местное время каждого участника. Отправки размазаны по дню — нет
+    утреннего всплеска запросов к Telegram и БД. Раз в сутки чистит журнал
+    изменений. Вместо cron с `python notifier.py`, не вместе с ним (вместе
+    не страшно — событие всё равно отправится один раз, но не по местному времени).
+    """
+    print(f"Notifier scheduler started: every {interval:.0f}s, planning {NOTIFIER_PLAN_AHEAD:.0f}s ahead")
+    pruned_on = None
+    while True:
+        started = time.perf_counter()
+        now = datetime.now(timezone.utc)
+        try:
+            stats = plan_due_events(now)
+            if stats["events"] or stats["failed"]:
+                print(
+                    f"{now:%Y-%m-%d %H:%M} planned {stats['events']} events for {stats['pairs']} pairs "
+                    f"({stats['failed']} failed) in {time.perf_counter() - started:.2f}s"
+                )
+        except Exception as e:
+            print(f"Scheduler error: {e}")
+
+        if pruned_on != now.date():
+            try:
+                print(f"Pruned {prune_pair_changes()} pair change log rows")
+                pruned_on = now.date()
+            except Exception as e:
+                print(f"Failed to prune pair change log: {e}")
+
+        time.sleep(max(0.0, interval - (time.perf_counter() - started)))
+
+
+def run_full_scan(today: _date) -> None:
+    """Прежний режим: перебор всех пар с датой начала (для сверки)."""
     pairs = get_all_pairs_with_start_date()
-    today = _date.today()
     print(f"Processing {len(pairs)} pairs for date {today.isoformat()}")
+    # одинаковые даты начала считаются один раз
+    calendars = calendars_for((pair["start_date"] for pair in pairs), today)
 
     for pair in pairs:
+        calendar = calendars[pair["start_date"]]
+        if not calendar["due_events"]:
+            continue
         try:
-            handle_anniversaries_for_pair(pair)
-            handle_beautiful_days_for_pair(pair)
+            with unit_of_work():
+                handle_events_for_pair(backfill_pair(pair, today), calendar)
         except Exception as e:
             print(f"Error processing pair {pair['id']}: {e}")
 
+
+def past_or_today(value: str) -> _date:
+    """--date: день не позже сегодняшнего — будущие события занимать рано."""
+    try:
+        day = _date.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid date {value!r}, expected YYYY-MM-DD")
+    if day > _date.today():
+        raise argparse.ArgumentTypeError(f"{value} is in the future: events are sent on their own day")
+    return day
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send anniversary and milestone notifications")
+    parser.add_argument("--full-scan", action="store_true", help="check every pair instead of querying due events")
+    parser.add_argument("--workers", type=int, default=NOTIFIER_WORKERS, help="parallel workers in this process")
+    parser.add_argument(
+        "--date", type=past_or_today, action="append", dest="dates", metavar="YYYY-MM-DD",
+        help="run for this date instead of today (repeat to backfill several days)",
+    )
+    parser.add_argument(
+        "--daemon", action="store_true",
+        help="keep running and deliver at each member's local time and preferred hour",
+    )
+    args = parser.parse_args()
+
+    print("Notifier started")
+    init_pool()
+    if args.daemon:
+        try:
+            run_scheduler()
+        except KeyboardInterrupt:
+            print("Notifier stopped")
+        return
+
+    for today in sorted(args.dates or [_date.today()]):
+        if args.full_scan:
+            run_full_scan(today)
+        else:
+            run_due_events(today, args.workers)
+
+    # Ежедневная уборка журнала изменений для /api/sync
+    try:
+        pruned = prune_pair_changes()
+        print(f"Pruned {pruned} pair change log rows")
+    except Exception as e:
+        print(f"Failed to prune pair change log: {e}")
+
     print("Notifier finished")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
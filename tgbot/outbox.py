@@ -0,0 +1,434 @@
+"""
+Исходящие сообщения Telegram через outbox.
+
+Код запроса (хендлер бота, эндпоинт вебаппа) не ходит в Telegram сам, а кладёт
+сообщение в таблицу outbox — в той же транзакции (unit of work), что
+и изменение данных. Поэтому уведомление уходит, только если изменение
+закоммитилось, а время ответа не зависит от Telegram API.
+
+Отправляет воркер — отдельный процесс:
+    python outbox.py
+
+Воркер — общий планировщик отправки для бота, вебаппа и нотифаера:
+- забирает готовые строки по приоритету (SKIP LOCKED); плановое сообщение
+  (send_at) ждёт в очереди до своего времени — next_attempt_at;
+- держит лимиты Telegram: глобальный token bucket (OUTBOX_RATE сообщений
+  в секунду — с запасом под прямые ответы бота, которые идут мимо outbox)
+  и не чаще одного сообщения в OUTBOX_CHAT_INTERVAL секунд в чат;
+  строка в чат, который ещё «остывает», откладывается без траты попытки;
+- шлёт параллельно (OUTBOX_CONCURRENCY потоков), чтобы задержка сети
+  не съедала пропускную способность;
+- на 429 ставит на паузу и чат, и весь поток отправки на retry_after.
+
+При ошибке — повтор с экспоненциальной задержкой, после OUTBOX_MAX_ATTEMPTS
+попыток или при постоянной ошибке (бот заблокирован, чат не найден) строка
+уходит в dead и больше не отправляется. Взятая строка «арендуется» на
+OUTBOX_LEASE секунд: если воркер упал посреди отправки, её подхватит
+другой (доставка at-least-once). Лимиты считаются в процессе воркера —
+запускайте один воркер на бота.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import random
+import select
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from io import BytesIO
+from typing import Any, Dict, List, Optional
+
+import telebot
+from telebot.apihelper import ApiTelegramException
+from psycopg2 import Binary
+
+try:
+    from config import BOT_TOKEN
+    from db import connect, execute, execute_returning_all, fetchall, init_pool
+    from export import send_wishlist_export
+    import metrics
+    from services import prune_export_cache
+except ModuleNotFoundError:
+    from tgbot.config import BOT_TOKEN
+    from tgbot.db import connect, execute, execute_returning_all, fetchall, init_pool
+    from tgbot.export import send_wishlist_export
+    from tgbot import metrics
+    from tgbot.services import prune_export_cache
+
+
+CHANNEL = "fambot_outbox"
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "20"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "2"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "600"))
+OUTBOX_LEASE = float(os.getenv("OUTBOX_LEASE", "120"))
+# Страховочный опрос, если NOTIFY потерялся (сек.)
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+# Сколько дней хранить отправленные
+OUTBOX_KEEP_SENT_DAYS = int(os.getenv("OUTBOX_KEEP_SENT_DAYS", "7"))
+# Лимиты Telegram: ~30 сообщений в секунду на бота, ~1 в секунду в один чат.
+# Ответы бота (send_or_edit в хендлерах) идут в Bot API напрямую, мимо этого
+# лимита и из другого процесса, поэтому воркер берёт не все 30/с, а оставляет
+# запас под интерактивные ответы: сумма не должна превышать лимит Telegram.
+OUTBOX_RATE = float(os.getenv("OUTBOX_RATE", "25"))
+OUTBOX_CHAT_INTERVAL = float(os.getenv("OUTBOX_CHAT_INTERVAL", "1"))
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "8"))
+# Сколько дней хранить file_id выгрузок, к которым не обращались
+EXPORT_CACHE_DAYS = int(os.getenv("EXPORT_CACHE_DAYS", "30"))
+
+# Приоритеты: чем больше, тем раньше уйдёт
+PRIORITY_SCHEDULED = 0     # плановые уведомления нотифаера
+PRIORITY_NOTIFICATION = 5  # уведомления партнёру о действиях в паре
+PRIORITY_INTERACTIVE = 10  # ответ на действие пользователя (файл списка)
+
+# Ошибки Telegram, которые повтором не исправить
+PERMANENT_ERROR_CODES = {400, 403, 404}
+
+
+# ===== Постановка в очередь (вызывается в транзакции запроса) =====
+
+
+def enqueue_message(
+    chat_id: int,
+    text: str,
+    parse_mode: Optional[str] = "HTML",
+    reply_markup=None,
+    priority: int = PRIORITY_NOTIFICATION,
+    send_at: Optional[datetime] = None,
+) -> None:
+    """
+    Поставить сообщение в outbox. reply_markup — объект telebot или JSON-строка.
+    send_at — не отправлять раньше этого момента (плановые уведомления).
+    """
+    execute(*message_insert(chat_id, text, parse_mode, reply_markup, priority, send_at))
+
+
+def message_insert(
+    chat_id: int,
+    text: str,
+    parse_mode: Optional[str] = "HTML",
+    reply_markup=None,
+    priority: int = PRIORITY_NOTIFICATION,
+    send_at: Optional[datetime] = None,
+):
+    """(SQL, параметры) вставки сообщения — для асинхронного слоя БД (tgbot/adb.py)."""
+    if reply_markup is not None and hasattr(reply_markup, "to_json"):
+        reply_markup = reply_markup.to_json()
+    payload = {"text": text, "parse_mode": parse_mode, "reply_markup": reply_markup}
+    return (
+        """
+        INSERT INTO outbox (kind, chat_id, payload, priority, next_attempt_at)
+        VALUES ('message', %s, %s, %s, COALESCE(%s, NOW()))
+        """,
+        (chat_id, json.dumps(payload, ensure_ascii=False), priority, send_at),
+    )
+
+
+def enqueue_document(
+    chat_id: int,
+    data: bytes,
+    filename: str,
+    caption: Optional[str] = None,
+    priority: int = PRIORITY_INTERACTIVE,
+) -> None:
+    """Поставить файл в outbox (содержимое хранится в строке до отправки)."""
+    payload = {"filename": filename, "caption": caption}
+    execute(
+        """
+        INSERT INTO outbox (kind, chat_id, payload, document, priority)
+        VALUES ('document', %s, %s, %s, %s)
+        """,
+        (chat_id, json.dumps(payload, ensure_ascii=False), Binary(data), priority),
+    )
+
+
+def enqueue_export(
+    chat_id: int,
+    pair_id: int,
+    owner_user_id: int,
+    sheet_name: str,
+    priority: int = PRIORITY_INTERACTIVE,
+) -> None:
+    """
+    Поставить в outbox выгрузку вишлиста в XLSX. Файл собирает воркер
+    в момент отправки (или пересылает уже загруженный по file_id).
+    """
+    payload = {"pair_id": pair_id, "owner_user_id": owner_user_id, "sheet_name": sheet_name}
+    execute(
+        "INSERT INTO outbox (kind, chat_id, payload, priority) VALUES ('export', %s, %s, %s)",
+        (chat_id, json.dumps(payload, ensure_ascii=False), priority),
+    )
+
+
+# ===== Воркер =====
+
+
+def claim_batch(limit: int = OUTBOX_BATCH_SIZE) -> List[Dict[str, Any]]:
+    """
+    Взять до limit строк, готовых к отправке. Попытка засчитывается сразу,
+    а next_attempt_at сдвигается на OUTBOX_LEASE — это и есть аренда строки.
+    """
+    # без повтора при обрыве: повтор взял бы вторую пачку, а первая
+    # висела бы невидимой до конца аренды
+    return execute_returning_all(
+        """
+        UPDATE outbox SET
+            attempts = attempts + 1,
+            next_attempt_at = NOW() + make_interval(secs => %s)
+        WHERE id IN (
+            SELECT id FROM outbox
+            WHERE status = 'pending' AND next_attempt_at <= NOW()
+            ORDER BY priority DESC, next_attempt_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING *
+        """,
+        (OUTBOX_LEASE, limit),
+    ) or []
+
+
+def mark_sent(outbox_id: int) -> None:
+    execute(
+        "UPDATE outbox SET status = 'sent', sent_at = NOW(), document = NULL, last_error = NULL WHERE id = %s",
+        (outbox_id,),
+    )
+
+
+def defer(outbox_id: int, delay: float) -> None:
+    """Отложить взятую строку (чат ещё «остывает»), не тратя попытку."""
+    execute(
+        """
+        UPDATE outbox SET
+            next_attempt_at = NOW() + make_interval(secs => %s),
+            attempts = attempts - 1
+        WHERE id = %s
+        """,
+        (delay, outbox_id),
+    )
+
+
+def retry_after_of(error: Exception) -> Optional[float]:
+    """retry_after из ответа 429 Telegram, иначе None."""
+    if isinstance(error, ApiTelegramException) and error.error_code == 429:
+        params = (error.result_json or {}).get("parameters") or {}
+        return float(params.get("retry_after") or 1)
+    return None
+
+
+def mark_failed(row: Dict[str, Any], error: Exception) -> None:
+    """Запланировать повтор или отправить в dead."""
+    retry_after = retry_after_of(error)
+    permanent = isinstance(error, ApiTelegramException) and error.error_code in PERMANENT_ERROR_CODES
+
+    if permanent or (retry_after is None and row["attempts"] >= OUTBOX_MAX_ATTEMPTS):
+        execute(
+            "UPDATE outbox SET status = 'dead', last_error = %s WHERE id = %s",
+            (str(error)[:1000], row["id"]),
+        )
+        print(f"Outbox message {row['id']} is dead after {row['attempts']} attempts: {error}")
+        return
+
+    if retry_after is None:
+        delay = min(OUTBOX_BACKOFF_BASE ** row["attempts"], OUTBOX_BACKOFF_MAX)
+        delay *= random.uniform(0.8, 1.2)
+    else:
+        # 429 — не ошибка сообщения: попытку не засчитываем
+        delay = retry_after
+    execute(
+        """
+        UPDATE outbox SET
+            next_attempt_at = NOW() + make_interval(secs => %s),
+            attempts = attempts - %s,
+            last_error = %s
+        WHERE id = %s
+        """,
+        (delay, 1 if retry_after is not None else 0, str(error)[:1000], row["id"]),
+    )
+
+
+def send_row(bot: telebot.TeleBot, row: Dict[str, Any]) -> None:
+    payload = row["payload"] or {}
+    if row["kind"] == "message":
+        bot.send_message(
+            row["chat_id"],
+            payload["text"],
+            parse_mode=payload.get("parse_mode"),
+            reply_markup=payload.get("reply_markup"),
+        )
+    elif row["kind"] == "export":
+        send_wishlist_export(
+            bot,
+            row["chat_id"],
+            payload["pair_id"],
+            payload["owner_user_id"],
+            payload.get("sheet_name") or "Wishlist",
+        )
+    else:
+        document = BytesIO(bytes(row["document"]))
+        # telebot берёт имя файла из .name
+        document.name = payload.get("filename") or "file"
+        bot.send_document(row["chat_id"], document, caption=payload.get("caption"))
+
+
+class TokenBucket:
+    """
+    Глобальный лимит: не больше rate отправок в секунду. burst — сколько можно
+    отправить подряд после простоя; в любом окне в 1 с уходит не больше
+    burst + rate, поэтому по умолчанию burst = 1 (ровный темп).
+    """
+
+    def __init__(self, rate: float, burst: float = 1) -> None:
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+    def acquire(self) -> None:
+        """Дождаться токена (и конца паузы после 429)."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now >= self.paused_until:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    self.updated = self.paused_until
+                    wait = self.paused_until - now
+            time.sleep(wait)
+
+
+class SendScheduler:
+    """Отправка строк outbox с глобальным и per-chat лимитами."""
+
+    def __init__(self, bot: telebot.TeleBot) -> None:
+        self.bot = bot
+        self.bucket = TokenBucket(OUTBOX_RATE)
+        self.pool = ThreadPoolExecutor(max_workers=OUTBOX_CONCURRENCY, thread_name_prefix="outbox-send")
+        # chat_id -> monotonic-время, раньше которого в чат не пишем
+        self._chat_ready: Dict[int, float] = {}
+        self._chat_lock = threading.Lock()
+
+    def _reserve_chat(self, chat_id: int) -> float:
+        """Занять слот чата. 0 — можно слать сейчас, иначе через сколько секунд."""
+        now = time.monotonic()
+        with self._chat_lock:
+            ready_at = self._chat_ready.get(chat_id, 0.0)
+            if ready_at > now:
+                return ready_at - now
+            self._chat_ready[chat_id] = now + OUTBOX_CHAT_INTERVAL
+            if len(self._chat_ready) > 10000:
+                self._chat_ready = {c: t for c, t in self._chat_ready.items() if t > now}
+            return 0.0
+
+    def _hold_chat(self, chat_id: int, seconds: float) -> None:
+        with self._chat_lock:
+            self._chat_ready[chat_id] = max(self._chat_ready.get(chat_id, 0.0), time.monotonic() + seconds)
+
+    def _send(self, row: Dict[str, Any]) -> None:
+        try:
+            send_row(self.bot, row)
+        except Exception as e:
+            retry_after = retry_after_of(e)
+            if retry_after is not None:
+                # Лимиты мы держим сами, значит Telegram притормаживает весь бот
+                self._hold_chat(row["chat_id"], retry_after)
+                self.bucket.pause(retry_after)
+            mark_failed(row, e)
+        else:
+            mark_sent(row["id"])
+
+    def process_batch(self) -> int:
+        """Отправить одну пачку. Возвращает число взятых строк."""
+        rows = claim_batch()
+        futures = []
+        for row in rows:
+            wait = self._reserve_chat(row["chat_id"])
+            if wait:
+                defer(row["id"], wait)
+                continue
+            self.bucket.acquire()
+            futures.append(self.pool.submit(self._send, row))
+        for future in futures:
+            future.result()
+        return len(rows)
+
+
+def seconds_until_next() -> Optional[float]:
+    """Через сколько секунд наступит ближайшая отправка (None — очередь пуста)."""
+    row = fetchall(
+        """
+        SELECT GREATEST(EXTRACT(EPOCH FROM MIN(next_attempt_at) - NOW()), 0) AS wait
+        FROM outbox WHERE status = 'pending'
+        """
+    )
+    wait = row[0]["wait"] if row else None
+    return None if wait is None else float(wait)
+
+
+def prune_sent(days: int = OUTBOX_KEEP_SENT_DAYS) -> None:
+    execute(
+        "DELETE FROM outbox WHERE status = 'sent' AND sent_at < NOW() - make_interval(days => %s)",
+        (days,),
+    )
+    prune_export_cache(EXPORT_CACHE_DAYS)
+
+
+def run_worker() -> None:
+    """Бесконечный цикл: отправить всё готовое, затем ждать NOTIFY или таймер."""
+    init_pool()
+    metrics.instrument_telegram()
+    metrics.serve()
+    scheduler = SendScheduler(telebot.TeleBot(BOT_TOKEN, parse_mode="HTML"))
+    listen_conn = None
+    last_prune = 0.0
+    print("Outbox worker started")
+
+    while True:
+        try:
+            if listen_conn is None:
+                listen_conn = connect()
+                with listen_conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CHANNEL}")
+
+            while scheduler.process_batch():
+                pass
+
+            if time.monotonic() - last_prune > 3600:
+                prune_sent()
+                last_prune = time.monotonic()
+
+            # ждём новых строк (NOTIFY) или срока ближайшей отложенной
+            wait = seconds_until_next()
+            timeout = OUTBOX_POLL_INTERVAL if wait is None else min(wait, OUTBOX_POLL_INTERVAL)
+            if select.select([listen_conn], [], [], timeout)[0]:
+                listen_conn.poll()
+                listen_conn.notifies.clear()
+        except Exception as e:
+            print(f"Outbox worker error: {e}")
+            if listen_conn is not None:
+                try:
+                    listen_conn.close()
+                except Exception:
+                    pass
+                listen_conn = None
+            time.sleep(OUTBOX_POLL_INTERVAL)
+
+
+if __name__ == "__main__":
+    run_worker()
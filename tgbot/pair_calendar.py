@@ -0,0 +1,223 @@
+"""
+Календарь пары: всё, что считается от даты начала отношений.
+
+Одна реализация для бота (flows.py, handlers.py), вебаппа (/api/init)
+и нотифаера: сколько вместе, годовщины, прогресс до следующей,
+«красивые» числа дней, крупные юбилеи и события, которые наступают
+в конкретный день (напоминания за 7 и 1 день, годовщина, красивое число).
+
+Годовщина 29 февраля в невисокосный год — 28 февраля.
+
+Результат relationship_calendar() зависит только от (start, today), поэтому
+кэшируется; кэш сбрасывается при смене календарного дня. Возвращаемый
+словарь общий для всех вызывающих — не изменяйте его.
+"""
+
+from __future__ import annotations
+
+import calendar
+import os
+import threading
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+try:
+    from cache import TTLCache
+except ModuleNotFoundError:
+    from tgbot.cache import TTLCache
+
+
+# «Красивые» числа дней вместе
+MILESTONE_DAYS = (100, 200, 300, 400, 500, 600, 700, 800, 900, 1000, 1500, 2000, 2500, 3000)
+# Крупный юбилей — каждые N лет
+BIG_ANNIVERSARY_STEP = 5
+# За сколько дней до годовщины напоминать: дней -> тип уведомления
+ANNIVERSARY_REMINDERS = {7: "year_anniversary_7d", 1: "year_anniversary_1d"}
+
+# Насколько давние даты начала проверять при поиске событий дня (лет)
+MAX_RELATIONSHIP_YEARS = 120
+
+CALENDAR_CACHE_SIZE = int(os.getenv("CALENDAR_CACHE_SIZE", "10000"))
+
+_cache = TTLCache(CALENDAR_CACHE_SIZE, ttl=86400)
+_cache_day: Optional[date] = None
+_cache_lock = threading.Lock()
+
+
+def anniversary(start: date, years: int) -> date:
+    """Дата years-й годовщины (29.02 в невисокосный год — 28.02)."""
+    year = start.year + years
+    day = min(start.day, calendar.monthrange(year, start.month)[1])
+    return date(year, start.month, day)
+
+
+def completed_years(start: date, today: date) -> int:
+    years = today.year - start.year
+    if years > 0 and anniversary(start, years) > today:
+        years -= 1
+    return max(years, 0)
+
+
+def _completed_months(start: date, last_anniv: date, today: date) -> int:
+    months = (today.year - last_anniv.year) * 12 + (today.month - last_anniv.month)
+    # «месячина» в коротком месяце — в его последний день
+    if today.day < min(start.day, calendar.monthrange(today.year, today.month)[1]):
+        months -= 1
+    return max(months, 0)
+
+
+def _next_milestone(days_together: int) -> Optional[int]:
+    for days in MILESTONE_DAYS:
+        if days > days_together:
+            return days
+    return None
+
+
+def _due_events(start: date, today: date, years: int, days_together: int, next_anniv: date):
+    """События, которые наступают ровно сегодня: ((тип, payload), ...)."""
+    events = []
+    days_to_anniv = (next_anniv - today).days
+    if days_to_anniv in ANNIVERSARY_REMINDERS:
+        events.append((ANNIVERSARY_REMINDERS[days_to_anniv], {"year": years + 1}))
+    if years > 0 and anniversary(start, years) == today:
+        events.append(("year_anniversary", {"year": years}))
+    if days_together in MILESTONE_DAYS:
+        events.append(("beautiful_day", {"days": days_together}))
+    return tuple(events)
+
+
+def _compute(start: date, today: date) -> Dict[str, Any]:
+    if start > today:
+        return {"start_date": start, "today": today, "future": True, "due_events": ()}
+
+    days_together = (today - start).days
+    years = completed_years(start, today)
+    last_anniv = anniversary(start, years)
+    next_anniv = anniversary(start, years + 1)
+
+    period_days = (next_anniv - last_anniv).days or 1
+    done_days = max(0, min((today - last_anniv).days, period_days))
+
+    next_milestone = _next_milestone(days_together)
+    milestone_date = start + timedelta(days=next_milestone) if next_milestone else None
+
+    next_big_year = (years // BIG_ANNIVERSARY_STEP + 1) * BIG_ANNIVERSARY_STEP
+    big_anniv = anniversary(start, next_big_year)
+
+    return {
+        "start_date": start,
+        "today": today,
+        "future": False,
+        "days_together": days_together,
+        "years": years,
+        "months": _completed_months(start, last_anniv, today),
+        "is_anniversary_today": years > 0 and last_anniv == today,
+        "last_anniversary": last_anniv,
+        "next_anniversary": next_anniv,
+        "next_anniversary_year": years + 1,
+        "days_until_next": (next_anniv - today).days,
+        "progress_to_next": done_days / period_days,
+        "next_milestone_days": next_milestone,
+        "next_milestone_date": milestone_date,
+        "next_milestone_days_left": next_milestone - days_together if next_milestone else None,
+        "next_big_year": next_big_year,
+        "next_big_year_date": big_anniv,
+        "next_big_year_days_left": (big_anniv - today).days,
+        "due_events": _due_events(start, today, years, days_together, next_anniv),
+    }
+
+
+def _roll_cache_day() -> None:
+    global _cache_day
+    current = date.today()
+    if _cache_day != current:
+        with _cache_lock:
+            if _cache_day != current:
+                _cache.clear()
+                _cache_day = current
+
+
+def relationship_calendar(start: date, today: Optional[date] = None) -> Dict[str, Any]:
+    """
+    Все величины календаря пары на дату today (по умолчанию — сегодня).
+    Для будущей start — только {"future": True, ...}.
+    """
+    _roll_cache_day()
+    today = today or date.today()
+    key = (start, today)
+    result = _cache.get(key)
+    if result is None:
+        result = _compute(start, today)
+        _cache.set(key, result)
+    return result
+
+
+def calendars_for(starts: Iterable[date], today: Optional[date] = None) -> Dict[date, Dict[str, Any]]:
+    """
+    Календари для многих дат начала сразу (нотифаер): одинаковые даты
+    считаются один раз. Возвращает {start_date: календарь}.
+    """
+    today = today or date.today()
+    return {start: relationship_calendar(start, today) for start in set(starts) if start is not None}
+
+
+def due_events(start: date, today: Optional[date] = None) -> Tuple[Tuple[str, Dict[str, Any]], ...]:
+    """События, наступающие в день today: (("year_anniversary", {"year": 3}), ...)."""
+    return relationship_calendar(start, today)["due_events"]
+
+
+def due_start_dates(today: Optional[date] = None) -> Dict[date, Tuple[Tuple[str, Dict[str, Any]], ...]]:
+    """
+    Обратная задача к due_events: все даты начала, у которых в день today
+    есть события, — {start_date: события}. Их несколько сотен (годовщины
+    и напоминания за MAX_RELATIONSHIP_YEARS лет плюс красивые числа),
+    и нотифаер выбирает пары по этим датам одним запросом вместо перебора всех.
+    """
+    today = today or date.today()
+    candidates = {today - timedelta(days=days) for days in MILESTONE_DAYS}
+    targets = [today] + [today + timedelta(days=before) for before in ANNIVERSARY_REMINDERS]
+    for target in targets:
+        for n in range(1, MAX_RELATIONSHIP_YEARS + 1):
+            year = target.year - n
+            if year < 1:
+                break
+            if target.month == 2 and target.day == 29 and not calendar.isleap(year):
+                continue
+            candidates.add(date(year, target.month, target.day))
+            # годовщина 29.02 в невисокосный год — 28.02
+            if target.month == 2 and target.day == 28 and calendar.isleap(year):
+                candidates.add(date(year, 2, 29))
+
+    result = {}
+    for start in candidates:
+        events = due_events(start, today)
+        if events:
+            result[start] = events
+    return result
+
+
+def next_event_date(start: date, today: Optional[date] = None) -> Optional[date]:
+    """
+    Ближайший день (начиная с today), в который у пары есть событие:
+    напоминание о годовщине, годовщина или красивое число дней.
+    Без полного расчёта и кэша — для планировщика.
+    """
+    today = today or date.today()
+    if start > today:
+        return None
+
+    years = completed_years(start, today)
+    candidates = []
+    for n in (years, years + 1, years + 2):
+        if n < 1:
+            continue
+        anniv = anniversary(start, n)
+        candidates.append(anniv)
+        candidates.extend(anniv - timedelta(days=before) for before in ANNIVERSARY_REMINDERS)
+
+    next_milestone = _next_milestone((today - start).days - 1)
+    if next_milestone is not None:
+        candidates.append(start + timedelta(days=next_milestone))
+
+    upcoming = [d for d in candidates if d >= today]
+    return min(upcoming) if upcoming else None
@@ -6,48 +6,195 @@
 from __future__ import annotations
 
 from datetime import date
+import os
 import secrets
 from typing import Any, Dict, List, Optional
 
 try:
-    from db import fetchone, fetchall, execute, execute_returning_one
+    from db import fetchone, fetchall, execute, execute_returning_one, iterate, on_commit, after_transaction
+    from cache import TTLCache
+    from changes import subscribe, subscribe_reset
 except ModuleNotFoundError:
-    from tgbot.db import fetchone, fetchall, execute, execute_returning_one
+    from tgbot.db import fetchone, fetchall, execute, execute_returning_one, iterate, on_commit, after_transaction
+    from tgbot.cache import TTLCache
+    from tgbot.changes import subscribe, subscribe_reset
 
 
 # ===== Пользователи и пары =====
 
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "600"))
+
+PAIR_CACHE_SIZE = int(os.getenv("PAIR_CACHE_SIZE", "10000"))
+# Согласованность между процессами обеспечивают NOTIFY-события (changes.py),
+# TTL — страховка на случай, если слушатель отвалился.
+PAIR_CACHE_TTL = float(os.getenv("PAIR_CACHE_TTL", "300"))
+
+# telegram_id -> (user_id, (username, first_name, last_name))
+_user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+# pair_id -> строка pairs
+_pair_cache = TTLCache(PAIR_CACHE_SIZE, PAIR_CACHE_TTL)
+# user_id -> pair_id (или _NO_PAIR, если пары нет)
+_pair_id_by_user = TTLCache(PAIR_CACHE_SIZE, PAIR_CACHE_TTL)
+_NO_PAIR = 0
+
+
+UPSERT_USER_SQL = """
+INSERT INTO users (telegram_id, username, first_name, last_name)
+VALUES (%s, %s, %s, %s)
+ON CONFLICT (telegram_id) DO UPDATE
+SET username = EXCLUDED.username,
+    first_name = EXCLUDED.first_name,
+    last_name = EXCLUDED.last_name
+RETURNING id
+"""
+
+PAIR_BY_USER_SQL = """
+SELECT * FROM pairs
+WHERE creator_user_id = %s OR partner_user_id = %s
+"""
+
 
 def get_or_create_user(tg_user) -> int:
-    """Вернуть ID пользователя в нашей БД, при необходимости создавая запись."""
-    row = fetchone(
-        "SELECT id FROM users WHERE telegram_id = %s",
-        (tg_user.id,),
-    )
-    if row:
-        return row["id"]
+    """
+    Вернуть ID пользователя в нашей БД, при необходимости создавая запись.
+
+    Повторные вызовы отдаются из кэша без запроса к БД. В БД идём один раз
+    (upsert) при промахе кэша или если у пользователя сменились username / имя —
+    тогда профиль заодно обновляется.
+    """
+    user_id = cached_user_id(tg_user)
+    if user_id is not None:
+        return user_id
+
+    row = execute_returning_one(UPSERT_USER_SQL, (tg_user.id, *user_profile(tg_user)))
+    user_id = row["id"]
+
+    # кэшируем только закоммиченное: новый пользователь может откатиться вместе с транзакцией
+    on_commit(lambda: remember_user(tg_user, user_id))
+    return user_id
 
-    execute(
-        """
-        INSERT INTO users (telegram_id, username, first_name, last_name)
-        VALUES (%s, %s, %s, %s)
-        """,
-        (tg_user.id, tg_user.username, tg_user.first_name, tg_user.last_name),
-    )
 
-    row = fetchone("SELECT id FROM users WHERE telegram_id = %s", (tg_user.id,))
-    return row["id"]
+def user_profile(tg_user) -> tuple:
+    return (tg_user.username, tg_user.first_name, tg_user.last_name)
+
+
+def cached_user_id(tg_user) -> Optional[int]:
+    """user_id из кэша, если профиль в Telegram с тех пор не менялся."""
+    cached = _user_cache.get(tg_user.id)
+    if cached is not None and cached[1] == user_profile(tg_user):
+        return cached[0]
+    return None
+
+
+def cached_user_id_by_telegram_id(telegram_id: int) -> Optional[int]:
+    cached = _user_cache.get(telegram_id)
+    return cached[0] if cached is not None else None
+
+
+def remember_user(tg_user, user_id: int) -> None:
+    _user_cache.set(tg_user.id, (user_id, user_profile(tg_user)))
+
+
+def get_user_id_by_telegram_id(telegram_id: int) -> Optional[int]:
+    """Найти ID пользователя по telegram_id, не создавая и не меняя запись."""
+    user_id = cached_user_id_by_telegram_id(telegram_id)
+    if user_id is not None:
+        return user_id
+    row = fetchone("SELECT id FROM users WHERE telegram_id = %s", (telegram_id,))
+    return row["id"] if row else None
 
 
 def get_pair_by_user(user_id: int) -> Optional[Dict[str, Any]]:
-    """Получить пару, в которой состоит данный пользователь (если есть)."""
-    return fetchone(
-        """
-        SELECT * FROM pairs
-        WHERE creator_user_id = %s OR partner_user_id = %s
-        """,
-        (user_id, user_id),
-    )
+    """
+    Получить пару, в которой состоит данный пользователь (если есть).
+    Результат кэшируется по user_id и pair_id; все функции, меняющие pairs,
+    сбрасывают кэш (см. invalidate_pair_cache).
+    """
+    known, pair = cached_pair_by_user(user_id)
+    if known:
+        return pair
+
+    user_gen, pair_gen = pair_cache_generations()
+    pair = fetchone(PAIR_BY_USER_SQL, (user_id, user_id))
+    return cache_pair_lookup(user_id, pair, user_gen, pair_gen)
+
+
+def cached_pair_by_user(user_id: int):
+    """
+    Пара из кэша без запроса к БД: (True, пара или None) — ответ известен,
+    (False, None) — нужно идти в БД.
+    """
+    pair_id = _pair_id_by_user.get(user_id)
+    if pair_id == _NO_PAIR:
+        return True, None
+    if pair_id is not None:
+        pair = _pair_cache.get(pair_id)
+        if pair is not None:
+            return True, dict(pair)
+    return False, None
+
+
+def pair_cache_generations():
+    """Поколения кэшей на момент перед запросом (см. TTLCache.set(generation=...))."""
+    return _pair_id_by_user.generation, _pair_cache.generation
+
+
+def cache_pair_lookup(user_id: int, pair, user_gen: int, pair_gen: int) -> Optional[Dict[str, Any]]:
+    """Запомнить результат поиска пары пользователя и вернуть его копию."""
+    if pair is None:
+        _pair_id_by_user.set(user_id, _NO_PAIR, generation=user_gen)
+        return None
+
+    _pair_cache.set(pair["id"], dict(pair), generation=pair_gen)
+    _pair_id_by_user.set(user_id, pair["id"], generation=user_gen)
+    return dict(pair)
+
+
+def invalidate_pair_cache(pair_id: Optional[int] = None, user_ids=()) -> None:
+    """
+    Сбросить закэшированную пару (по pair_id) и/или привязку user_id -> пара.
+    Сбрасываем сразу и ещё раз по окончании транзакции: внутри unit of work
+    кэш мог успеть заполниться незакоммиченными данными.
+    """
+
+    def drop() -> None:
+        drop_pair_cache(pair_id, user_ids)
+
+    drop()
+    after_transaction(drop)
+
+
+def drop_pair_cache(pair_id: Optional[int] = None, user_ids=()) -> None:
+    if pair_id is not None:
+        _pair_cache.pop(pair_id)
+    for uid in user_ids:
+        if uid:
+            _pair_id_by_user.pop(uid)
+
+
+def _on_pairs_changed(event: Dict[str, Any]) -> None:
+    """Пару изменил другой процесс (или мы сами — повторный сброс безвреден)."""
+    invalidate_pair_cache(event.get("pair_id"), event.get("user_ids") or ())
+
+
+def _reset_pair_cache() -> None:
+    _pair_cache.clear()
+    _pair_id_by_user.clear()
+
+
+subscribe("pairs", _on_pairs_changed)
+subscribe_reset(_reset_pair_cache)
+
+
+def pair_cache_stats() -> Dict[str, Dict[str, int]]:
+    """Счётчики попаданий / промахов кэшей пар и пользователей."""
+    return {
+        "pairs": _pair_cache.stats(),
+        "pair_by_user": _pair_id_by_user.stats(),
+        "users": _user_cache.stats(),
+    }
 
 
 def link_partner_to_pair(invite_token: str, partner_user_id: int):
@@ -61,8 +208,10 @@ def link_partner_to_pair(invite_token: str, partner_user_id: int):
       - 'has_pair'
       - 'creator_has_pair'
     """
+    # FOR UPDATE: два одновременных перехода по одной ссылке
+    # не создадут две пары (обработка апдейта идёт в одной транзакции)
     invite = fetchone(
-        "SELECT * FROM pair_invites WHERE invite_token = %s",
+        "SELECT * FROM pair_invites WHERE invite_token = %s FOR UPDATE",
         (invite_token,),
     )
     if not invite:
@@ -93,6 +242,7 @@ def link_partner_to_pair(invite_token: str, partner_user_id: int):
         """,
         (creator_user_id, partner_user_id, invite_token),
     )
+    invalidate_pair_cache(pair["id"], (creator_user_id, partner_user_id))
 
     # Инвайт больше не нужен
     execute("DELETE FROM pair_invites WHERE id = %s", (invite["id"],))
@@ -100,20 +250,36 @@ def link_partner_to_pair(invite_token: str, partner_user_id: int):
     return pair, "ok"
 
 
+def get_notification_settings(user_id: int) -> Dict[str, Any]:
+    """Часовой пояс и час плановых уведомлений пользователя (NULL — по умолчанию)."""
+    row = fetchone("SELECT timezone, notify_hour FROM users WHERE id = %s", (user_id,))
+    return row or {"timezone": None, "notify_hour": None}
+
+
+def set_notification_settings(user_id: int, timezone: Optional[str], notify_hour: Optional[int]) -> None:
+    """Сохранить часовой пояс (IANA) и час уведомлений; None — значение по умолчанию."""
+    execute(
+        "UPDATE users SET timezone = %s, notify_hour = %s WHERE id = %s",
+        (timezone, notify_hour, user_id),
+    )
+
+
 def set_pair_start_date(pair_id: int, start_date: date) -> None:
     """Установить / обновить дату начала отношений для пары."""
     execute(
-        "UPDATE pairs SET start_date = %s WHERE id = %s",
+        "UPDATE pairs SET start_date = %s, version = version + 1 WHERE id = %s",
         (start_date, pair_id),
     )
+    invalidate_pair_cache(pair_id)
 
 
 def set_pair_cloud_url(pair_id: int, url: str) -> None:
     """Установить / обновить ссылку на общий диск для пары."""
     execute(
-        "UPDATE pairs SET cloud_drive_url = %s WHERE id = %s",
+        "UPDATE pairs SET cloud_drive_url = %s, version = version + 1 WHERE id = %s",
         (url, pair_id),
     )
+    invalidate_pair_cache(pair_id)
 
 
 def get_partner_alias_for_user(pair: Dict[str, Any], user_id: int) -> Optional[str]:
@@ -127,14 +293,85 @@ def set_partner_alias_for_user(pair: Dict[str, Any], user_id: int, alias: Option
     """Сохранить алиас имени партнёра для текущего участника пары."""
     if pair["creator_user_id"] == user_id:
         execute(
-            "UPDATE pairs SET creator_partner_alias = %s WHERE id = %s",
+            "UPDATE pairs SET creator_partner_alias = %s, version = version + 1 WHERE id = %s",
             (alias, pair["id"]),
         )
     else:
         execute(
-            "UPDATE pairs SET partner_partner_alias = %s WHERE id = %s",
+            "UPDATE pairs SET partner_partner_alias = %s, version = version + 1 WHERE id = %s",
             (alias, pair["id"]),
         )
+    invalidate_pair_cache(pair["id"])
+
+
+def bump_pair_version(pair_id: int, entity: Optional[str] = None, entity_ids=()) -> None:
+    """
+    Отметить, что данные пары (вишлисты, заметки) изменились:
+    клиенты с закэшированным /api/init получат новое состояние.
+    Вызывается после каждой записи, которая не идёт через UPDATE pairs.
+
+    entity ('wishlist_items' | 'notes') и entity_ids — какие строки затронуты:
+    они пишутся в журнал pair_changes с новой версией, по нему /api/sync
+    отдаёт клиенту только изменения.
+    """
+    execute(*bump_version_statement(pair_id, entity, entity_ids))
+    invalidate_pair_cache(pair_id)
+
+
+def bump_version_statement(pair_id: int, entity: Optional[str] = None, entity_ids=()):
+    """(SQL, параметры) для bump_pair_version — общие с асинхронным слоем (aservices.py)."""
+    ids = list(entity_ids)
+    if entity and ids:
+        return (
+            """
+            WITH v AS (
+                UPDATE pairs SET version = version + 1 WHERE id = %s
+                RETURNING id, version
+            )
+            INSERT INTO pair_changes (pair_id, version, entity, entity_id)
+            SELECT v.id, v.version, %s, e.id
+            FROM v, unnest(%s::int[]) AS e(id)
+            """,
+            (pair_id, entity, ids),
+        )
+    return "UPDATE pairs SET version = version + 1 WHERE id = %s", (pair_id,)
+
+
+PAIR_CHANGES_RETENTION_DAYS = int(os.getenv("PAIR_CHANGES_RETENTION_DAYS", "30"))
+
+
+def prune_pair_changes(days: int = PAIR_CHANGES_RETENTION_DAYS) -> int:
+    """
+    Удалить записи журнала pair_changes старше days дней и сдвинуть
+    pairs.changes_since, чтобы клиенты со старой версией получили reset.
+    Возвращает число удалённых записей.
+    """
+    row = execute_returning_one(
+        """
+        WITH gone AS (
+            DELETE FROM pair_changes
+            WHERE changed_at < NOW() - make_interval(days => %s)
+            RETURNING pair_id, version
+        ), moved AS (
+            UPDATE pairs p SET changes_since = g.version
+            FROM (SELECT pair_id, MAX(version) AS version FROM gone GROUP BY pair_id) g
+            WHERE p.id = g.pair_id AND p.changes_since < g.version
+        )
+        SELECT COUNT(*) AS count FROM gone
+        """,
+        (days,),
+    )
+    return row["count"] if row else 0
+
+
+def delete_pair(pair_id: int) -> None:
+    """Удалить пару (вишлисты, заметки и лог уведомлений удалятся каскадом)."""
+    row = execute_returning_one(
+        "DELETE FROM pairs WHERE id = %s RETURNING creator_user_id, partner_user_id",
+        (pair_id,),
+    )
+    user_ids = (row["creator_user_id"], row["partner_user_id"]) if row else ()
+    invalidate_pair_cache(pair_id, user_ids)
 
 
 def get_or_create_invite_for_user(user_id: int) -> Dict[str, Any]:
@@ -166,6 +403,13 @@ def get_or_create_invite_for_user(user_id: int) -> Dict[str, Any]:
 # ===== Вишлисты =====
 
 
+ADD_WISHLIST_ITEM_SQL = """
+INSERT INTO wishlist_items (pair_id, owner_user_id, title, description, url)
+VALUES (%s, %s, %s, %s, NULL)
+RETURNING *
+"""
+
+
 def add_wishlist_item(
     pair_id: int,
     owner_user_id: int,
@@ -173,14 +417,9 @@ def add_wishlist_item(
     description: Optional[str] = None,
 ):
     """Добавить элемент в список желаний пользователя в рамках пары."""
-    return execute_returning_one(
-        """
-        INSERT INTO wishlist_items (pair_id, owner_user_id, title, description, url)
-        VALUES (%s, %s, %s, %s, NULL)
-        RETURNING *
-        """,
-        (pair_id, owner_user_id, title, description),
-    )
+    item = execute_returning_one(ADD_WISHLIST_ITEM_SQL, (pair_id, owner_user_id, title, description))
+    bump_pair_version(pair_id, "wishlist_items", [item["id"]])
+    return item
 
 
 def get_wishlist_for_pair(pair_id: int) -> List[Dict[str, Any]]:
@@ -208,4 +447,253 @@ def get_wishlist_for_owner(pair_id: int, owner_user_id: int) -> List[Dict[str, A
         ORDER BY w.created_at
         """,
         (pair_id, owner_user_id),
-    )
\ No newline at end of file
+    )
+
+def iter_wishlist_export(pair_id: int, owner_user_id: int):
+    """
+    Желания участника для выгрузки, потоком (серверный курсор), новые сверху.
+    В каждой строке также max_title_len / max_url_len / total по всему списку:
+    оконные агрегаты считает БД, и ширины колонок и «Всего» известны уже
+    на первой строке — выгрузке хватает одного прохода.
+    """
+    return iterate(
+        """
+        SELECT title, url, created_at, priority,
+               MAX(char_length(title)) OVER () AS max_title_len,
+               MAX(char_length(url)) OVER () AS max_url_len,
+               COUNT(*) OVER () AS total
+        FROM wishlist_items
+        WHERE pair_id = %s AND owner_user_id = %s
+        ORDER BY created_at DESC, id DESC
+        """,
+        (pair_id, owner_user_id),
+    )
+
+
+def get_wishlist_content_hash(pair_id: int, owner_user_id: int) -> Dict[str, Any]:
+    """
+    Хэш выгружаемого содержимого списка (то, что попадает в файл, в порядке
+    выгрузки) и число желаний: {"content_hash", "total"}. Один агрегатный
+    запрос по индексу — намного дешевле, чем собрать файл. Порядок — как
+    в iter_wishlist_export, с id при равном created_at: иначе хэш одного
+    и того же списка зависел бы от плана запроса.
+    """
+    return fetchone(
+        """
+        SELECT md5(COALESCE(string_agg(
+                   concat_ws(E'\\x1f', title, url, COALESCE(priority, 'medium'),
+                             to_char(created_at, 'DD.MM.YYYY')),
+                   E'\\x1e' ORDER BY created_at DESC, id DESC), '')) AS content_hash,
+               COUNT(*) AS total
+        FROM wishlist_items
+        WHERE pair_id = %s AND owner_user_id = %s
+        """,
+        (pair_id, owner_user_id),
+    )
+
+
+def get_export_file_id(cache_key: str) -> Optional[str]:
+    """file_id уже загруженной в Telegram выгрузки с таким содержимым."""
+    row = execute_returning_one(
+        """
+        UPDATE export_cache SET last_used_at = NOW()
+        WHERE cache_key = %s
+        RETURNING file_id
+        """,
+        (cache_key,),
+    )
+    return row["file_id"] if row else None
+
+
+def save_export_file_id(cache_key: str, file_id: str) -> None:
+    execute(
+        """
+        INSERT INTO export_cache (cache_key, file_id) VALUES (%s, %s)
+        ON CONFLICT (cache_key) DO UPDATE SET file_id = EXCLUDED.file_id, last_used_at = NOW()
+        """,
+        (cache_key, file_id),
+    )
+
+
+def forget_export_file_id(cache_key: str) -> None:
+    execute("DELETE FROM export_cache WHERE cache_key = %s", (cache_key,))
+
+
+def prune_export_cache(days: int = 30) -> None:
+    execute(
+        "DELETE FROM export_cache WHERE last_used_at < NOW() - make_interval(days => %s)",
+        (days,),
+    )
+
+
+# ===== Сводка для WebApp =====
+
+# Формат created_at как у datetime.isoformat() в serialize_date вебаппа
+_ISO_TS = """'YYYY-MM-DD"T"HH24:MI:SS.USTZH:TZM'"""
+
+# Сериализация строк как serialize_wishlist_item / serialize_note вебаппа
+_WISHLIST_ITEM_JSON = f"""json_build_object(
+    'id', w.id, 'title', w.title, 'description', w.description, 'url', w.url,
+    'is_done', w.is_done, 'priority', COALESCE(w.priority, 'medium'),
+    'created_at', to_char(w.created_at, {_ISO_TS})
+)"""
+_NOTE_JSON = f"""json_build_object(
+    'id', n.id, 'text', n.text, 'author_user_id', n.author_user_id,
+    'is_mine', n.author_user_id = %(user_id)s,
+    'created_at', to_char(n.created_at, {_ISO_TS})
+)"""
+
+DASHBOARD_SQL = f"""
+WITH p AS (
+    SELECT * FROM pairs
+    WHERE creator_user_id = %(user_id)s OR partner_user_id = %(user_id)s
+    LIMIT 1
+), partner AS (
+    SELECT CASE WHEN p.creator_user_id = %(user_id)s
+                THEN p.partner_user_id ELSE p.creator_user_id END AS id
+    FROM p
+)
+SELECT
+    p.*,
+    (
+        SELECT json_build_object('id', u.id, 'username', u.username, 'first_name', u.first_name)
+        FROM users u WHERE u.id = (SELECT id FROM partner)
+    ) AS dash_partner,
+    (
+        SELECT COALESCE(json_agg({_WISHLIST_ITEM_JSON} ORDER BY w.created_at), '[]'::json)
+        FROM wishlist_items w
+        WHERE w.pair_id = p.id AND w.owner_user_id = %(user_id)s
+    ) AS dash_my_wishlist,
+    (
+        SELECT COALESCE(json_agg({_WISHLIST_ITEM_JSON} ORDER BY w.created_at), '[]'::json)
+        FROM wishlist_items w
+        WHERE w.pair_id = p.id AND w.owner_user_id = (SELECT id FROM partner)
+    ) AS dash_partner_wishlist,
+    (
+        SELECT COALESCE(json_agg({_NOTE_JSON} ORDER BY n.created_at DESC), '[]'::json)
+        FROM notes n
+        WHERE n.pair_id = p.id
+    ) AS dash_notes
+FROM p
+"""
+
+
+def get_dashboard(user_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Всё для экрана WebApp одним запросом: пара, профиль партнёра, оба вишлиста
+    и заметки (списки собираются json_agg на стороне БД, уже сериализованными).
+    Возвращает None, если у пользователя нет пары, иначе
+    {"pair", "partner", "my_wishlist", "partner_wishlist", "notes"}.
+    """
+    return dashboard_from_row(fetchone(DASHBOARD_SQL, {"user_id": user_id}))
+
+
+def dashboard_from_row(row) -> Optional[Dict[str, Any]]:
+    if not row:
+        return None
+
+    row = dict(row)
+    return {
+        "partner": row.pop("dash_partner"),
+        "my_wishlist": row.pop("dash_my_wishlist"),
+        "partner_wishlist": row.pop("dash_partner_wishlist"),
+        "notes": row.pop("dash_notes"),
+        "pair": row,
+    }
+
+
+def get_changed_row(entity: str, entity_id: int) -> Optional[Dict[str, Any]]:
+    """
+    Текущая строка wishlist_items / notes для события об изменении (SSE),
+    сериализованная как в /api/init, плюс owner_user_id у желаний.
+    is_mine у заметки не заполняется — событие общее для обоих партнёров.
+    None — строки уже нет.
+    """
+    if entity == "wishlist_items":
+        sql = f"""
+            SELECT {_WISHLIST_ITEM_JSON}::jsonb
+                   || jsonb_build_object('owner_user_id', w.owner_user_id) AS row
+            FROM wishlist_items w WHERE w.id = %(id)s
+        """
+    elif entity == "notes":
+        sql = f"SELECT {_NOTE_JSON} AS row FROM notes n WHERE n.id = %(id)s"
+    else:
+        raise ValueError(f"Unknown entity: {entity}")
+
+    row = fetchone(sql, {"id": entity_id, "user_id": None})
+    return row["row"] if row else None
+
+
+# Изменения пары после версии since одним запросом (один снимок данных):
+# затронутые строки из журнала, которые ещё существуют, — upserts,
+# исчезнувшие — надгробия (id удалённых).
+PAIR_CHANGES_SQL = f"""
+WITH changed AS (
+    SELECT DISTINCT entity, entity_id
+    FROM pair_changes
+    WHERE pair_id = %(pair_id)s AND version > %(since)s
+)
+SELECT
+    p.*,
+    (
+        SELECT COALESCE(json_agg({_WISHLIST_ITEM_JSON} ORDER BY w.created_at), '[]'::json)
+        FROM changed c
+        JOIN wishlist_items w ON w.id = c.entity_id AND w.pair_id = p.id
+        WHERE c.entity = 'wishlist_items' AND w.owner_user_id = %(user_id)s
+    ) AS sync_my_wishlist,
+    (
+        SELECT COALESCE(json_agg({_WISHLIST_ITEM_JSON} ORDER BY w.created_at), '[]'::json)
+        FROM changed c
+        JOIN wishlist_items w ON w.id = c.entity_id AND w.pair_id = p.id
+        WHERE c.entity = 'wishlist_items' AND w.owner_user_id <> %(user_id)s
+    ) AS sync_partner_wishlist,
+    (
+        SELECT COALESCE(json_agg(c.entity_id), '[]'::json)
+        FROM changed c
+        WHERE c.entity = 'wishlist_items'
+          AND NOT EXISTS (SELECT 1 FROM wishlist_items w WHERE w.id = c.entity_id AND w.pair_id = p.id)
+    ) AS sync_wishlist_deleted,
+    (
+        SELECT COALESCE(json_agg({_NOTE_JSON} ORDER BY n.created_at DESC), '[]'::json)
+        FROM changed c
+        JOIN notes n ON n.id = c.entity_id AND n.pair_id = p.id
+        WHERE c.entity = 'notes'
+    ) AS sync_notes,
+    (
+        SELECT COALESCE(json_agg(c.entity_id), '[]'::json)
+        FROM changed c
+        WHERE c.entity = 'notes'
+          AND NOT EXISTS (SELECT 1 FROM notes n WHERE n.id = c.entity_id AND n.pair_id = p.id)
+    ) AS sync_notes_deleted
+FROM pairs p
+WHERE p.id = %(pair_id)s
+"""
+
+
+def get_pair_changes(pair_id: int, user_id: int, since: int) -> Optional[Dict[str, Any]]:
+    """
+    Дельта для /api/sync: что изменилось в вишлистах и заметках пары после
+    версии since. Возвращает None, если пары уже нет, иначе
+    {"pair", "reset", "my_wishlist", "partner_wishlist", "wishlist_deleted",
+    "notes", "notes_deleted"}; reset=True — журнал за since уже почищен,
+    клиенту нужна полная загрузка.
+    """
+    row = fetchone(PAIR_CHANGES_SQL, {"pair_id": pair_id, "user_id": user_id, "since": since})
+    return pair_changes_from_row(row, since)
+
+
+def pair_changes_from_row(row, since: int) -> Optional[Dict[str, Any]]:
+    if not row:
+        return None
+
+    row = dict(row)
+    changes = {
+        "my_wishlist": row.pop("sync_my_wishlist"),
+        "partner_wishlist": row.pop("sync_partner_wishlist"),
+        "wishlist_deleted": row.pop("sync_wishlist_deleted"),
+        "notes": row.pop("sync_notes"),
+        "notes_deleted": row.pop("sync_notes_deleted"),
+    }
+    changes["pair"] = row
+    changes["reset"] = since < row["changes_since"] or since > row["version"]
+    return changes
@@ -10,20 +10,16 @@ if BASE_DIR not in sys.path:
     sys.path.append(BASE_DIR)
 
 from telebot import types  # если хочешь ещё и клавиатуру
-from tgbot.bot_setup import bot  # тот же bot, что и в handlers
 import html
+import time
 
-from datetime import date, datetime, timedelta
-from typing import Any, Dict, Optional, List
+from datetime import date, datetime
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, g
 from psycopg2.extras import RealDictRow
 
-from io import BytesIO
 from flask import send_file
-from openpyxl import Workbook
-from openpyxl.utils import get_column_letter
-from openpyxl.styles import Font, Alignment
 
 from tgbot.services import (  # type: ignore
     get_or_create_user,
@@ -34,14 +30,117 @@ from tgbot.services import (  # type: ignore
     set_pair_start_date,
     get_partner_alias_for_user,
     set_partner_alias_for_user,
+    delete_pair,
+    bump_pair_version,
+    get_dashboard,
+    get_pair_changes,
+    get_user_id_by_telegram_id,
+)
+from tgbot.db import (  # type: ignore
+    fetchone,
+    execute_returning_one,
+    execute_returning_all,
+    init_pool,
+    begin_unit_of_work,
+    end_unit_of_work,
+    get_pool,
+)
+from tgbot import metrics  # type: ignore
+from tgbot.changes import start_listener  # type: ignore
+from tgbot.pair_calendar import relationship_calendar  # type: ignore
+from tgbot.outbox import enqueue_message, enqueue_export  # type: ignore
+from tgbot.export import EXPORT_FORMATS, stream_wishlist_export  # type: ignore
+from webapp.events import event_hub, SSE_HEARTBEAT, SSE_RETRY_MS, RESET_MESSAGE
+from webapp.auth import (
+    WEBAPP_TRUST_USER,
+    SessionPair,
+    StaleSession,
+    issue_session,
+    read_session,
+    verify_init_data,
 )
-from tgbot.db import fetchone, execute, execute_returning_one  # type: ignore
 from tgbot.config import BOT_USERNAME  # type: ignore
 
 
 app = Flask(__name__, template_folder="templates", static_folder="static")
 
 
+# ===== Метрики запроса =====
+# Зарегистрированы первыми: before_request выполняется раньше остальных,
+# after_request — последним, так что в замер попадает и COMMIT.
+
+
+@app.before_request
+def begin_request_metrics():
+    g.started_at = time.perf_counter()
+    metrics.begin_request()
+
+
+@app.after_request
+def record_request_metrics(response):
+    started_at = g.pop("started_at", None)
+    if started_at is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.end_request(
+            request.method, route, request.path, response.status_code, time.perf_counter() - started_at
+        )
+    return response
+
+
+# ===== Unit of work на запрос =====
+# Все запросы к БД внутри одного HTTP-запроса идут через одно соединение
+# и коммитятся один раз — после того как view вернул ответ.
+
+
+@app.before_request
+def begin_request_unit_of_work():
+    # слушатель NOTIFY для сброса кэшей; под gunicorn стартует в каждом воркере
+    start_listener()
+    g.uow = begin_unit_of_work()
+
+
+@app.after_request
+def commit_request_unit_of_work(response):
+    uow = g.pop("uow", None)
+    if response.status_code >= 500:
+        # view упал (Flask вызывает after_request и для ответа 500 из
+        # handle_exception) или сам вернул 5xx — начатое не сохраняем
+        end_unit_of_work(uow, commit=False)
+        return response
+    try:
+        end_unit_of_work(uow)
+    except Exception as e:
+        print(f"Failed to commit request transaction: {e}")
+        response = jsonify({"ok": False, "error": "DB_COMMIT_FAILED"})
+        response.status_code = 500
+    return response
+
+
+@app.teardown_request
+def rollback_request_unit_of_work(exc):
+    # обычно uow уже закрыт в after_request; открытым он остаётся, если
+    # after_request не дошёл до него (упал предыдущий обработчик)
+    uow = g.pop("uow", None)
+    end_unit_of_work(uow, commit=False)
+
+
+@app.after_request
+def attach_session_token(response):
+    # новый токен сессии (после проверки initData или смены пары) — в заголовке,
+    # чтобы он не попадал в кэшируемые клиентом ответы
+    token = g.pop("new_session", None)
+    if token and response.status_code < 400:
+        response.headers["X-Session-Token"] = token
+    return response
+
+
+@app.errorhandler(StaleSession)
+def handle_stale_session(exc):
+    # токен ссылается на удалённую пару: ничего из начатого не сохраняем
+    end_unit_of_work(g.pop("uow", None), commit=False)
+    return jsonify({"ok": False, "error": "SESSION_EXPIRED"}), 401
+
+
 # ===== Вспомогательные классы/функции =====
 
 
@@ -94,124 +193,148 @@ def serialize_note(row: Dict[str, Any], current_user_id: int) -> Dict[str, Any]:
 
 def compute_relationship_stats(start: date) -> Dict[str, Any]:
     """
-    Логика очень близка к тому, что у тебя в start_date_flow:
-    считаем дни вместе, годы/месяцы, прогресс до годовщины, "красивые даты", большой юбилей.
+    Блок «вместе» для /api/init: дни вместе, годы/месяцы, прогресс до
+    годовщины, "красивые даты", большой юбилей (см. tgbot/pair_calendar.py).
     """
-    today = date.today()
-    if start > today:
+    cal = relationship_calendar(start)
+    if cal["future"]:
         return {
             "start_date_iso": serialize_date(start),
             "start_date_human": fmt_date_ddmmyyyy(start),
             "future": True,
         }
 
-    days_together = (today - start).days
-
-    # годы + месяцы (по годовщинам)
-    years = today.year - start.year
-    if (today.month, today.day) < (start.month, start.day):
-        years -= 1
-    if years < 0:
-        years = 0
-
-    last_year_anniv = date(start.year + years, start.month, start.day)
-
-    months = (today.year - last_year_anniv.year) * 12 + (
-        today.month - last_year_anniv.month
-    )
-    if today.day < start.day:
-        months -= 1
-    if months < 0:
-        months = 0
-
-    # до следующей годовщины
-    next_anniv = date(start.year + years + 1, start.month, start.day)
-    days_until_next = (next_anniv - today).days
-
-    total_period_days = (next_anniv - last_year_anniv).days or 1
-    done_days = (today - last_year_anniv).days
-    done_days = max(0, min(done_days, total_period_days))
-    ratio = done_days / total_period_days
-    percent = int(ratio * 100)
-
-    # "красивые" даты
-    milestone_days = [
-        100,
-        200,
-        300,
-        400,
-        500,
-        600,
-        700,
-        800,
-        900,
-        1000,
-        1500,
-        2000,
-        2500,
-        3000,
-    ]
-    next_milestone = None
-    milestone_date = None
-    days_to_milestone = None
-
-    for d in milestone_days:
-        if d > days_together:
-            next_milestone = d
-            milestone_date = start + timedelta(days=d)
-            days_to_milestone = d - days_together
-            break
-
-    # крупный юбилей по годам (каждые 5 лет)
-    next_big_year = ((years // 5) + 1) * 5
-    big_anniv_date = date(start.year + next_big_year, start.month, start.day)
-    days_to_big = (big_anniv_date - today).days
-
-    is_anniversary_today = (
-        years > 0
-        and today.month == start.month
-        and today.day == start.day
-    )
-
     return {
         "start_date_iso": serialize_date(start),
         "start_date_human": fmt_date_ddmmyyyy(start),
         "future": False,
-        "days_together": days_together,
-        "years": years,
-        "months": months,
-        "is_anniversary_today": is_anniversary_today,
-        "days_until_next": days_until_next,
-        "percent_to_next": percent,
-        "next_milestone_days": next_milestone,
-        "next_milestone_date": serialize_date(milestone_date) if milestone_date else None,
-        "next_milestone_days_left": days_to_milestone,
-        "next_big_year": next_big_year,
-        "next_big_year_date": fmt_date_ddmmyyyy(big_anniv_date),
-        "next_big_year_days_left": days_to_big,
+        "days_together": cal["days_together"],
+        "years": cal["years"],
+        "months": cal["months"],
+        "is_anniversary_today": cal["is_anniversary_today"],
+        "days_until_next": cal["days_until_next"],
+        "percent_to_next": int(cal["progress_to_next"] * 100),
+        "next_milestone_days": cal["next_milestone_days"],
+        "next_milestone_date": serialize_date(cal["next_milestone_date"]),
+        "next_milestone_days_left": cal["next_milestone_days_left"],
+        "next_big_year": cal["next_big_year"],
+        "next_big_year_date": fmt_date_ddmmyyyy(cal["next_big_year_date"]),
+        "next_big_year_days_left": cal["next_big_year_days_left"],
     }
 
 
-def get_current_user_and_pair(payload: Dict[str, Any]):
+def get_current_user(payload: Dict[str, Any]):
     """
-    Общий helper: из JSON достаём user, создаём/находим его в БД и пару.
+    Пользователь запроса:
+    - токен сессии (Authorization: Bearer ...) — без обращения к БД;
+    - иначе подписанная initData (заголовок X-Telegram-Init-Data): проверяем
+      подпись, создаём/находим пользователя и выдаём токен (X-Session-Token);
+    - WEBAPP_TRUST_USER=1 (разработка) — объект user из JSON, как раньше.
     """
-    user_data = payload.get("user")
+    auth = request.headers.get("Authorization", "")
+    if auth.startswith("Bearer "):
+        session = read_session(auth[len("Bearer "):])
+        if session is None:
+            return None, jsonify({"ok": False, "error": "SESSION_EXPIRED"}), 401
+        g.session_pair_id = session.get("p")
+        return session["u"], None, None
+
+    init_data = request.headers.get("X-Telegram-Init-Data")
+    if init_data:
+        user_data = verify_init_data(init_data)
+        if user_data is None:
+            return None, jsonify({"ok": False, "error": "BAD_INIT_DATA"}), 401
+    elif WEBAPP_TRUST_USER:
+        user_data = payload.get("user")
+    else:
+        return None, jsonify({"ok": False, "error": "AUTH_REQUIRED"}), 401
+
     if not user_data or "id" not in user_data:
-        return None, None, jsonify({"ok": False, "error": "USER_REQUIRED"}), 400
+        return None, jsonify({"ok": False, "error": "USER_REQUIRED"}), 400
 
     tg_user = TGUserWrapper(user_data)
     user_id = get_or_create_user(tg_user)
     pair = get_pair_by_user(user_id)
+    g.session_pair_id = pair["id"] if pair else None
+    g.new_session = issue_session(user_id, g.session_pair_id)
+    return user_id, None, None
+
+
+def get_current_user_and_pair(payload: Dict[str, Any]):
+    """
+    Общий helper: пользователь запроса и его пара.
+    Пара из токена сессии — SessionPair: поля, кроме id, читаются при обращении.
+    """
+    user_id, err_resp, err_code = get_current_user(payload)
+    if err_resp is not None:
+        return None, None, err_resp, err_code
+
+    pair_id = g.get("session_pair_id")
+    if pair_id:
+        pair = SessionPair(pair_id, user_id)
+    else:
+        # пары не было, когда выдавали токен, — могла появиться
+        pair = get_pair_by_user(user_id)
+        if pair and "new_session" not in g:
+            g.new_session = issue_session(user_id, pair["id"])
 
     return user_id, pair, None, None
 
-def notify_partner_about_new_note(pair, user_id: int, text: str) -> None:
-    if pair["creator_user_id"] == user_id:
-        partner_user_id = pair["partner_user_id"]
+
+def get_query_user_and_pair():
+    """
+    Пользователь и пара для GET-ссылок (EventSource, скачивание), где нет
+    заголовков и JSON: токен сессии — в query (?session=...).
+    """
+    session = read_session(request.args.get("session"))
+    if session is not None:
+        user_id = session["u"]
+        pair = SessionPair(session["p"], user_id) if session.get("p") else get_pair_by_user(user_id)
+    elif WEBAPP_TRUST_USER and request.args.get("tg_id", type=int) is not None:
+        user_id = get_user_id_by_telegram_id(request.args.get("tg_id", type=int))
+        if not user_id:
+            return None, None, jsonify({"ok": False, "error": "USER_NOT_FOUND"}), 400
+        pair = get_pair_by_user(user_id)
     else:
-        partner_user_id = pair["creator_user_id"]
+        return None, None, jsonify({"ok": False, "error": "SESSION_EXPIRED"}), 401
+
+    if not pair:
+        return None, None, jsonify({"ok": False, "error": "NO_PAIR"}), 400
+    return user_id, pair, None, None
+
+def partner_user_id_of(pair, user_id: int) -> Optional[int]:
+    if pair["creator_user_id"] == user_id:
+        return pair["partner_user_id"]
+    return pair["creator_user_id"]
+
 
+def new_note_notification(text: str) -> str:
+    preview = text[:100] + "…" if len(text) > 100 else text
+    safe_text = html.escape(preview, quote=False)
+
+    return (
+        "📝 <b>Новая совместная заметка!</b>\n\n"
+        f"{safe_text}"
+    )
+
+
+def new_wish_notification(title: str) -> str:
+    # кто добавил желание — из WebApp, у нас нет message.from_user,
+    # но в payload прилетает user с username / first_name
+    who = "Партнёр"
+    # если хочешь, можно прокинуть username из payload и передать его сюда отдельным аргументом
+
+    safe_title = html.escape(title, quote=False)
+    safe_who = html.escape(who, quote=False)
+
+    return (
+        "🎁 <b>Новое желание в списке партнера!</b>\n\n"
+        f"<b>{safe_who}</b> добавил(а): <b>{safe_title}</b>"
+    )
+
+
+def notify_partner_about_new_note(pair, user_id: int, text: str) -> None:
+    partner_user_id = partner_user_id_of(pair, user_id)
     if not partner_user_id:
         return
 
@@ -222,19 +345,7 @@ def notify_partner_about_new_note(pair, user_id: int, text: str) -> None:
     if not partner or not partner.get("telegram_id"):
         return
 
-    tg_id = partner["telegram_id"]
-    preview = text[:100] + "…" if len(text) > 100 else text
-    safe_text = html.escape(preview, quote=False)
-
-    notif_text = (
-        "📝 <b>Новая совместная заметка!</b>\n\n"
-        f"{safe_text}"
-    )
-
-    try:
-        bot.send_message(tg_id, notif_text, parse_mode="HTML")
-    except Exception as e:
-        print(f"Failed to send note notification: {e}")
+    enqueue_message(partner["telegram_id"], new_note_notification(text), parse_mode="HTML")
 
 
 def notify_partner_about_new_wish(pair, user_id: int, title: str) -> None:
@@ -243,92 +354,19 @@ def notify_partner_about_new_wish(pair, user_id: int, title: str) -> None:
     (логика очень похожа на ту, что в bot.handle_pending -> wishlist_add).
     """
     # определяем id партнёра
-    if pair["creator_user_id"] == user_id:
-        partner_user_id = pair["partner_user_id"]
-    else:
-        partner_user_id = pair["creator_user_id"]
-
+    partner_user_id = partner_user_id_of(pair, user_id)
     if not partner_user_id:
         return
 
     # достаём telegram_id партнёра
     partner = fetchone(
-        "SELECT telegram_id, username, first_name FROM users WHERE id = %s",
+        "SELECT telegram_id FROM users WHERE id = %s",
         (partner_user_id,),
     )
     if not partner or not partner.get("telegram_id"):
         return
 
-    tg_id = partner["telegram_id"]
-
-    # кто добавил желание — из WebApp, у нас нет message.from_user,
-    # но в payload прилетает user с username / first_name
-    who = "Партнёр"
-    # если хочешь, можно прокинуть username из payload и передать его сюда отдельным аргументом
-
-    safe_title = html.escape(title, quote=False)
-    safe_who = html.escape(who, quote=False)
-
-    notif_text = (
-        "🎁 <b>Новое желание в списке партнера!</b>\n\n"
-        f"<b>{safe_who}</b> добавил(а): <b>{safe_title}</b>"
-    )
-
-    try:
-        bot.send_message(tg_id, notif_text, reply_markup=None, parse_mode="HTML")
-    except Exception as e:
-        print(f"Failed to send wishlist notification from webapp: {e}")
-
-from io import BytesIO
-from openpyxl import Workbook
-from openpyxl.utils import get_column_letter
-from openpyxl.styles import Font, Alignment
-
-
-def build_wishlist_xlsx(items: list[dict], sheet_name: str = "Wishlist") -> BytesIO:
-    wb = Workbook()
-    ws = wb.active
-    ws.title = sheet_name[:31]  # Excel limit
-
-    PRIORITY_LABELS = {"high": "Очень хочу", "medium": "Хочу", "low": "Несрочно"}
-
-    headers = ["Желание", "Приоритет", "Ссылка", "Создано"]
-    ws.append(headers)
-
-    header_font = Font(bold=True)
-    for col in range(1, len(headers) + 1):
-        c = ws.cell(row=1, column=col)
-        c.font = header_font
-        c.alignment = Alignment(vertical="center")
-
-    for r in items:
-        created_at = r.get("created_at")
-        priority = r.get("priority") or "medium"
-        ws.append(
-            [
-                r.get("title") or "",
-                PRIORITY_LABELS.get(priority, priority),
-                r.get("url") or "",
-                (created_at.strftime("%d.%m.%Y") if created_at else ""),
-            ]
-        )
-
-    # простая авто-ширина
-    for col in range(1, len(headers) + 1):
-        max_len = 10
-        for row in range(1, ws.max_row + 1):
-            v = ws.cell(row=row, column=col).value
-            if v is None:
-                continue
-            max_len = max(max_len, len(str(v)))
-        ws.column_dimensions[get_column_letter(col)].width = min(max_len + 2, 60)
-
-    bio = BytesIO()
-    wb.save(bio)
-    bio.seek(0)
-    # telebot любит, когда у файла есть name
-    bio.name = "wishlist.xlsx"
-    return bio
+    enqueue_message(partner["telegram_id"], new_wish_notification(title), parse_mode="HTML")
 
 from tgbot.db import fetchall  # если есть
 
@@ -344,22 +382,22 @@ def send_wishlist_to_bot(pair: dict, owner_user_id: int, receiver_user_id: int,
     if not receiver or not receiver.get("telegram_id"):
         return
 
-    tg_id = receiver["telegram_id"]
+    # файл соберёт (или перешлёт по file_id из кэша) воркер outbox
+    enqueue_export(receiver["telegram_id"], pair["id"], owner_user_id, title)
 
-    items = fetchall(
-        """
-        SELECT title, url, created_at, priority
-        FROM wishlist_items
-        WHERE pair_id = %s AND owner_user_id = %s
-        ORDER BY created_at DESC
-        """,
-        (pair["id"], owner_user_id),
-    )
 
-    xlsx = build_wishlist_xlsx(items, sheet_name=title)
+def resolve_export_owner(pair: dict, user_id: int, target: Optional[str]):
+    """
+    Чей список выгружаем: target "me" (по умолчанию) или "partner".
+    Возвращает (owner_user_id или None, если партнёра нет; название листа).
+    """
+    if (target or "me").strip() == "partner":
+        if pair["creator_user_id"] == user_id:
+            return pair["partner_user_id"], "Список партнёра"
+        return pair["creator_user_id"], "Список партнёра"
+    return user_id, "Мой список"
+
 
-    caption = f"📄 {title}\nВсего: {len(items)}"
-    bot.send_document(tg_id, xlsx, caption=caption)
 # ===== Маршруты =====
 
 
@@ -368,32 +406,82 @@ def index():
     return render_template("index.html")
 
 
-@app.post("/api/init")
-def api_init():
+# /api/init одним запросом к БД (get_dashboard). INIT_SINGLE_QUERY=0 — старый путь
+# с отдельными запросами (оставлен для сравнения, см. webapp/bench_init.py).
+INIT_SINGLE_QUERY = os.getenv("INIT_SINGLE_QUERY", "1") != "0"
+
+
+def init_etag(pair: Dict[str, Any], user_id: int) -> str:
     """
-    Инициализация состояния WebApp:
-    - пользователь
-    - пара (если есть)
-    - мой список
-    - список партнёра
-    - ссылка на диск
-    - данные по дате отношений.
+    ETag ответа /api/init. Меняется, когда растёт версия пары; ответ
+    персональный (is_mine, партнёр), а статистика по дате зависит от «сегодня» —
+    поэтому в ETag также пользователь и текущая дата.
     """
-    data = request.json or {}
+    return f'W/"{pair["id"]}.{pair["version"]}.{user_id}.{date.today():%Y%m%d}"'
+
+
+def serialize_pair_block(pair: Dict[str, Any], user_id: int) -> Dict[str, Any]:
+    """Блок "pair" ответов /api/init и /api/sync."""
+    start_stats = None
+    if pair.get("start_date"):
+        start_stats = compute_relationship_stats(pair["start_date"])
+
+    return {
+        "id": pair["id"],
+        "version": pair["version"],
+        "start_date": serialize_date(pair.get("start_date")),
+        "start_stats": start_stats,
+        "cloud_url": pair.get("cloud_drive_url"),
+        "partner_alias": get_partner_alias_for_user(pair, user_id),
+    }
+
+
+def build_init_payload(user_id: int) -> Dict[str, Any]:
+    """Ответ /api/init: пара, оба вишлиста и заметки — одним SQL-запросом."""
+    return init_payload_from_dashboard(user_id, get_dashboard(user_id))
 
-    user_id, pair, err_resp, err_code = get_current_user_and_pair(data)
-    if err_resp is not None:
-        return err_resp, err_code
 
+def init_payload_from_dashboard(user_id: int, dashboard: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Собрать ответ /api/init из результата get_dashboard (без запросов к БД)."""
+    if dashboard is None:
+        return {"ok": True, "has_pair": False, "user_id": user_id}
+
+    pair = dashboard["pair"]
+    if pair["creator_user_id"] == user_id:
+        partner_id = pair["partner_user_id"]
+    else:
+        partner_id = pair["creator_user_id"]
+    partner_info = dashboard["partner"]
+
+    return {
+        "ok": True,
+        "has_pair": True,
+        "user_id": user_id,
+        "etag": init_etag(pair, user_id),
+        "pair": serialize_pair_block(pair, user_id),
+        "partner": {
+            "id": partner_id,
+            "username": partner_info["username"] if partner_info else None,
+            "first_name": partner_info["first_name"] if partner_info else None,
+        }
+        if partner_id
+        else None,
+        "my_wishlist": dashboard["my_wishlist"],
+        "partner_wishlist": dashboard["partner_wishlist"] if partner_id else [],
+        "notes": dashboard["notes"],
+    }
+
+
+def build_init_payload_multi(user_id: int) -> Dict[str, Any]:
+    """Ответ /api/init по-старому: отдельный запрос на каждый кусок."""
+    pair = get_pair_by_user(user_id)
     if not pair:
         # пара ещё не создана, но юзер в БД уже есть
-        return jsonify(
-            {
-                "ok": True,
-                "has_pair": False,
-                "user_id": user_id,
-            }
-        )
+        return {
+            "ok": True,
+            "has_pair": False,
+            "user_id": user_id,
+        }
 
     # определяем партнёра
     if pair["creator_user_id"] == user_id:
@@ -418,15 +506,6 @@ def api_init():
             (partner_id,),
         )
 
-    # инфо по дате
-    start_stats = None
-    if pair.get("start_date"):
-        start_stats = compute_relationship_stats(pair["start_date"])
-
-    # линк на диск
-    cloud_url = pair.get("cloud_drive_url")
-    partner_alias = get_partner_alias_for_user(pair, user_id)
-
     # совместные заметки
     notes_raw = fetchall(
         "SELECT id, author_user_id, text, created_at FROM notes WHERE pair_id = %s ORDER BY created_at DESC",
@@ -434,29 +513,162 @@ def api_init():
     ) or []
     notes = [serialize_note(n, user_id) for n in notes_raw]
 
-    return jsonify(
-        {
-            "ok": True,
-            "has_pair": True,
-            "user_id": user_id,
-            "pair": {
-                "id": pair["id"],
-                "start_date": serialize_date(pair.get("start_date")),
-                "start_stats": start_stats,
-                "cloud_url": cloud_url,
-                "partner_alias": partner_alias,
-            },
-            "partner": {
-                "id": partner_id,
-                "username": partner_info["username"] if partner_info else None,
-                "first_name": partner_info["first_name"] if partner_info else None,
-            }
-            if partner_id
-            else None,
-            "my_wishlist": my_items,
-            "partner_wishlist": partner_items,
-            "notes": notes,
+    return {
+        "ok": True,
+        "has_pair": True,
+        "user_id": user_id,
+        "etag": init_etag(pair, user_id),
+        "pair": serialize_pair_block(pair, user_id),
+        "partner": {
+            "id": partner_id,
+            "username": partner_info["username"] if partner_info else None,
+            "first_name": partner_info["first_name"] if partner_info else None,
         }
+        if partner_id
+        else None,
+        "my_wishlist": my_items,
+        "partner_wishlist": partner_items,
+        "notes": notes,
+    }
+
+
+@app.post("/api/init")
+def api_init():
+    """
+    Инициализация состояния WebApp:
+    - пользователь
+    - пара (если есть)
+    - мой список
+    - список партнёра
+    - ссылка на диск
+    - данные по дате отношений.
+    """
+    data = request.json or {}
+
+    user_id, err_resp, err_code = get_current_user(data)
+    if err_resp is not None:
+        return err_resp, err_code
+
+    # Клиент прислал ETag прошлого ответа, и версия пары с тех пор не менялась —
+    # отвечаем коротким not_modified, main.js возьмёт состояние из своего кэша.
+    # Пара обычно берётся из кэша, так что такой ответ обходится без запросов к БД.
+    client_etag = request.headers.get("If-None-Match")
+    if client_etag:
+        pair = get_pair_by_user(user_id)
+        if pair and client_etag == init_etag(pair, user_id):
+            resp = jsonify({"ok": True, "not_modified": True})
+            resp.headers["ETag"] = client_etag
+            return resp
+
+    if INIT_SINGLE_QUERY:
+        payload = build_init_payload(user_id)
+    else:
+        payload = build_init_payload_multi(user_id)
+
+    resp = jsonify(payload)
+    if payload.get("etag"):
+        resp.headers["ETag"] = payload["etag"]
+    return resp
+
+
+def build_sync_payload(user_id: int, changes: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Собрать ответ /api/sync из результата get_pair_changes (без запросов к БД)."""
+    if changes is None:
+        # пару удалили между запросами
+        return {"ok": True, "has_pair": False, "user_id": user_id}
+    if changes["reset"]:
+        return {"ok": True, "has_pair": True, "reset": True}
+
+    pair = changes["pair"]
+    return {
+        "ok": True,
+        "has_pair": True,
+        "user_id": user_id,
+        "version": pair["version"],
+        "etag": init_etag(pair, user_id),
+        "pair": serialize_pair_block(pair, user_id),
+        "my_wishlist": {
+            "upserts": changes["my_wishlist"],
+            "deleted": changes["wishlist_deleted"],
+        },
+        "partner_wishlist": {
+            "upserts": changes["partner_wishlist"],
+            "deleted": changes["wishlist_deleted"],
+        },
+        "notes": {
+            "upserts": changes["notes"],
+            "deleted": changes["notes_deleted"],
+        },
+    }
+
+
+@app.post("/api/sync")
+def api_sync():
+    """
+    Дельта-синхронизация: только то, что изменилось после версии пары since.
+    JSON: { "user": {...} }, версия — в query: /api/sync?since=<pair.version>.
+
+    Ответ: pair (актуальный блок пары), version, etag и для my_wishlist,
+    partner_wishlist, notes — { "upserts": [...], "deleted": [id, ...] }.
+    reset=true — журнал изменений за since уже почищен: нужна полная /api/init.
+    """
+    data = request.json or {}
+    since = request.args.get("since", type=int)
+
+    if since is None:
+        return jsonify({"ok": False, "error": "SINCE_REQUIRED"}), 400
+
+    user_id, pair, err_resp, err_code = get_current_user_and_pair(data)
+    if err_resp is not None:
+        return err_resp, err_code
+    if not pair:
+        return jsonify({"ok": True, "has_pair": False, "user_id": user_id})
+
+    payload = build_sync_payload(user_id, get_pair_changes(pair["id"], user_id, since))
+    resp = jsonify(payload)
+    if payload.get("etag"):
+        resp.headers["ETag"] = payload["etag"]
+    return resp
+
+
+@app.get("/api/events")
+def api_events():
+    """
+    SSE-поток изменений пары: /api/events?session=<токен сессии>.
+    EventSource не умеет слать заголовки, поэтому токен — в query.
+
+    События:
+    - change: {"entity": "wishlist_items" | "notes", "id", "row"} — row = текущая
+      строка или null, если удалена; {"entity": "pairs", "op"} — поменялась пара;
+    - reset: часть событий потеряна, клиенту нужен /api/sync.
+    Переподключение с Last-Event-ID досылает пропущенное (см. webapp/events.py).
+    """
+    user_id, pair, err_resp, err_code = get_query_user_and_pair()
+    if err_resp is not None:
+        return err_resp, err_code
+
+    last_event_id = request.headers.get("Last-Event-ID")
+    sub, missed = event_hub.subscribe(pair["id"], last_event_id)
+
+    # Генератор работает уже после after_request: unit of work закрыт,
+    # соединение с БД возвращено в пул, поток только ждёт на очереди.
+    def stream():
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            if missed is None:
+                yield RESET_MESSAGE
+            else:
+                yield from missed
+            while True:
+                message = sub.get(timeout=SSE_HEARTBEAT)
+                yield message if message is not None else ": ping\n\n"
+        finally:
+            event_hub.unsubscribe(sub)
+
+    return Response(
+        stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
 
@@ -474,6 +686,8 @@ def api_wishlist_add():
     if not pair:
         return jsonify({"ok": False, "error": "NO_PAIR"}), 400
 
+    if isinstance(pair, SessionPair):
+        pair.validate()
     item = add_wishlist_item(pair["id"], user_id, title)
     item_serialized = serialize_wishlist_item(item)
 
@@ -487,47 +701,201 @@ def api_wishlist_add():
     return jsonify({"ok": True, "item": item_serialized})
 
 
-@app.post("/api/wishlist/delete")
-def api_wishlist_delete():
-    """
-    Удаление желания из своего списка.
-    JSON: { "user": {...}, "item_id": 123 }
-    """
-    data = request.json or {}
-    item_id = data.get("item_id")
+# ===== Точечные изменения =====
+# Правила проверки и сама запись для каждого изменения описаны один раз
+# и используются отдельными эндпоинтами, /api/batch и ASGI-режимом (webapp/asgi.py).
+# parse(data) -> (аргументы, код ошибки); write(user_id, **аргументы) -> Write:
+# SQL-запрос записи (RETURNING id изменённых строк) и entity для журнала
+# версий пары. В журнал и версию попадают только строки, которые запрос
+# действительно изменил: чужое, несуществующее или уже удалённое — не в счёт.
+
+
+class Write(NamedTuple):
+    sql: str
+    params: tuple
+    entity: str
 
+
+def _parse_item_id(data: Dict[str, Any]):
+    item_id = data.get("item_id")
     if not isinstance(item_id, int):
-        return jsonify({"ok": False, "error": "ITEM_ID_REQUIRED"}), 400
+        return None, "ITEM_ID_REQUIRED"
+    return {"item_id": item_id}, None
 
-    user_id, pair, err_resp, err_code = get_current_user_and_pair(data)
-    if err_resp is not None:
-        return err_resp, err_code
-    if not pair:
-        return jsonify({"ok": False, "error": "NO_PAIR"}), 400
 
+def _write_wishlist_delete(user_id: int, item_id: int) -> Write:
     # удаляем только свои желания
-    execute(
-        "DELETE FROM wishlist_items WHERE id = %s AND owner_user_id = %s",
+    return Write(
+        "DELETE FROM wishlist_items WHERE id = %s AND owner_user_id = %s RETURNING id",
         (item_id, user_id),
+        "wishlist_items",
     )
 
-    return jsonify({"ok": True})
+
+def _parse_wishlist_set_link(data: Dict[str, Any]):
+    args, error = _parse_item_id(data)
+    if error:
+        return None, error
+    url = (data.get("url") or "").strip()
+    if not (url.startswith("http://") or url.startswith("https://")):
+        return None, "INVALID_URL"
+    args["url"] = url
+    return args, None
 
 
-@app.post("/api/wishlist/set_link")
-def api_wishlist_set_link():
+def _write_wishlist_set_link(user_id: int, item_id: int, url: str) -> Write:
+    # обновляем только своё желание
+    return Write(
+        "UPDATE wishlist_items SET url = %s WHERE id = %s AND owner_user_id = %s RETURNING id",
+        (url, item_id, user_id),
+        "wishlist_items",
+    )
+
+
+def _parse_wishlist_edit(data: Dict[str, Any]):
+    args, error = _parse_item_id(data)
+    if error:
+        return None, error
+    title = (data.get("title") or "").strip()
+    if not title:
+        return None, "TITLE_REQUIRED"
+    args["title"] = title
+    return args, None
+
+
+def _write_wishlist_edit(user_id: int, item_id: int, title: str) -> Write:
+    return Write(
+        "UPDATE wishlist_items SET title = %s WHERE id = %s AND owner_user_id = %s RETURNING id",
+        (title, item_id, user_id),
+        "wishlist_items",
+    )
+
+
+def _parse_wishlist_toggle_done(data: Dict[str, Any]):
+    args, error = _parse_item_id(data)
+    if error:
+        return None, error
+    done = data.get("done")
+    if not isinstance(done, bool):
+        return None, "DONE_BOOL_REQUIRED"
+    args["done"] = done
+    return args, None
+
+
+def _write_wishlist_toggle_done(user_id: int, item_id: int, done: bool) -> Write:
+    return Write(
+        "UPDATE wishlist_items SET is_done = %s WHERE id = %s AND owner_user_id = %s RETURNING id",
+        (done, item_id, user_id),
+        "wishlist_items",
+    )
+
+
+def _parse_wishlist_set_priority(data: Dict[str, Any]):
+    args, error = _parse_item_id(data)
+    if error:
+        return None, error
+    priority = (data.get("priority") or "").strip()
+    if priority not in ("high", "medium", "low"):
+        return None, "INVALID_PRIORITY"
+    args["priority"] = priority
+    return args, None
+
+
+def _write_wishlist_set_priority(user_id: int, item_id: int, priority: str) -> Write:
+    return Write(
+        "UPDATE wishlist_items SET priority = %s WHERE id = %s AND owner_user_id = %s RETURNING id",
+        (priority, item_id, user_id),
+        "wishlist_items",
+    )
+
+
+def _parse_notes_delete(data: Dict[str, Any]):
+    note_id = data.get("note_id")
+    if not isinstance(note_id, int):
+        return None, "NOTE_ID_REQUIRED"
+    return {"note_id": note_id}, None
+
+
+def _write_notes_delete(user_id: int, note_id: int) -> Write:
+    return Write(
+        "DELETE FROM notes WHERE id = %s AND author_user_id = %s RETURNING id",
+        (note_id, user_id),
+        "notes",
+    )
+
+
+MUTATIONS = {
+    "wishlist/delete": (_parse_item_id, _write_wishlist_delete),
+    "wishlist/set_link": (_parse_wishlist_set_link, _write_wishlist_set_link),
+    "wishlist/edit": (_parse_wishlist_edit, _write_wishlist_edit),
+    "wishlist/toggle_done": (_parse_wishlist_toggle_done, _write_wishlist_toggle_done),
+    "wishlist/set_priority": (_parse_wishlist_set_priority, _write_wishlist_set_priority),
+    "notes/delete": (_parse_notes_delete, _write_notes_delete),
+}
+
+# Больше операций в одном /api/batch не принимаем
+BATCH_MAX_OPS = int(os.getenv("BATCH_MAX_OPS", "100"))
+
+
+def plan_batch(user_id: int, ops: List[Any]):
     """
-    Привязать ссылку к своему желанию.
-    JSON: { "user": {...}, "item_id": 123, "url": "https://..." }
+    Разобрать операции /api/batch. Возвращает (results, writes): результат
+    для каждой операции в порядке ops и записи валидных операций по порядку
+    вместе с индексом их результата. Невалидная операция получает ошибку
+    и пропускается.
     """
+    results = []
+    writes: List[Tuple[int, Write]] = []
+    for op in ops:
+        name = op.get("op") if isinstance(op, dict) else None
+        # op — из JSON клиента: список или объект в "op" не должен ронять весь batch
+        mutation = MUTATIONS.get(name) if isinstance(name, str) else None
+        if mutation is None:
+            results.append({"ok": False, "error": "UNKNOWN_OP"})
+            continue
+
+        parse, write = mutation
+        args, error = parse(op)
+        if error:
+            results.append({"ok": False, "error": error})
+            continue
+
+        writes.append((len(results), write(user_id, **args)))
+        results.append({"ok": True})
+    return results, writes
+
+
+def note_not_found(results: List[Dict[str, Any]], i: int, ids: List[int]) -> None:
+    """Операция, которая не изменила ни одной строки, — NOT_FOUND, а не ok."""
+    if not ids:
+        results[i] = {"ok": False, "error": "NOT_FOUND"}
+
+
+def changed_by_entity(applied: List[Tuple[Write, List[int]]]) -> Dict[str, List[int]]:
+    """
+    entity -> id изменённых строк по (запись, id из RETURNING): версия пары
+    растёт один раз на вид данных и только если что-то изменилось.
+    """
+    changed: Dict[str, List[int]] = {}
+    for w, ids in applied:
+        if ids:
+            changed.setdefault(w.entity, []).extend(ids)
+    return changed
+
+
+def apply_write(w: Write) -> List[int]:
+    """Выполнить запись; id строк, которые она изменила."""
+    return [row["id"] for row in execute_returning_all(w.sql, w.params)]
+
+
+def run_mutation(name: str):
+    """Отдельный эндпоинт изменения: проверка, авторизация, запись, версия пары."""
     data = request.json or {}
-    item_id = data.get("item_id")
-    url = (data.get("url") or "").strip()
+    parse, write = MUTATIONS[name]
 
-    if not isinstance(item_id, int):
-        return jsonify({"ok": False, "error": "ITEM_ID_REQUIRED"}), 400
-    if not (url.startswith("http://") or url.startswith("https://")):
-        return jsonify({"ok": False, "error": "INVALID_URL"}), 400
+    args, error = parse(data)
+    if error:
+        return jsonify({"ok": False, "error": error}), 400
 
     user_id, pair, err_resp, err_code = get_current_user_and_pair(data)
     if err_resp is not None:
@@ -535,28 +903,39 @@ def api_wishlist_set_link():
     if not pair:
         return jsonify({"ok": False, "error": "NO_PAIR"}), 400
 
-    # обновляем только своё желание
-    execute(
-        "UPDATE wishlist_items SET url = %s WHERE id = %s AND owner_user_id = %s",
-        (url, item_id, user_id),
-    )
+    # пару из токена могли удалить или сменить: версия и журнал должны расти
+    # у настоящей пары, иначе клиенты другой пары не увидят изменения
+    if isinstance(pair, SessionPair):
+        pair.validate()
+    w = write(user_id, **args)
+    ids = apply_write(w)
+    if ids:
+        bump_pair_version(pair["id"], w.entity, ids)
 
     return jsonify({"ok": True})
 
-@app.post("/api/wishlist/edit")
-def api_wishlist_edit():
+
+@app.post("/api/batch")
+def api_batch():
     """
-    Редактировать название своего желания.
-    JSON: { "user": {...}, "item_id": 123, "title": "Новое название" }
+    Несколько изменений одним запросом.
+    JSON: { "user": {...}, "ops": [ { "op": "wishlist/toggle_done", "item_id": 1, "done": true }, ... ] }
+    op — имя из MUTATIONS (путь эндпоинта без /api/), остальные поля — как у эндпоинта.
+
+    Пользователь и пара проверяются один раз, операции выполняются по порядку
+    в одной транзакции запроса (unit of work), версия пары растёт один раз на
+    вид данных. Ответ: { "ok": true, "results": [ {"ok": true} | {"ok": false, "error": "..."} ] }
+    в порядке ops. Невалидная операция пропускается, остальные выполняются;
+    операция, не нашедшая своей строки (чужая, удалённая), получает NOT_FOUND;
+    ошибка БД откатывает весь пакет.
     """
     data = request.json or {}
-    item_id = data.get("item_id")
-    title = (data.get("title") or "").strip()
+    ops = data.get("ops")
 
-    if not isinstance(item_id, int):
-        return jsonify({"ok": False, "error": "ITEM_ID_REQUIRED"}), 400
-    if not title:
-        return jsonify({"ok": False, "error": "TITLE_REQUIRED"}), 400
+    if not isinstance(ops, list) or not ops:
+        return jsonify({"ok": False, "error": "OPS_REQUIRED"}), 400
+    if len(ops) > BATCH_MAX_OPS:
+        return jsonify({"ok": False, "error": "TOO_MANY_OPS"}), 400
 
     user_id, pair, err_resp, err_code = get_current_user_and_pair(data)
     if err_resp is not None:
@@ -564,12 +943,44 @@ def api_wishlist_edit():
     if not pair:
         return jsonify({"ok": False, "error": "NO_PAIR"}), 400
 
-    execute(
-        "UPDATE wishlist_items SET title = %s WHERE id = %s AND owner_user_id = %s",
-        (title, item_id, user_id),
-    )
+    if isinstance(pair, SessionPair):
+        pair.validate()
+    results, writes = plan_batch(user_id, ops)
+    applied = []
+    for i, w in writes:
+        ids = apply_write(w)
+        note_not_found(results, i, ids)
+        applied.append((w, ids))
+    for entity, ids in changed_by_entity(applied).items():
+        bump_pair_version(pair["id"], entity, ids)
+
+    return jsonify({"ok": True, "results": results})
 
-    return jsonify({"ok": True})
+
+@app.post("/api/wishlist/delete")
+def api_wishlist_delete():
+    """
+    Удаление желания из своего списка.
+    JSON: { "user": {...}, "item_id": 123 }
+    """
+    return run_mutation("wishlist/delete")
+
+
+@app.post("/api/wishlist/set_link")
+def api_wishlist_set_link():
+    """
+    Привязать ссылку к своему желанию.
+    JSON: { "user": {...}, "item_id": 123, "url": "https://..." }
+    """
+    return run_mutation("wishlist/set_link")
+
+@app.post("/api/wishlist/edit")
+def api_wishlist_edit():
+    """
+    Редактировать название своего желания.
+    JSON: { "user": {...}, "item_id": 123, "title": "Новое название" }
+    """
+    return run_mutation("wishlist/edit")
 
 @app.post("/api/wishlist/send_to_bot")
 def api_wishlist_send_to_bot():
@@ -582,20 +993,7 @@ def api_wishlist_send_to_bot():
         return jsonify({"ok": False, "error": "NO_PAIR"}), 400
 
     # что отправляем: мой список или список партнёра
-    target = (data.get("target") or "me").strip()  # "me" | "partner"
-
-    if target == "partner":
-        # чей список выгружаем — партнёра
-        if pair["creator_user_id"] == user_id:
-            owner_user_id = pair["partner_user_id"]
-        else:
-            owner_user_id = pair["creator_user_id"]
-        title = "Список партнёра"
-    else:
-        # мой список
-        owner_user_id = user_id
-        title = "Мой список"
-
+    owner_user_id, title = resolve_export_owner(pair, user_id, data.get("target"))
     if not owner_user_id:
         return jsonify({"ok": False, "error": "NO_PARTNER"}), 400
 
@@ -606,35 +1004,48 @@ def api_wishlist_send_to_bot():
         print(f"Failed to send wishlist xlsx to bot: {e}")
         return jsonify({"ok": False, "error": "SEND_FAILED"}), 500
 
-    return jsonify({"ok": True})
+    return jsonify({"ok": True, "queued": True})
 
-@app.post("/api/wishlist/toggle_done")
-def api_wishlist_toggle_done():
+
+@app.get("/api/wishlist/export")
+def api_wishlist_export():
     """
-    Переключить флаг is_done для своего желания.
-    JSON: { "user": {...}, "item_id": 123, "done": true }
+    Скачать вишлист файлом: /api/wishlist/export?session=...&format=csv|json|xlsx&target=me|partner.
+    Ответ идёт кусками по мере чтения курсора и не проходит через Telegram.
+    Как и у /api/events, токен сессии — в query: это обычная ссылка для скачивания.
     """
-    data = request.json or {}
-    item_id = data.get("item_id")
-    done = data.get("done")
-
-    if not isinstance(item_id, int):
-        return jsonify({"ok": False, "error": "ITEM_ID_REQUIRED"}), 400
-    if not isinstance(done, bool):
-        return jsonify({"ok": False, "error": "DONE_BOOL_REQUIRED"}), 400
+    fmt = (request.args.get("format") or "xlsx").lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({"ok": False, "error": "BAD_FORMAT"}), 400
 
-    user_id, pair, err_resp, err_code = get_current_user_and_pair(data)
+    user_id, pair, err_resp, err_code = get_query_user_and_pair()
     if err_resp is not None:
         return err_resp, err_code
-    if not pair:
-        return jsonify({"ok": False, "error": "NO_PAIR"}), 400
 
-    execute(
-        "UPDATE wishlist_items SET is_done = %s WHERE id = %s AND owner_user_id = %s",
-        (done, item_id, user_id),
+    owner_user_id, title = resolve_export_owner(pair, user_id, request.args.get("target"))
+    if not owner_user_id:
+        return jsonify({"ok": False, "error": "NO_PARTNER"}), 400
+
+    # Генератор читает БД уже после after_request: unit of work закрыт,
+    # курсор берёт своё соединение и отдаёт его, когда поток закончится.
+    mimetype, ext = EXPORT_FORMATS[fmt]
+    return Response(
+        stream_wishlist_export(pair["id"], owner_user_id, fmt, title),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": f"attachment; filename=wishlist.{ext}",
+            "Cache-Control": "no-store",
+            "X-Accel-Buffering": "no",
+        },
     )
 
-    return jsonify({"ok": True})
+@app.post("/api/wishlist/toggle_done")
+def api_wishlist_toggle_done():
+    """
+    Переключить флаг is_done для своего желания.
+    JSON: { "user": {...}, "item_id": 123, "done": true }
+    """
+    return run_mutation("wishlist/toggle_done")
 
 
 @app.post("/api/wishlist/set_priority")
@@ -644,27 +1055,7 @@ def api_wishlist_set_priority():
     JSON: { "user": {...}, "item_id": 123, "priority": "high" }
     Допустимые значения priority: "high", "medium", "low"
     """
-    data = request.json or {}
-    item_id = data.get("item_id")
-    priority = (data.get("priority") or "").strip()
-
-    if not isinstance(item_id, int):
-        return jsonify({"ok": False, "error": "ITEM_ID_REQUIRED"}), 400
-    if priority not in ("high", "medium", "low"):
-        return jsonify({"ok": False, "error": "INVALID_PRIORITY"}), 400
-
-    user_id, pair, err_resp, err_code = get_current_user_and_pair(data)
-    if err_resp is not None:
-        return err_resp, err_code
-    if not pair:
-        return jsonify({"ok": False, "error": "NO_PAIR"}), 400
-
-    execute(
-        "UPDATE wishlist_items SET priority = %s WHERE id = %s AND owner_user_id = %s",
-        (priority, item_id, user_id),
-    )
-
-    return jsonify({"ok": True})
+    return run_mutation("wishlist/set_priority")
 
 
 @app.post("/api/cloud/set")
@@ -783,7 +1174,9 @@ def api_pair_delete():
         (pair_id,),
     )
 
-    execute("DELETE FROM pairs WHERE id = %s", (pair_id,))
+    delete_pair(pair_id)
+    # в прежнем токене остался pair_id удалённой пары
+    g.new_session = issue_session(user_id, None)
 
     return jsonify({"ok": True})
 
@@ -802,10 +1195,11 @@ def api_wishlist_clear():
         return jsonify({"ok": False, "error": "NO_PAIR"}), 400
 
     # Вариант 1 (если в таблице есть колонка pair_id — наиболее корректно):
-    execute(
-        "DELETE FROM wishlist_items WHERE pair_id = %s AND owner_user_id = %s",
+    deleted = execute_returning_all(
+        "DELETE FROM wishlist_items WHERE pair_id = %s AND owner_user_id = %s RETURNING id",
         (pair["id"], user_id),
-    )
+    ) or []
+    bump_pair_version(pair["id"], "wishlist_items", [r["id"] for r in deleted])
 
     # Вариант 2 (на 100% совместим с тем, что уже видно в коде — чистим все желания юзера):
     # execute(
@@ -815,6 +1209,12 @@ def api_wishlist_clear():
 
     return jsonify({"ok": True})
 
+ADD_NOTE_SQL = (
+    "INSERT INTO notes (pair_id, author_user_id, text) VALUES (%s, %s, %s) "
+    "RETURNING id, author_user_id, text, created_at"
+)
+
+
 @app.post("/api/notes/add")
 def api_notes_add():
     data = request.json or {}
@@ -829,10 +1229,10 @@ def api_notes_add():
     if not pair:
         return jsonify({"ok": False, "error": "NO_PAIR"}), 400
 
-    note = execute_returning_one(
-        "INSERT INTO notes (pair_id, author_user_id, text) VALUES (%s, %s, %s) RETURNING id, author_user_id, text, created_at",
-        (pair["id"], user_id, text),
-    )
+    if isinstance(pair, SessionPair):
+        pair.validate()
+    note = execute_returning_one(ADD_NOTE_SQL, (pair["id"], user_id, text))
+    bump_pair_version(pair["id"], "notes", [note["id"]])
     note_serialized = serialize_note(note, user_id)
 
     try:
@@ -845,26 +1245,24 @@ def api_notes_add():
 
 @app.post("/api/notes/delete")
 def api_notes_delete():
-    data = request.json or {}
-    note_id = data.get("note_id")
-
-    if not isinstance(note_id, int):
-        return jsonify({"ok": False, "error": "NOTE_ID_REQUIRED"}), 400
-
-    user_id, pair, err_resp, err_code = get_current_user_and_pair(data)
-    if err_resp is not None:
-        return err_resp, err_code
-    if not pair:
-        return jsonify({"ok": False, "error": "NO_PAIR"}), 400
+    """
+    Удалить свою заметку.
+    JSON: { "user": {...}, "note_id": 123 }
+    """
+    return run_mutation("notes/delete")
 
-    execute(
-        "DELETE FROM notes WHERE id = %s AND author_user_id = %s",
-        (note_id, user_id),
-    )
 
-    return jsonify({"ok": True})
+@app.get("/metrics")
+def metrics_endpoint():
+    """Метрики процесса в формате Prometheus (см. tgbot/metrics.py)."""
+    if not metrics.check_token(request.headers.get("Authorization"), required=True):
+        return Response("unauthorized\n", status=401, mimetype="text/plain")
+    for state, value in get_pool().stats().items():
+        metrics.DB_POOL.set(value, pool="sync", state=state)
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 
 if __name__ == "__main__":
     # dev-режим
+    init_pool()
     app.run(host="0.0.0.0", port=8000, debug=True)
\ No newline at end of file
@@ -0,0 +1,477 @@
+# webapp/asgi.py
+"""
+ASGI-режим вебаппа: асинхронные обработчики горячих эндпоинтов.
+
+Flask-приложение (webapp/app.py) держит поток воркера на всё время запроса,
+включая ожидание БД, а SSE-соединение /api/events — постоянно. Здесь те же
+эндпоинты написаны на Quart (API как у Flask) поверх асинхронного слоя БД
+(tgbot/adb.py, psycopg 3): пока запрос ждёт Postgres, event loop обслуживает
+другие, а открытое SSE-соединение — это корутина, а не поток.
+
+Асинхронно обслуживаются: /api/init, /api/sync, /api/events, /api/batch,
+точечные изменения (MUTATIONS), /api/wishlist/add, /api/notes/add.
+Остальные (редкие) запросы и статика уходят во Flask-приложение, которое
+выполняется в пуле потоков (a2wsgi), — контракт API один и тот же.
+Проверки, SQL и сборка ответов — общие с app.py и services.py.
+
+Telegram из запросов не вызывается ни в одном режиме: сообщения и файлы
+кладутся в outbox, отправляет их воркер (tgbot/outbox.py).
+
+    uvicorn webapp.asgi:application --host 0.0.0.0 --port 8000
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+import time
+from typing import Any, Dict, List
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.append(BASE_DIR)
+
+from a2wsgi import WSGIMiddleware  # noqa: E402
+from quart import Quart, Response, g, jsonify, request  # noqa: E402
+
+from tgbot import adb, aservices, metrics  # type: ignore  # noqa: E402
+from tgbot.db import get_pool  # type: ignore  # noqa: E402
+from tgbot.changes import start_listener  # type: ignore  # noqa: E402
+from tgbot.outbox import message_insert  # type: ignore  # noqa: E402
+from webapp.app import (  # noqa: E402
+    ADD_NOTE_SQL,
+    BATCH_MAX_OPS,
+    MUTATIONS,
+    TGUserWrapper,
+    app as flask_app,
+    build_sync_payload,
+    changed_by_entity,
+    init_etag,
+    init_payload_from_dashboard,
+    new_note_notification,
+    new_wish_notification,
+    note_not_found,
+    partner_user_id_of,
+    plan_batch,
+    serialize_note,
+    serialize_wishlist_item,
+)
+from webapp.auth import (  # noqa: E402
+    WEBAPP_TRUST_USER,
+    StaleSession,
+    issue_session,
+    read_session,
+    verify_init_data,
+)
+from webapp.events import (  # noqa: E402
+    RESET_MESSAGE,
+    SSE_HEARTBEAT,
+    SSE_RETRY_MS,
+    AsyncSubscription,
+    event_hub,
+)
+
+
+# Потоки для запросов, которые обслуживает Flask-приложение
+ASGI_WSGI_WORKERS = int(os.getenv("ASGI_WSGI_WORKERS", "10"))
+
+quart_app = Quart(__name__)
+
+
+# ===== Жизненный цикл и unit of work на запрос =====
+
+
+@quart_app.before_serving
+async def open_pool():
+    await adb.init_pool()
+    # слушатель NOTIFY (кэши, SSE) — общий с Flask-частью процесса
+    start_listener()
+
+
+@quart_app.after_serving
+async def close_pool():
+    await adb.close_pool()
+
+
+@quart_app.before_request
+async def begin_request_metrics():
+    # как в app.py: первым до запроса и последним после, чтобы учесть COMMIT
+    g.started_at = time.perf_counter()
+    metrics.begin_request()
+
+
+@quart_app.after_request
+async def record_request_metrics(response):
+    started_at = g.pop("started_at", None)
+    if started_at is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.end_request(
+            request.method, route, request.path, response.status_code, time.perf_counter() - started_at
+        )
+    return response
+
+
+@quart_app.before_request
+async def begin_request_unit_of_work():
+    g.uow = adb.begin_unit_of_work()
+
+
+@quart_app.after_request
+async def commit_request_unit_of_work(response):
+    uow = g.pop("uow", None)
+    if response.status_code >= 500:
+        # упавший view: Quart тоже вызывает after_request для ответа 500
+        await adb.end_unit_of_work(uow, commit=False)
+        return response
+    try:
+        await adb.end_unit_of_work(uow)
+    except Exception as e:
+        print(f"Failed to commit request transaction: {e}")
+        response = jsonify({"ok": False, "error": "DB_COMMIT_FAILED"})
+        response.status_code = 500
+    return response
+
+
+@quart_app.teardown_request
+async def rollback_request_unit_of_work(exc):
+    uow = g.pop("uow", None)
+    await adb.end_unit_of_work(uow, commit=False)
+
+
+@quart_app.after_request
+async def attach_session_token(response):
+    token = g.pop("new_session", None)
+    if token and response.status_code < 400:
+        response.headers["X-Session-Token"] = token
+    return response
+
+
+@quart_app.errorhandler(StaleSession)
+async def handle_stale_session(exc):
+    await adb.end_unit_of_work(g.pop("uow", None), commit=False)
+    return jsonify({"ok": False, "error": "SESSION_EXPIRED"}), 401
+
+
+# ===== Авторизация (как get_current_user в app.py) =====
+
+
+async def request_json() -> Dict[str, Any]:
+    return (await request.get_json(silent=True)) or {}
+
+
+async def get_current_user(payload: Dict[str, Any]):
+    auth = request.headers.get("Authorization", "")
+    if auth.startswith("Bearer "):
+        session = read_session(auth[len("Bearer "):])
+        if session is None:
+            return None, jsonify({"ok": False, "error": "SESSION_EXPIRED"}), 401
+        g.session_pair_id = session.get("p")
+        return session["u"], None, None
+
+    init_data = request.headers.get("X-Telegram-Init-Data")
+    if init_data:
+        user_data = verify_init_data(init_data)
+        if user_data is None:
+            return None, jsonify({"ok": False, "error": "BAD_INIT_DATA"}), 401
+    elif WEBAPP_TRUST_USER:
+        user_data = payload.get("user")
+    else:
+        return None, jsonify({"ok": False, "error": "AUTH_REQUIRED"}), 401
+
+    if not user_data or "id" not in user_data:
+        return None, jsonify({"ok": False, "error": "USER_REQUIRED"}), 400
+
+    user_id = await aservices.get_or_create_user(TGUserWrapper(user_data))
+    pair = await aservices.get_pair_by_user(user_id)
+    g.session_pair_id = pair["id"] if pair else None
+    g.new_session = issue_session(user_id, g.session_pair_id)
+    return user_id, None, None
+
+
+async def get_current_user_and_pair_id(payload: Dict[str, Any]):
+    """(user_id, pair_id, ...): pair_id из токена — без запроса к БД."""
+    user_id, err_resp, err_code = await get_current_user(payload)
+    if err_resp is not None:
+        return None, None, err_resp, err_code
+
+    pair_id = g.get("session_pair_id")
+    if not pair_id:
+        pair = await aservices.get_pair_by_user(user_id)
+        pair_id = pair["id"] if pair else None
+        if pair_id and "new_session" not in g:
+            g.new_session = issue_session(user_id, pair_id)
+    return user_id, pair_id, None, None
+
+
+async def get_query_user_and_pair_id():
+    """Как get_query_user_and_pair в app.py: токен сессии в ?session=."""
+    session = read_session(request.args.get("session"))
+    if session is not None:
+        user_id, pair_id = session["u"], session.get("p")
+    elif WEBAPP_TRUST_USER and request.args.get("tg_id", type=int) is not None:
+        user_id = await aservices.get_user_id_by_telegram_id(request.args.get("tg_id", type=int))
+        if not user_id:
+            return None, None, jsonify({"ok": False, "error": "USER_NOT_FOUND"}), 400
+        pair_id = None
+    else:
+        return None, None, jsonify({"ok": False, "error": "SESSION_EXPIRED"}), 401
+
+    if not pair_id:
+        pair = await aservices.get_pair_by_user(user_id)
+        pair_id = pair["id"] if pair else None
+    if not pair_id:
+        return None, None, jsonify({"ok": False, "error": "NO_PAIR"}), 400
+    return user_id, pair_id, None, None
+
+
+async def load_pair(user_id: int, pair_id: int) -> Dict[str, Any]:
+    """Строка пары из токена (обычно из кэша); пары нет — токен устарел."""
+    pair = await aservices.get_pair_by_user(user_id)
+    if not pair or pair["id"] != pair_id:
+        raise StaleSession()
+    return pair
+
+
+async def notify_partner(pair_id: int, user_id: int, text: str) -> None:
+    partner_id = partner_user_id_of(await load_pair(user_id, pair_id), user_id)
+    if not partner_id:
+        return
+    partner = await adb.fetchone("SELECT telegram_id FROM users WHERE id = %s", (partner_id,))
+    if not partner or not partner.get("telegram_id"):
+        return
+    await adb.execute(*message_insert(partner["telegram_id"], text, parse_mode="HTML"))
+
+
+# ===== Маршруты =====
+
+
+@quart_app.post("/api/init")
+async def api_init():
+    data = await request_json()
+
+    user_id, err_resp, err_code = await get_current_user(data)
+    if err_resp is not None:
+        return err_resp, err_code
+
+    client_etag = request.headers.get("If-None-Match")
+    if client_etag:
+        pair = await aservices.get_pair_by_user(user_id)
+        if pair and client_etag == init_etag(pair, user_id):
+            resp = jsonify({"ok": True, "not_modified": True})
+            resp.headers["ETag"] = client_etag
+            return resp
+
+    payload = init_payload_from_dashboard(user_id, await aservices.get_dashboard(user_id))
+    resp = jsonify(payload)
+    if payload.get("etag"):
+        resp.headers["ETag"] = payload["etag"]
+    return resp
+
+
+@quart_app.post("/api/sync")
+async def api_sync():
+    data = await request_json()
+    since = request.args.get("since", type=int)
+
+    if since is None:
+        return jsonify({"ok": False, "error": "SINCE_REQUIRED"}), 400
+
+    user_id, pair_id, err_resp, err_code = await get_current_user_and_pair_id(data)
+    if err_resp is not None:
+        return err_resp, err_code
+    if not pair_id:
+        return jsonify({"ok": True, "has_pair": False, "user_id": user_id})
+
+    payload = build_sync_payload(user_id, await aservices.get_pair_changes(pair_id, user_id, since))
+    resp = jsonify(payload)
+    if payload.get("etag"):
+        resp.headers["ETag"] = payload["etag"]
+    return resp
+
+
+@quart_app.get("/api/events")
+async def api_events():
+    user_id, pair_id, err_resp, err_code = await get_query_user_and_pair_id()
+    if err_resp is not None:
+        return err_resp, err_code
+
+    sub = AsyncSubscription(pair_id, asyncio.get_running_loop())
+    sub, missed = event_hub.subscribe(pair_id, request.headers.get("Last-Event-ID"), sub)
+
+    async def stream():
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n".encode()
+            if missed is None:
+                yield RESET_MESSAGE.encode()
+            else:
+                for message in missed:
+                    yield message.encode()
+            while True:
+                message = await sub.get(timeout=SSE_HEARTBEAT)
+                yield (message if message is not None else ": ping\n\n").encode()
+        finally:
+            event_hub.unsubscribe(sub)
+
+    response = Response(
+        stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # соединение живёт, пока открыто Mini App
+    response.timeout = None
+    return response
+
+
+@quart_app.post("/api/wishlist/add")
+async def api_wishlist_add():
+    data = await request_json()
+    title = (data.get("title") or "").strip()
+
+    if not title:
+        return jsonify({"ok": False, "error": "TITLE_REQUIRED"}), 400
+
+    user_id, pair_id, err_resp, err_code = await get_current_user_and_pair_id(data)
+    if err_resp is not None:
+        return err_resp, err_code
+    if not pair_id:
+        return jsonify({"ok": False, "error": "NO_PAIR"}), 400
+
+    # пару из токена мог удалить партнёр: 401 SESSION_EXPIRED, а не 500 на внешнем ключе
+    await load_pair(user_id, pair_id)
+    item = await aservices.add_wishlist_item(pair_id, user_id, title)
+
+    try:
+        await notify_partner(pair_id, user_id, new_wish_notification(title))
+    except StaleSession:
+        raise
+    except Exception as e:
+        print(f"Failed to notify partner about new wishlist item (webapp): {e}")
+
+    return jsonify({"ok": True, "item": serialize_wishlist_item(item)})
+
+
+@quart_app.post("/api/notes/add")
+async def api_notes_add():
+    data = await request_json()
+    text = (data.get("text") or "").strip()
+
+    if not text:
+        return jsonify({"ok": False, "error": "TEXT_REQUIRED"}), 400
+
+    user_id, pair_id, err_resp, err_code = await get_current_user_and_pair_id(data)
+    if err_resp is not None:
+        return err_resp, err_code
+    if not pair_id:
+        return jsonify({"ok": False, "error": "NO_PAIR"}), 400
+
+    await load_pair(user_id, pair_id)
+    note = await adb.execute_returning_one(ADD_NOTE_SQL, (pair_id, user_id, text))
+    await aservices.bump_pair_version(pair_id, "notes", [note["id"]])
+
+    try:
+        await notify_partner(pair_id, user_id, new_note_notification(text))
+    except StaleSession:
+        raise
+    except Exception as e:
+        print(f"Failed to notify partner about new note: {e}")
+
+    return jsonify({"ok": True, "note": serialize_note(note, user_id)})
+
+
+@quart_app.post("/api/batch")
+async def api_batch():
+    data = await request_json()
+    ops = data.get("ops")
+
+    if not isinstance(ops, list) or not ops:
+        return jsonify({"ok": False, "error": "OPS_REQUIRED"}), 400
+    if len(ops) > BATCH_MAX_OPS:
+        return jsonify({"ok": False, "error": "TOO_MANY_OPS"}), 400
+
+    user_id, pair_id, err_resp, err_code = await get_current_user_and_pair_id(data)
+    if err_resp is not None:
+        return err_resp, err_code
+    if not pair_id:
+        return jsonify({"ok": False, "error": "NO_PAIR"}), 400
+
+    await load_pair(user_id, pair_id)
+    results, writes = plan_batch(user_id, ops)
+    applied = []
+    for i, w in writes:
+        ids = await apply_write(w)
+        note_not_found(results, i, ids)
+        applied.append((w, ids))
+    for entity, ids in changed_by_entity(applied).items():
+        await aservices.bump_pair_version(pair_id, entity, ids)
+
+    return jsonify({"ok": True, "results": results})
+
+
+@quart_app.get("/metrics")
+async def metrics_endpoint():
+    """Метрики процесса: и асинхронные эндпоинты, и Flask-часть — реестр общий."""
+    if not metrics.check_token(request.headers.get("Authorization"), required=True):
+        return Response("unauthorized\n", status=401, mimetype="text/plain")
+    for state, value in adb.pool_stats().items():
+        metrics.DB_POOL.set(value, pool="async", state=state)
+    for state, value in get_pool().stats().items():
+        metrics.DB_POOL.set(value, pool="sync", state=state)
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+async def apply_write(w) -> List[int]:
+    """Как apply_write в app.py: id строк, которые запись изменила."""
+    return [row["id"] for row in await adb.execute_returning_all(w.sql, w.params)]
+
+
+def mutation_view(name: str):
+    parse, write = MUTATIONS[name]
+
+    async def view():
+        data = await request_json()
+        args, error = parse(data)
+        if error:
+            return jsonify({"ok": False, "error": error}), 400
+
+        user_id, pair_id, err_resp, err_code = await get_current_user_and_pair_id(data)
+        if err_resp is not None:
+            return err_resp, err_code
+        if not pair_id:
+            return jsonify({"ok": False, "error": "NO_PAIR"}), 400
+
+        # версия и журнал — у пары из токена, только если она ещё настоящая
+        await load_pair(user_id, pair_id)
+        w = write(user_id, **args)
+        ids = await apply_write(w)
+        if ids:
+            await aservices.bump_pair_version(pair_id, w.entity, ids)
+        return jsonify({"ok": True})
+
+    return view
+
+
+for _name in MUTATIONS:
+    quart_app.add_url_rule(f"/api/{_name}", endpoint=_name, view_func=mutation_view(_name), methods=["POST"])
+
+
+# ===== Точка входа ASGI =====
+
+ASYNC_PATHS = frozenset(rule.rule for rule in quart_app.url_map.iter_rules() if rule.endpoint != "static")
+
+_flask_asgi = WSGIMiddleware(flask_app, workers=ASGI_WSGI_WORKERS)
+
+
+async def application(scope, receive, send):
+    """Горячие пути — в Quart, всё остальное — во Flask-приложение (в потоках)."""
+    if scope["type"] == "http" and scope["path"] not in ASYNC_PATHS:
+        await _flask_asgi(scope, receive, send)
+    else:
+        # lifespan (открыть/закрыть пул) и асинхронные маршруты
+        await quart_app(scope, receive, send)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run("webapp.asgi:application", host="0.0.0.0", port=8000)
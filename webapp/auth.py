@@ -0,0 +1,158 @@
+# webapp/auth.py
+"""
+Авторизация запросов Mini App.
+
+Telegram передаёт Mini App строку initData, подписанную токеном бота.
+Сервер проверяет подпись (HMAC-SHA256, см. документацию Telegram WebApp)
+один раз — на первом запросе (обычно /api/init) — и выдаёт короткоживущий
+токен сессии с user_id и pair_id, подписанный уже своим секретом. Дальше
+main.js шлёт токен в заголовке Authorization, и запрос авторизуется без
+обращения к БД: ни upsert пользователя, ни поиска пары.
+
+Пара в токене — только id. Если обработчику нужны другие поля пары,
+SessionPair догружает строку (обычно из кэша пар) при первом обращении.
+"""
+
+from __future__ import annotations
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qsl
+
+from tgbot.config import BOT_TOKEN  # type: ignore
+from tgbot.services import get_pair_by_user  # type: ignore
+
+
+# Сколько живёт токен сессии (сек.); по истечении main.js заново шлёт initData
+SESSION_TTL = int(os.getenv("SESSION_TTL", "900"))
+# Насколько старую initData принимать (сек., по auth_date)
+INIT_DATA_MAX_AGE = int(os.getenv("INIT_DATA_MAX_AGE", "86400"))
+# Только для разработки вне Telegram: верить объекту user из JSON / tg_id из query
+WEBAPP_TRUST_USER = os.getenv("WEBAPP_TRUST_USER", "0") == "1"
+
+
+def _session_secret() -> bytes:
+    secret = os.getenv("SESSION_SECRET")
+    if secret:
+        return secret.encode("utf-8")
+    if BOT_TOKEN:
+        # отдельный ключ, выведенный из токена бота: одинаковый во всех процессах
+        return hmac.new(BOT_TOKEN.encode("utf-8"), b"fambot-session", hashlib.sha256).digest()
+    print("SESSION_SECRET and BOT_TOKEN are not set: sessions are valid only in this process")
+    return secrets.token_bytes(32)
+
+
+_SECRET = _session_secret()
+
+
+class StaleSession(Exception):
+    """Пара из токена больше не существует (удалена) — нужен новый токен."""
+
+
+def verify_init_data(init_data: str, bot_token: Optional[str] = BOT_TOKEN) -> Optional[Dict[str, Any]]:
+    """
+    Проверить подпись initData. Возвращает объект user из неё или None,
+    если подпись неверна, данные устарели или пользователя в них нет.
+    """
+    if not init_data or not bot_token:
+        return None
+
+    fields = dict(parse_qsl(init_data, keep_blank_values=True))
+    received = fields.pop("hash", "")
+    check_string = "\n".join(f"{k}={v}" for k, v in sorted(fields.items()))
+    secret_key = hmac.new(b"WebAppData", bot_token.encode("utf-8"), hashlib.sha256).digest()
+    expected = hmac.new(secret_key, check_string.encode("utf-8"), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected, received):
+        return None
+
+    try:
+        auth_date = int(fields.get("auth_date") or 0)
+        user = json.loads(fields.get("user") or "null")
+    except ValueError:
+        return None
+    if INIT_DATA_MAX_AGE and time.time() - auth_date > INIT_DATA_MAX_AGE:
+        return None
+    if not isinstance(user, dict) or "id" not in user:
+        return None
+    return user
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def issue_session(user_id: int, pair_id: Optional[int]) -> str:
+    """Токен "<payload>.<подпись>", payload = {"u": user_id, "p": pair_id, "exp": ...}."""
+    payload = {"u": user_id, "p": pair_id, "exp": int(time.time()) + SESSION_TTL}
+    body = _b64encode(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+    signature = hmac.new(_SECRET, body.encode("ascii"), hashlib.sha256).digest()
+    return f"{body}.{_b64encode(signature)}"
+
+
+def read_session(token: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Payload токена или None, если подпись неверна или срок истёк."""
+    if not token:
+        return None
+    body, _, signature = token.partition(".")
+    expected = _b64encode(hmac.new(_SECRET, body.encode("ascii", "replace"), hashlib.sha256).digest())
+    if not hmac.compare_digest(expected, signature):
+        return None
+    try:
+        payload = json.loads(_b64decode(body))
+    except ValueError:
+        return None
+    if not isinstance(payload, dict) or payload.get("exp", 0) < time.time():
+        return None
+    return payload
+
+
+class SessionPair(dict):
+    """
+    Пара из токена сессии: сразу известен только id, остальные поля
+    читаются (из кэша пар или БД) при первом обращении к ним.
+    """
+
+    def __init__(self, pair_id: int, user_id: int) -> None:
+        super().__init__(id=pair_id)
+        self._user_id = user_id
+        self._loaded = False
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        pair = get_pair_by_user(self._user_id)
+        if not pair or pair["id"] != self["id"]:
+            raise StaleSession()
+        self.update(pair)
+
+    def validate(self) -> "SessionPair":
+        """
+        Проверить, что пара ещё есть, не читая полей, — перед любой записью:
+        удалённая партнёром пара дала бы ошибку внешнего ключа (500), а не
+        StaleSession (401 SESSION_EXPIRED), а изменение по старой паре подняло
+        бы её версию вместо версии настоящей пары.
+        """
+        self._load()
+        return self
+
+    def __missing__(self, key):
+        self._load()
+        if key not in self:
+            raise KeyError(key)
+        return dict.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        if key not in self:
+            self._load()
+        return dict.get(self, key, default)
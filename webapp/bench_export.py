@@ -0,0 +1,147 @@
+# webapp/bench_export.py
+"""
+Бенчмарк выгрузки вишлиста в XLSX: потоковая выгрузка (tgbot/export.py)
+против прежнего построения книги целиком в памяти.
+
+Засевает в БД из окружения тестовую пару с N желаниями, для каждого размера
+печатает время и пик памяти Python (tracemalloc, отдельным прогоном),
+затем удаляет данные.
+
+    python webapp/bench_export.py --sizes 10000 100000
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.append(BASE_DIR)
+
+from openpyxl import Workbook  # noqa: E402
+from openpyxl.styles import Alignment, Font  # noqa: E402
+from openpyxl.utils import get_column_letter  # noqa: E402
+
+from tgbot.db import execute, execute_returning_one, fetchall, init_pool  # noqa: E402
+from tgbot.export import write_wishlist_xlsx  # noqa: E402
+from tgbot.services import iter_wishlist_export  # noqa: E402
+
+# Диапазон telegram_id, который не пересекается с настоящими пользователями
+BENCH_TG_ID = 9_000_000_100
+
+
+def seed(items: int):
+    row = execute_returning_one(
+        """
+        INSERT INTO users (telegram_id, username, first_name)
+        VALUES (%s, 'bench_export', 'Bench')
+        ON CONFLICT (telegram_id) DO UPDATE SET username = EXCLUDED.username
+        RETURNING id
+        """,
+        (BENCH_TG_ID,),
+    )
+    user_id = row["id"]
+    execute("DELETE FROM pairs WHERE creator_user_id = %s", (user_id,))
+    pair = execute_returning_one(
+        "INSERT INTO pairs (creator_user_id, invite_token) VALUES (%s, %s) RETURNING id",
+        (user_id, f"bench-export-{time.time_ns()}"),
+    )
+    execute(
+        """
+        INSERT INTO wishlist_items (pair_id, owner_user_id, title, url, priority, created_at)
+        SELECT %s, %s, 'Желание номер ' || g || repeat('!', g %% 40),
+               'https://example.com/item/' || g,
+               (ARRAY['high', 'medium', 'low'])[1 + g %% 3],
+               NOW() - make_interval(mins => g)
+        FROM generate_series(1, %s) g
+        """,
+        (pair["id"], user_id, items),
+    )
+    return user_id, pair["id"]
+
+
+def cleanup() -> None:
+    execute("DELETE FROM users WHERE telegram_id = %s", (BENCH_TG_ID,))
+
+
+def legacy_export(pair_id: int, owner_user_id: int) -> int:
+    """Прежний путь: все строки в список, книга в памяти, ширины повторным обходом ячеек."""
+    items = fetchall(
+        """
+        SELECT title, url, created_at, priority
+        FROM wishlist_items
+        WHERE pair_id = %s AND owner_user_id = %s
+        ORDER BY created_at DESC
+        """,
+        (pair_id, owner_user_id),
+    )
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Wishlist"
+    labels = {"high": "Очень хочу", "medium": "Хочу", "low": "Несрочно"}
+    headers = ["Желание", "Приоритет", "Ссылка", "Создано"]
+    ws.append(headers)
+    for col in range(1, len(headers) + 1):
+        c = ws.cell(row=1, column=col)
+        c.font = Font(bold=True)
+        c.alignment = Alignment(vertical="center")
+    for r in items:
+        priority = r.get("priority") or "medium"
+        ws.append([r["title"], labels.get(priority, priority), r["url"] or "", r["created_at"].strftime("%d.%m.%Y")])
+    for col in range(1, len(headers) + 1):
+        max_len = 10
+        for row in range(1, ws.max_row + 1):
+            v = ws.cell(row=row, column=col).value
+            if v is not None:
+                max_len = max(max_len, len(str(v)))
+        ws.column_dimensions[get_column_letter(col)].width = min(max_len + 2, 60)
+    bio = BytesIO()
+    wb.save(bio)
+    return len(bio.getvalue())
+
+
+def streaming_export(pair_id: int, owner_user_id: int) -> int:
+    out, _ = write_wishlist_xlsx(iter_wishlist_export(pair_id, owner_user_id))
+    with out:
+        out.seek(0, os.SEEK_END)
+        return out.tell()
+
+
+def measure(name: str, fn, pair_id: int, user_id: int) -> None:
+    # время и память — отдельными прогонами: tracemalloc сильно замедляет код
+    t0 = time.perf_counter()
+    size = fn(pair_id, user_id)
+    elapsed = time.perf_counter() - t0
+
+    tracemalloc.start()
+    fn(pair_id, user_id)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  {name:<10} {elapsed:7.2f} s  peak={peak / 1024 / 1024:7.1f} MiB  file={size / 1024:8.0f} KiB")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark wishlist XLSX export")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--skip-legacy", action="store_true", help="only the streaming export")
+    args = parser.parse_args()
+
+    init_pool()
+    try:
+        for size in args.sizes:
+            user_id, pair_id = seed(size)
+            print(f"items={size}")
+            measure("streaming", streaming_export, pair_id, user_id)
+            if not args.skip_legacy:
+                measure("legacy", legacy_export, pair_id, user_id)
+    finally:
+        cleanup()
+
+
+if __name__ == "__main__":
+    main()
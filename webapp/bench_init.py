@@ -0,0 +1,130 @@
+# webapp/bench_init.py
+"""
+Бенчмарк /api/init: один SQL-запрос (build_init_payload) против старого пути
+с отдельными запросами (build_init_payload_multi).
+
+Засевает в БД из окружения (DB_NAME и т.д.) тестовую пару с вишлистами
+и заметками, прогоняет оба варианта в unit of work (как в реальном запросе)
+и печатает задержки. После прогона тестовые данные удаляются.
+
+    python webapp/bench_init.py --items 200 --notes 100 --runs 300
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.append(BASE_DIR)
+
+from webapp.app import build_init_payload, build_init_payload_multi  # noqa: E402
+from tgbot.db import execute, execute_returning_one, init_pool, unit_of_work  # noqa: E402
+from tgbot.services import _pair_cache, _pair_id_by_user  # noqa: E402
+
+# Диапазон telegram_id, который не пересекается с настоящими пользователями
+BENCH_TG_ID = 9_000_000_000
+
+
+def seed(items: int, notes: int):
+    users = []
+    for i in range(2):
+        row = execute_returning_one(
+            """
+            INSERT INTO users (telegram_id, username, first_name)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (telegram_id) DO UPDATE SET username = EXCLUDED.username
+            RETURNING id
+            """,
+            (BENCH_TG_ID + i, f"bench{i}", f"Bench {i}"),
+        )
+        users.append(row["id"])
+
+    execute("DELETE FROM pairs WHERE creator_user_id = ANY(%s) OR partner_user_id = ANY(%s)", (users, users))
+    pair = execute_returning_one(
+        """
+        INSERT INTO pairs (creator_user_id, partner_user_id, invite_token, start_date)
+        VALUES (%s, %s, %s, '2021-02-14')
+        RETURNING id
+        """,
+        (users[0], users[1], f"bench-{time.time_ns()}"),
+    )
+    pair_id = pair["id"]
+
+    for owner in users:
+        execute(
+            """
+            INSERT INTO wishlist_items (pair_id, owner_user_id, title, url, priority)
+            SELECT %s, %s, 'Желание ' || g, 'https://example.com/' || g,
+                   (ARRAY['high', 'medium', 'low'])[1 + g %% 3]
+            FROM generate_series(1, %s) g
+            """,
+            (pair_id, owner, items),
+        )
+    execute(
+        """
+        INSERT INTO notes (pair_id, author_user_id, text)
+        SELECT %s, (ARRAY[%s, %s])[1 + g %% 2], 'Заметка ' || g
+        FROM generate_series(1, %s) g
+        """,
+        (pair_id, users[0], users[1], notes),
+    )
+    return users, pair_id
+
+
+def cleanup(users) -> None:
+    execute("DELETE FROM users WHERE id = ANY(%s)", (users,))
+
+
+def measure(fn, user_id: int, runs: int, cold_cache: bool):
+    timings = []
+    for _ in range(runs):
+        if cold_cache:
+            _pair_cache.clear()
+            _pair_id_by_user.clear()
+        t0 = time.perf_counter()
+        with unit_of_work():
+            fn(user_id)
+        timings.append((time.perf_counter() - t0) * 1000)
+    return timings
+
+
+def report(name: str, timings) -> None:
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(
+        f"{name:<28} mean={statistics.mean(timings):7.2f} ms  "
+        f"p50={statistics.median(timings):7.2f} ms  p95={p95:7.2f} ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark /api/init data paths")
+    parser.add_argument("--items", type=int, default=200, help="wishlist items per partner")
+    parser.add_argument("--notes", type=int, default=100)
+    parser.add_argument("--runs", type=int, default=300)
+    args = parser.parse_args()
+
+    init_pool()
+    users, _ = seed(args.items, args.notes)
+    try:
+        user_id = users[0]
+        # прогрев
+        measure(build_init_payload, user_id, 10, cold_cache=True)
+        measure(build_init_payload_multi, user_id, 10, cold_cache=True)
+
+        print(f"items/partner={args.items} notes={args.notes} runs={args.runs}")
+        for cold in (True, False):
+            label = "cold pair cache" if cold else "warm pair cache"
+            report(f"single query ({label})", measure(build_init_payload, user_id, args.runs, cold))
+            report(f"multi query ({label})", measure(build_init_payload_multi, user_id, args.runs, cold))
+    finally:
+        cleanup(users)
+
+
+if __name__ == "__main__":
+    main()
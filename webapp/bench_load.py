@@ -0,0 +1,192 @@
+# webapp/bench_load.py
+"""
+Нагрузочный тест вебаппа: много одновременных сессий Mini App.
+
+Каждая сессия держит открытым SSE /api/events (как настоящее Mini App)
+и в цикле делает запросы: /api/sync, /api/batch, /api/init с ETag. Скрипт
+засевает --sessions пар, выдаёт им токены сессии (нужен тот же SESSION_SECRET,
+что у сервера), гоняет нагрузку --duration секунд, печатает RPS, ошибки,
+перцентили задержек и число подключившихся SSE, затем удаляет данные.
+
+Сравнение режимов — один и тот же прогон против двух серверов:
+
+    SESSION_SECRET=bench gunicorn -w 1 --threads 32 -b :8000 webapp.app:app
+    SESSION_SECRET=bench uvicorn webapp.asgi:application --port 8001
+
+    SESSION_SECRET=bench python webapp/bench_load.py --url http://127.0.0.1:8000 --sessions 200
+    SESSION_SECRET=bench python webapp/bench_load.py --url http://127.0.0.1:8001 --sessions 200
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.append(BASE_DIR)
+
+from tgbot.db import execute, execute_returning_all, execute_returning_one, init_pool  # noqa: E402
+from webapp.auth import issue_session  # noqa: E402
+
+# Диапазон telegram_id, который не пересекается с настоящими пользователями
+BENCH_TG_ID = 9_000_100_000
+ITEMS_PER_USER = 20
+
+
+def seed(sessions: int):
+    """Пары с желаниями; возвращает [(user_id, pair_id, [item_id, ...])]."""
+    cleanup()
+    result = []
+    for i in range(sessions):
+        users = execute_returning_all(
+            """
+            INSERT INTO users (telegram_id, username, first_name)
+            VALUES (%s, 'bench_load', 'A'), (%s, 'bench_load', 'B')
+            RETURNING id
+            """,
+            (BENCH_TG_ID + 2 * i, BENCH_TG_ID + 2 * i + 1),
+        )
+        a, b = users[0]["id"], users[1]["id"]
+        pair = execute_returning_one(
+            "INSERT INTO pairs (creator_user_id, partner_user_id, invite_token) VALUES (%s, %s, %s) RETURNING id",
+            (a, b, f"bench-load-{i}-{time.time_ns()}"),
+        )
+        items = execute_returning_all(
+            """
+            INSERT INTO wishlist_items (pair_id, owner_user_id, title)
+            SELECT %s, %s, 'Желание ' || g FROM generate_series(1, %s) g
+            RETURNING id
+            """,
+            (pair["id"], a, ITEMS_PER_USER),
+        )
+        result.append((a, pair["id"], [r["id"] for r in items]))
+    return result
+
+
+def cleanup() -> None:
+    execute(
+        "DELETE FROM users WHERE telegram_id BETWEEN %s AND %s",
+        (BENCH_TG_ID, BENCH_TG_ID + 1_000_000),
+    )
+
+
+class Stats:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.sse_connected = 0
+        self.sse_events = 0
+
+    def record(self, op: str, seconds: float, ok: bool) -> None:
+        with self.lock:
+            self.latencies[op].append(seconds)
+            if not ok:
+                self.errors[op] += 1
+
+
+def percentile(values, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def listen_events(url: str, token: str, stats: Stats, stop: threading.Event) -> None:
+    try:
+        with requests.get(f"{url}/api/events", params={"session": token}, stream=True, timeout=(10, 60)) as resp:
+            if resp.status_code != 200:
+                return
+            with stats.lock:
+                stats.sse_connected += 1
+            for line in resp.iter_lines():
+                if stop.is_set():
+                    return
+                if line.startswith(b"event: change"):
+                    with stats.lock:
+                        stats.sse_events += 1
+    except requests.RequestException:
+        pass
+
+
+def run_session(url: str, token: str, items, stats: Stats, stop: threading.Event, think: float) -> None:
+    http = requests.Session()
+    http.headers["Authorization"] = f"Bearer {token}"
+    etag = None
+    version = 1
+    while not stop.is_set():
+        roll = random.random()
+        if roll < 0.5:
+            op, path, body, headers = "sync", f"/api/sync?since={version}", {}, {}
+        elif roll < 0.8:
+            op, path, headers = "batch", "/api/batch", {}
+            body = {"ops": [{"op": "wishlist/toggle_done", "item_id": random.choice(items), "done": random.random() < 0.5}]}
+        else:
+            op, path, body = "init", "/api/init", {}
+            headers = {"If-None-Match": etag} if etag else {}
+
+        t0 = time.perf_counter()
+        try:
+            resp = http.post(url + path, json=body, headers=headers, timeout=30)
+            data = resp.json()
+            ok = resp.status_code == 200 and data.get("ok", False)
+        except (requests.RequestException, ValueError):
+            ok, data = False, {}
+        stats.record(op, time.perf_counter() - t0, ok)
+
+        if ok and op in ("sync", "init") and data.get("etag"):
+            etag = data["etag"]
+            version = (data.get("pair") or {}).get("version", version)
+        stop.wait(random.uniform(0, 2 * think))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test the webapp with concurrent Mini App sessions")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--think", type=float, default=0.2, help="mean pause between requests of one session, s")
+    parser.add_argument("--no-sse", action="store_true", help="do not hold /api/events connections")
+    args = parser.parse_args()
+
+    init_pool()
+    try:
+        sessions = seed(args.sessions)
+        stats = Stats()
+        stop = threading.Event()
+        threads = []
+        for user_id, pair_id, items in sessions:
+            token = issue_session(user_id, pair_id)
+            if not args.no_sse:
+                threads.append(threading.Thread(target=listen_events, args=(args.url, token, stats, stop), daemon=True))
+            threads.append(threading.Thread(
+                target=run_session, args=(args.url, token, items, stats, stop, args.think), daemon=True
+            ))
+        for t in threads:
+            t.start()
+        time.sleep(args.duration)
+        stop.set()
+        time.sleep(1)
+
+        total = sum(len(v) for v in stats.latencies.values())
+        print(f"url={args.url} sessions={args.sessions} duration={args.duration:.0f}s")
+        print(f"  requests={total}  rps={total / args.duration:.0f}  errors={sum(stats.errors.values())}")
+        print(f"  sse connected={stats.sse_connected}/{0 if args.no_sse else args.sessions}  change events={stats.sse_events}")
+        for op, values in sorted(stats.latencies.items()):
+            print(
+                f"  {op:<6} n={len(values):6d}  p50={percentile(values, 0.5) * 1000:7.1f} ms"
+                f"  p95={percentile(values, 0.95) * 1000:7.1f} ms  p99={percentile(values, 0.99) * 1000:7.1f} ms"
+                f"  errors={stats.errors[op]}"
+            )
+    finally:
+        cleanup()
+
+
+if __name__ == "__main__":
+    main()
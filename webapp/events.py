@@ -0,0 +1,308 @@
+# webapp/events.py
+"""
+Живые обновления Mini App: Server-Sent Events по паре (/api/events).
+
+Источник событий — NOTIFY-триггеры (tgbot/changes.py): они срабатывают после
+COMMIT любой записи в pairs / wishlist_items / notes — из эндпоинтов вебаппа,
+хэндлеров бота или нотифаера. Слушатель процесса только ставит событие
+наблюдаемой пары в очередь: тот же поток инвалидирует кэши, и запрос к БД
+в нём задерживал бы их. Изменённую строку читает отдельный поток хаба —
+один раз на событие; он же один раз форматирует SSE-сообщение и раскладывает
+его по очередям подписчиков этой пары.
+
+Подписчик — это только очередь в памяти: соединение с БД он не держит
+и ничего не опрашивает, пока событий нет. Соединение спит на очереди
+и раз в SSE_HEARTBEAT секунд шлёт комментарий-пинг, чтобы прокси не рвали
+простаивающее соединение (и чтобы заметить отключившегося клиента).
+Во Flask-режиме «спит» поток сервера: каждое открытое Mini App занимает
+поток воркера на всё время соединения, поэтому число открытых приложений
+ограничено потоками (гринлетами) сервера. В ASGI-режиме (webapp/asgi.py)
+соединение — корутина, и простаивающие подключения действительно дешёвы.
+
+У каждого события id вида "<boot>-<seq>". Последние события пары хранятся
+в памяти, и при переподключении с Last-Event-ID клиент получает пропущенное.
+Если пропущенного уже нет (другой процесс, перезапуск, старый id) —
+приходит событие reset, и клиент догружает изменения через /api/sync.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+from collections import deque
+from typing import Any, Dict, List, Optional, Set
+
+from tgbot.cache import TTLCache  # type: ignore
+from tgbot.changes import subscribe, subscribe_reset  # type: ignore
+from tgbot.services import get_changed_row  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+SSE_HEARTBEAT = float(os.getenv("SSE_HEARTBEAT", "15"))
+# Сколько последних событий пары хранить для переподключения и сколько времени
+SSE_BACKLOG_SIZE = int(os.getenv("SSE_BACKLOG_SIZE", "100"))
+SSE_BACKLOG_TTL = float(os.getenv("SSE_BACKLOG_TTL", "300"))
+# Очередь медленного клиента; при переполнении он получит reset
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "100"))
+# Через сколько мс браузер переподключается после обрыва
+SSE_RETRY_MS = int(os.getenv("SSE_RETRY_MS", "3000"))
+# Событий, ждущих чтения строки; при переполнении все подписчики получат reset
+SSE_FETCH_QUEUE_SIZE = int(os.getenv("SSE_FETCH_QUEUE_SIZE", "10000"))
+
+RESET_MESSAGE = "event: reset\ndata: {}\n\n"
+
+
+def format_sse(event_id: str, event_type: str, data: Dict[str, Any]) -> str:
+    return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class Subscription:
+    """Одно SSE-соединение: очередь готовых сообщений."""
+
+    def __init__(self, pair_id: int) -> None:
+        self.pair_id = pair_id
+        self.queue: "queue.Queue[str]" = queue.Queue(SSE_QUEUE_SIZE)
+        self.overflowed = False
+
+    def put(self, message: str) -> None:
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout: float) -> Optional[str]:
+        """Следующее сообщение; None — за timeout ничего не пришло."""
+        try:
+            message = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if self.overflowed:
+            # клиент не успевал читать и часть событий потерял
+            self.overflowed = False
+            with self.queue.mutex:
+                self.queue.queue.clear()
+            return RESET_MESSAGE
+        return message
+
+
+class AsyncSubscription(Subscription):
+    """
+    Подписка для ASGI-режима (webapp/asgi.py): сообщения из потока слушателя
+    NOTIFY передаются в очередь asyncio через event loop соединения.
+    """
+
+    def __init__(self, pair_id: int, loop: asyncio.AbstractEventLoop) -> None:
+        self.pair_id = pair_id
+        self.loop = loop
+        self.queue: "asyncio.Queue[str]" = asyncio.Queue(SSE_QUEUE_SIZE)
+        self.overflowed = False
+
+    def put(self, message: str) -> None:
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # event loop уже остановлен
+            pass
+
+    def _put(self, message: str) -> None:
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout: float) -> Optional[str]:
+        try:
+            message = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if self.overflowed:
+            self.overflowed = False
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            return RESET_MESSAGE
+        return message
+
+
+class _Backlog:
+    """Последние сообщения пары и граница, начиная с которой они полные."""
+
+    def __init__(self, start_seq: int) -> None:
+        # события с seq > complete_after хранятся все (пока не вытеснены)
+        self.complete_after = start_seq
+        self.messages: deque = deque()
+
+    def append(self, seq: int, message: str) -> None:
+        self.messages.append((seq, message))
+        while len(self.messages) > SSE_BACKLOG_SIZE:
+            self.complete_after = self.messages.popleft()[0]
+
+
+class EventHub:
+    """Раздача событий пар подписчикам текущего процесса."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._subscribers: Dict[int, Set[Subscription]] = {}
+        # pair_id -> _Backlog; пары без подписчиков вытесняются по TTL
+        self._backlog = TTLCache(10000, SSE_BACKLOG_TTL)
+        self._boot = secrets.token_hex(4)
+        self._seq = itertools.count(1)
+        self._last_seq = 0
+
+    def subscribe(self, pair_id: int, last_event_id: Optional[str] = None, sub: Optional[Subscription] = None):
+        """
+        Подписаться на события пары. Возвращает (подписка, пропущенные сообщения);
+        пропущенные = None, если восстановить их нельзя и клиенту нужен reset.
+        Регистрация и выборка пропущенного идут под одной блокировкой,
+        поэтому событие не потеряется и не придёт дважды.
+        sub — готовая подписка (AsyncSubscription), по умолчанию потоковая.
+        """
+        if sub is None:
+            sub = Subscription(pair_id)
+        with self._lock:
+            self._subscribers.setdefault(pair_id, set()).add(sub)
+            backlog = self._backlog.get(pair_id)
+            if backlog is None:
+                backlog = _Backlog(self._last_seq)
+                self._backlog.set(pair_id, backlog)
+            missed = self._missed(backlog, last_event_id) if last_event_id else []
+        return sub, missed
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            subs = self._subscribers.get(sub.pair_id)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subscribers[sub.pair_id]
+
+    def is_watched(self, pair_id: int) -> bool:
+        """Есть подписчики или недавно были (их события нужны для переподключения)."""
+        with self._lock:
+            return pair_id in self._subscribers or self._backlog.get(pair_id) is not None
+
+    def publish(self, pair_id: int, event_type: str, data: Dict[str, Any]) -> None:
+        with self._lock:
+            seq = self._last_seq = next(self._seq)
+            message = format_sse(f"{self._boot}-{seq}", event_type, data)
+            backlog = self._backlog.get(pair_id)
+            if backlog is None:
+                backlog = _Backlog(seq - 1)
+            backlog.append(seq, message)
+            self._backlog.set(pair_id, backlog)
+            subs = list(self._subscribers.get(pair_id, ()))
+        for sub in subs:
+            sub.put(message)
+
+    def reset_pair(self, pair_id: int) -> None:
+        """Событие пары потеряно — её подписчикам reset, переподключению тоже."""
+        with self._lock:
+            self._backlog.pop(pair_id)
+            subs = list(self._subscribers.get(pair_id, ()))
+        for sub in subs:
+            sub.put(RESET_MESSAGE)
+
+    def reset_all(self) -> None:
+        """События могли потеряться (слушатель переподключался) — всем reset."""
+        with self._lock:
+            self._backlog.clear()
+            subs = [sub for subs in self._subscribers.values() for sub in subs]
+        for sub in subs:
+            sub.put(RESET_MESSAGE)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "pairs": len(self._subscribers),
+                "connections": sum(len(s) for s in self._subscribers.values()),
+            }
+
+    def _missed(self, backlog: _Backlog, last_event_id: str) -> Optional[List[str]]:
+        boot, _, seq = last_event_id.partition("-")
+        if boot != self._boot or not seq.isdigit():
+            return None
+        seq = int(seq)
+        if seq < backlog.complete_after:
+            # часть пропущенного уже вытеснена или не записывалась
+            return None
+        return [message for s, message in backlog.messages if s > seq]
+
+
+event_hub = EventHub()
+
+
+class _RowFetcher:
+    """
+    Поток, читающий изменённые строки для событий: запросы к БД не идут
+    в потоке слушателя NOTIFY. Один поток — события пары публикуются
+    в порядке коммитов.
+    """
+
+    def __init__(self) -> None:
+        self.queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(SSE_FETCH_QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def put(self, event: Dict[str, Any]) -> None:
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # БД не успевает за событиями: что-то потеряем — пусть догрузят через /api/sync
+            event_hub.reset_all()
+
+    def _ensure_started(self) -> None:
+        # после fork потока в дочернем процессе нет — запускаем свой
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._thread = threading.Thread(target=self._run, name="sse-row-fetcher", daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            event = self.queue.get()
+            pair_id = event["pair_id"]
+            entity = event["entity"]
+            try:
+                row = None if event.get("op") == "DELETE" else get_changed_row(entity, event["id"])
+            except Exception:
+                logger.exception("SSE row fetch failed for %s", event)
+                event_hub.reset_pair(pair_id)
+                continue
+            # строки нет — удалена (в том числе уже после этого INSERT/UPDATE)
+            event_hub.publish(pair_id, "change", {"entity": entity, "id": event["id"], "row": row})
+
+
+_row_fetcher = _RowFetcher()
+
+
+def _on_row_changed(event: Dict[str, Any]) -> None:
+    pair_id = event.get("pair_id")
+    if not pair_id or not event_hub.is_watched(pair_id):
+        return
+    _row_fetcher.put(event)
+
+
+def _on_pair_changed(event: Dict[str, Any]) -> None:
+    pair_id = event.get("pair_id")
+    if event.get("version_only") or not pair_id or not event_hub.is_watched(pair_id):
+        # рост версии сопровождает изменение вишлиста/заметок — о нём будет своё событие
+        return
+    event_hub.publish(pair_id, "change", {"entity": "pairs", "op": event.get("op")})
+
+
+subscribe("wishlist_items", _on_row_changed)
+subscribe("notes", _on_row_changed)
+subscribe("pairs", _on_pair_changed)
+subscribe_reset(event_hub.reset_all)
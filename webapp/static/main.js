@@ -987,13 +987,37 @@
 
   // === API-ХЕЛПЕР ===============================================
 
-  async function apiPost(path, payload) {
+  // Токен сессии: сервер выдаёт его (заголовок X-Session-Token) после проверки
+  // подписанной initData и дальше авторизует запросы по нему, без БД.
+  let sessionToken = null;
+
+  function authHeaders() {
+    return sessionToken
+      ? { Authorization: "Bearer " + sessionToken }
+      : { "X-Telegram-Init-Data": tg?.initData || "" };
+  }
+
+  async function apiPost(path, payload, extraHeaders) {
+    // точечные изменения копятся в очереди и уходят одним /api/batch
+    const batchOp = path.slice("/api/".length);
+    if (BATCH_OPS.has(batchOp) && !extraHeaders) {
+      return enqueueBatch(batchOp, payload);
+    }
+
+    const usedSession = !!sessionToken;
     const res = await fetch(path, {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
+      headers: {
+        "Content-Type": "application/json",
+        ...authHeaders(),
+        ...(extraHeaders || {}),
+      },
       body: JSON.stringify(payload),
     });
 
+    const issued = res.headers.get("X-Session-Token");
+    if (issued) sessionToken = issued;
+
     let data;
     try {
       data = await res.json();
@@ -1001,6 +1025,12 @@
       throw new Error("INVALID_JSON");
     }
 
+    // токен истёк — один повтор с initData, сервер выдаст новый
+    if (res.status === 401 && usedSession && data && data.error === "SESSION_EXPIRED") {
+      sessionToken = null;
+      return apiPost(path, payload, extraHeaders);
+    }
+
     // если backend не прислал ok — считаем, что всё ок, если HTTP-статус ok
     const okField =
       typeof data.ok === "undefined" ? true : !!data.ok;
@@ -1014,8 +1044,125 @@
     return data;
   }
 
+  // === ОЧЕРЕДЬ ИЗМЕНЕНИЙ =======================================
+
+  // Изменения, которые сервер принимает в /api/batch (см. MUTATIONS в app.py)
+  const BATCH_OPS = new Set([
+    "wishlist/delete",
+    "wishlist/set_link",
+    "wishlist/edit",
+    "wishlist/toggle_done",
+    "wishlist/set_priority",
+    "notes/delete",
+  ]);
+  const BATCH_DELAY_MS = 150;
+
+  let batchQueue = [];
+  let batchTimer = null;
+
+  function batchTarget(op) {
+    if (typeof op.item_id === "number") return "item:" + op.item_id;
+    if (typeof op.note_id === "number") return "note:" + op.note_id;
+    return null;
+  }
+
+  // Поставить изменение в очередь. Повтор того же изменения того же элемента
+  // заменяет ждущее (остаётся последнее значение), удаление поглощает все
+  // ждущие изменения элемента. Промис — результат операции на сервере.
+  function enqueueBatch(opName, payload) {
+    const { user: _user, ...fields } = payload || {};
+    const op = { op: opName, ...fields };
+    const isDelete = opName.endsWith("/delete");
+    const target = batchTarget(op);
+
+    return new Promise((resolve, reject) => {
+      const entry = { op, waiters: [{ resolve, reject }] };
+      if (target) {
+        batchQueue = batchQueue.filter((e) => {
+          const replaced =
+            batchTarget(e.op) === target && (isDelete || e.op.op === opName);
+          if (replaced) entry.waiters.push(...e.waiters);
+          return !replaced;
+        });
+      }
+      batchQueue.push(entry);
+
+      clearTimeout(batchTimer);
+      batchTimer = setTimeout(flushBatch, BATCH_DELAY_MS);
+    });
+  }
+
+  async function flushBatch() {
+    clearTimeout(batchTimer);
+    batchTimer = null;
+    const entries = batchQueue;
+    batchQueue = [];
+    if (!entries.length) return;
+
+    try {
+      const data = await apiPost("/api/batch", {
+        user,
+        ops: entries.map((e) => e.op),
+      });
+      entries.forEach((e, i) => {
+        const result = (data.results && data.results[i]) || {};
+        e.waiters.forEach((w) =>
+          result.ok ? w.resolve(result) : w.reject(new Error(result.error || "BATCH_FAILED"))
+        );
+      });
+    } catch (err) {
+      entries.forEach((e) => e.waiters.forEach((w) => w.reject(err)));
+    }
+  }
+
   // === INIT =====================================================
 
+  // Последний ответ /api/init + его ETag: если на сервере ничего не менялось,
+  // он ответит not_modified, и состояние берём отсюда.
+  const INIT_CACHE_KEY = "fambot_init_" + (user ? user.id : "anon");
+
+  function loadInitCache() {
+    try {
+      const raw = localStorage.getItem(INIT_CACHE_KEY);
+      return raw ? JSON.parse(raw) : null;
+    } catch (e) {
+      return null;
+    }
+  }
+
+  function saveInitCache(data) {
+    try {
+      if (data.etag) {
+        localStorage.setItem(INIT_CACHE_KEY, JSON.stringify(data));
+      } else {
+        localStorage.removeItem(INIT_CACHE_KEY);
+      }
+    } catch (e) {
+      // ignore
+    }
+  }
+
+  function applyInitData(data) {
+    state.user_id = data.user_id;
+    state.has_pair = data.has_pair;
+    state.pair = data.pair;
+    state.partner = data.partner;
+    state.my_wishlist = data.my_wishlist || [];
+    state.partner_wishlist = data.partner_wishlist || [];
+    state.notes = data.notes || [];
+
+    if (myListBlock && partnerListBlock) {
+      myListBlock.classList.add("hidden");
+      partnerListBlock.classList.remove("hidden");
+    }
+    renderTabs();
+    renderPairBlock();
+    renderWishlist();
+    renderNotes();
+    renderTabs();
+    connectEvents();
+  }
+
   async function init() {
     if (!user) {
       showError("Не удалось получить пользователя из Telegram WebApp API.");
@@ -1023,29 +1170,174 @@
     }
 
     try {
-      const data = await apiPost("/api/init", { user });
-      state.has_pair = data.has_pair;
-      state.pair = data.pair;
-      state.partner = data.partner;
-      state.my_wishlist = data.my_wishlist || [];
-      state.partner_wishlist = data.partner_wishlist || [];
-      state.notes = data.notes || [];
-
-      if (myListBlock && partnerListBlock) {
-        myListBlock.classList.add("hidden");
-        partnerListBlock.classList.remove("hidden");
+      const cached = loadInitCache();
+
+      // Есть сохранённый снимок с версией пары — показываем его сразу
+      // и догружаем только изменения через /api/sync.
+      if (cached && cached.has_pair && cached.pair && cached.pair.version) {
+        state.etag = cached.etag;
+        applyInitData(cached);
+        if (await sync()) return;
       }
-      renderTabs();
-      renderPairBlock();
-      renderWishlist();
-      renderNotes();
-      renderTabs();
+
+      const headers = cached && cached.etag ? { "If-None-Match": cached.etag } : {};
+      let data = await apiPost("/api/init", { user }, headers);
+      if (data.not_modified && cached) {
+        data = cached;
+      } else {
+        saveInitCache(data);
+      }
+      state.etag = data.etag;
+      applyInitData(data);
     } catch (e) {
       console.error(e);
       showError("Ошибка инициализации: " + e.message);
     }
   }
 
+  // === ДЕЛЬТА-СИНХРОНИЗАЦИЯ =====================================
+
+  // Применить к списку изменения: убрать удалённые id, заменить/добавить upserts.
+  function mergeById(list, upserts, deleted) {
+    const gone = new Set(deleted || []);
+    const byId = new Map();
+    (list || []).forEach((x) => {
+      if (!gone.has(x.id)) byId.set(x.id, x);
+    });
+    (upserts || []).forEach((x) => byId.set(x.id, x));
+    return Array.from(byId.values());
+  }
+
+  // Догрузить изменения с версии state.pair.version.
+  // true — состояние актуально; false — нужна полная загрузка через init().
+  async function sync() {
+    if (!state.has_pair || !state.pair || !state.pair.version) return false;
+
+    let data;
+    try {
+      data = await apiPost(
+        "/api/sync?since=" + encodeURIComponent(state.pair.version),
+        { user }
+      );
+    } catch (e) {
+      console.error(e);
+      return false;
+    }
+    if (!data.has_pair || data.reset) return false;
+
+    state.pair = data.pair;
+    state.my_wishlist = mergeById(
+      state.my_wishlist,
+      data.my_wishlist.upserts,
+      data.my_wishlist.deleted
+    );
+    state.partner_wishlist = mergeById(
+      state.partner_wishlist,
+      data.partner_wishlist.upserts,
+      data.partner_wishlist.deleted
+    );
+    state.notes = mergeById(state.notes, data.notes.upserts, data.notes.deleted);
+    state.notes.sort((a, b) => (b.created_at || "").localeCompare(a.created_at || ""));
+
+    renderPairBlock();
+    renderWishlist();
+    renderNotes();
+
+    state.etag = data.etag;
+    saveStateSnapshot();
+    connectEvents();
+    return true;
+  }
+
+  // Сохранить текущее состояние как снимок для следующего открытия.
+  function saveStateSnapshot() {
+    if (!state.has_pair || !state.etag) return;
+    saveInitCache({
+      ok: true,
+      has_pair: true,
+      user_id: state.user_id,
+      etag: state.etag,
+      pair: state.pair,
+      partner: state.partner,
+      my_wishlist: state.my_wishlist,
+      partner_wishlist: state.partner_wishlist,
+      notes: state.notes,
+    });
+  }
+
+  // === ЖИВЫЕ ОБНОВЛЕНИЯ (SSE) ===================================
+
+  // Поток /api/events: изменения партнёра (и свои с других устройств)
+  // приходят сразу. Переподключение с Last-Event-ID браузер делает сам.
+  let eventSource = null;
+
+  function connectEvents() {
+    if (!window.EventSource || !user) return;
+    if (!state.has_pair) {
+      if (eventSource) eventSource.close();
+      eventSource = null;
+      return;
+    }
+    // без токена подключимся после первого запроса к API (init / sync)
+    if (eventSource || !sessionToken) return;
+
+    eventSource = new EventSource("/api/events?session=" + encodeURIComponent(sessionToken));
+    eventSource.addEventListener("error", async () => {
+      // сервер отказал (например, истёк токен) — браузер сам не переподключится
+      if (!eventSource || eventSource.readyState !== EventSource.CLOSED) return;
+      eventSource = null;
+      if (!(await sync())) init();
+    });
+    eventSource.addEventListener("change", (e) => {
+      try {
+        applyChangeEvent(JSON.parse(e.data));
+      } catch (err) {
+        console.error(err);
+      }
+    });
+    eventSource.addEventListener("reset", async () => {
+      if (!(await sync())) init();
+    });
+  }
+
+  function applyChangeEvent(ev) {
+    if (ev.entity === "wishlist_items") {
+      const row = ev.row;
+      const gone = row ? [] : [ev.id];
+      const mine = row && row.owner_user_id === state.user_id;
+      state.my_wishlist = mergeById(state.my_wishlist, mine ? [row] : [], gone);
+      state.partner_wishlist = mergeById(
+        state.partner_wishlist,
+        row && !mine ? [row] : [],
+        gone
+      );
+      renderWishlist();
+    } else if (ev.entity === "notes") {
+      const row = ev.row ? { ...ev.row, is_mine: ev.row.author_user_id === state.user_id } : null;
+      state.notes = mergeById(state.notes, row ? [row] : [], row ? [] : [ev.id]);
+      state.notes.sort((a, b) => (b.created_at || "").localeCompare(a.created_at || ""));
+      renderNotes();
+    } else if (ev.entity === "pairs") {
+      // дата, ссылка, алиас или сама пара: берём блок пары через /api/sync
+      sync().then((ok) => {
+        if (!ok) init();
+      });
+      return;
+    }
+    saveStateSnapshot();
+  }
+
+  // Вернулись в приложение — подтягиваем только изменения, без полной init().
+  document.addEventListener("visibilitychange", async () => {
+    if (document.hidden) {
+      // уходим из приложения — не держим изменения в очереди
+      flushBatch();
+      return;
+    }
+    if (!state.has_pair) return;
+    if (!(await sync())) init();
+  });
+
   // === ОБРАБОТЧИКИ UI ==========================================
 
   if (tabMy && myListBlock && partnerListBlock) {